@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""Benchmarks parsing lines received from the server.
+
+Compares how CardinalBot.lineReceived used to handle a line (splitting it to
+find the command, letting Twisted parse it again, and then matching the user
+regex in the handler) with parsing it once into a Message.
+
+Usage: python benchmarks/line_parsing.py [runs]
+"""
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                '..'))
+
+from twisted.words.protocols import irc  # noqa: E402
+
+from cardinal.message import Message  # noqa: E402
+
+# A sample of what a busy network sends, mostly channel messages
+LINES = [
+    ":nick!ident@host.example.com PRIVMSG #channel :hey, anyone around?",
+    ":other!~other@user/other PRIVMSG #channel :yeah what's up",
+    ":nick!ident@host.example.com PRIVMSG #channel :!weather London",
+    ":third!third@192.0.2.1 PRIVMSG #other :lol",
+    ":other!~other@user/other PRIVMSG Cardinal :.help",
+    ":joiner!joiner@joiner.example.net JOIN #channel",
+    ":parter!parter@parter.example.net PART #channel :Leaving",
+    ":quitter!quitter@quit.example.net QUIT :Ping timeout: 240 seconds",
+    ":op!op@op.example.com MODE #channel +o nick",
+    ":irc.example.org 353 Cardinal = #channel :Cardinal @op +voice nick",
+    "PING :irc.example.org",
+]
+
+USER_REGEX = re.compile(r'^(.*?)!(.*?)@(.*?)$')
+
+
+def before(line):
+    # CardinalBot.lineReceived finding the command for irc.raw
+    parts = line.split(' ')
+    parts[1]
+
+    # IRCClient.lineReceived
+    line = irc.lowDequote(line)
+    prefix, command, params = irc.parsemsg(line)
+    command = irc.numeric_to_symbolic.get(command, command)
+
+    # The irc_* handler
+    if '!' in prefix:
+        re.match(USER_REGEX, prefix)
+
+
+def after(line):
+    message = Message(irc.lowDequote(line))
+    irc.numeric_to_symbolic.get(message.command, message.command)
+
+    if '!' in message.prefix:
+        message.user
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    lines = len(LINES) * runs
+    for name, parse in (("before", before), ("after", after)):
+        elapsed = timeit.timeit(lambda: [parse(line) for line in LINES],
+                                number=runs)
+        print "%-8s %12.0f lines/sec" % (name, lines / elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Benchmarks regex command dispatch as the number of regex commands grows.
+
+Compares testing every regex command against every message (as call_command
+used to) with RegexDispatcher, which only evaluates the commands whose
+required literal appears in the message. Some messages contain the literals
+of the synthetic commands, and not all of those match the full regex, so the
+cost of verifying candidates is included.
+
+Usage: python benchmarks/regex_dispatch.py [messages per run]
+"""
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                '..'))
+
+from cardinal.plugins import RegexDispatcher  # noqa: E402
+
+# A sample of ordinary channel traffic, most of which matches no command
+MESSAGES = [
+    "hey, did anyone see the game last night?",
+    "I think the build is broken again",
+    "lol",
+    "check out https://github.com/JohnMaguire/Cardinal for the bot",
+    "ping",
+    "!rules",
+    "can someone review my PR when they get a chance",
+    "brb, getting coffee",
+    "the quick brown fox jumps over the lazy dog",
+    "does anyone know how to configure twisted for ssl",
+]
+
+# Messages containing the literals of the synthetic commands. Some match the
+# full regex, while others only contain the literal, e.g. keyword12 contains
+# keyword1, and must be rejected once the regex is evaluated.
+MESSAGES += [
+    "keyword5 weather",
+    "could you try keyword42 tomorrow",
+    "keyword7!",
+    "keyword40x isn't a command",
+    "KEYWORD123 Status",
+    "is it keyword9, keyword99 or keyword249 today",
+]
+
+# Patterns shipped with the bundled plugins
+BUNDLED_PATTERNS = [
+    re.compile(r"(?:^|\s)((?:https?://)?(?:[a-z0-9.\-]+[.][a-z]{2,4}/?)"
+               r"(?:[^\s()<>]*|\((?:[^\s()<>]+|(?:\([^\s()<>]+\)))*\))+"
+               r"(?:\((?:[^\s()<>]+|(?:\([^\s()<>]+\)))*\)|"
+               r"[^\s`!()\[\]{};:\'\".,<>?]))",
+               flags=re.IGNORECASE | re.DOTALL),
+    re.compile(r'^!([^\s]+.*)'),
+    r'(?i)^ping[.?!]?$',
+]
+
+
+def make_commands(count):
+    """Returns `count` regex commands, starting with the bundled patterns."""
+    commands = []
+    for index in range(count):
+        if index < len(BUNDLED_PATTERNS):
+            pattern = BUNDLED_PATTERNS[index]
+        else:
+            # Precompiled, so that the naive approach isn't penalised by
+            # overflowing the re module's pattern cache
+            pattern = re.compile(r'(?i)\bkeyword%d\b\s+(\w+)' % index)
+
+        def command(*args):
+            pass
+        command.regex = pattern
+
+        commands.append(('plugin%d' % index, command))
+
+    return commands
+
+
+def naive_dispatch(commands, message):
+    return [(name, command) for name, command in commands
+            if re.search(command.regex, message)]
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    print "%8s %16s %16s" % ("commands", "naive (us/msg)", "indexed (us/msg)")
+    for count in (3, 10, 50, 100, 250, 500):
+        commands = make_commands(count)
+        dispatcher = RegexDispatcher(commands)
+
+        # Sanity check that both approaches agree
+        for message in MESSAGES:
+            assert naive_dispatch(commands, message) == \
+                dispatcher.match(message)
+
+        naive = timeit.timeit(
+            lambda: [naive_dispatch(commands, m) for m in MESSAGES],
+            number=runs)
+        indexed = timeit.timeit(
+            lambda: [dispatcher.match(m) for m in MESSAGES],
+            number=runs)
+
+        per_message = 1000000.0 / (runs * len(MESSAGES))
+        print "%8d %16.2f %16.2f" % (count,
+                                     naive * per_message,
+                                     indexed * per_message)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,14 @@ from twisted.internet import reactor
 
 from cardinal.config import ConfigParser, ConfigSpec
 from cardinal.bot import CardinalBotFactory
+from cardinal.networks import NetworkManager, network_configs
+from cardinal.supervisor import (
+    PASSWORD_ENVIRONMENT_VARIABLE,
+    StatsReporter,
+    Supervisor,
+    assign_networks,
+    worker_logging_config,
+)
 
 if __name__ == "__main__":
 
@@ -54,6 +62,15 @@ https://github.com/JohnMaguire/Cardinal
     arg_parser.add_argument('--config', metavar='config',
                             help='custom config location')
 
+    arg_parser.add_argument('-w', '--workers', type=int, metavar='workers',
+                            help='split networks between this many worker '
+                                 'processes, run by a supervisor')
+
+    # Used by the supervisor to start workers
+    arg_parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    arg_parser.add_argument('--worker-networks', help=argparse.SUPPRESS)
+    arg_parser.add_argument('--stats-socket', help=argparse.SUPPRESS)
+
     # Define the config spec and create a parser for our internal config
     spec = ConfigSpec()
     spec.add_option('nickname', basestring, 'Cardinal')
@@ -82,6 +99,13 @@ https://github.com/JohnMaguire/Cardinal
         'urbandict'
     ])
     spec.add_option('logging', dict, None)
+    spec.add_option('thread_pools', dict, None)
+    spec.add_option('timeouts', dict, None)
+    spec.add_option('rate_limits', dict, None)
+    spec.add_option('send_queue', dict, None)
+    spec.add_option('networks', list, None)
+    spec.add_option('shared_plugins', list, [])
+    spec.add_option('workers', int, 1)
 
     parser = ConfigParser(spec)
 
@@ -105,8 +129,11 @@ https://github.com/JohnMaguire/Cardinal
     if not args.ssl:
         args.ssl = None
 
-    # If the password flag was set, let the user safely type in their password
-    if args.password:
+    # If the password flag was set, let the user safely type in their password.
+    # Workers are given the password the supervisor was.
+    if args.worker is not None:
+        args.password = os.environ.get(PASSWORD_ENVIRONMENT_VARIABLE)
+    elif args.password:
         args.password = getpass('NickServ password: ')
     else:
         args.password = None
@@ -116,7 +143,11 @@ https://github.com/JohnMaguire/Cardinal
 
     # If user defined logging config, use it, otherwise use default
     if config['logging'] is not None:
-        logging.config.dictConfig(config['logging'])
+        if args.worker is not None:
+            logging.config.dictConfig(
+                worker_logging_config(config['logging'], args.worker))
+        else:
+            logging.config.dictConfig(config['logging'])
     else:
         # Set default log level to INFO and get some pretty formatting
         logging.basicConfig(
@@ -153,31 +184,70 @@ https://github.com/JohnMaguire/Cardinal
 
                 os.makedirs(directory)
 
-    # Instance a new factory, and connect with/without SSL
-    logger.debug("Instantiating CardinalBotFactory")
-    factory = CardinalBotFactory(config['network'], config['server_password'],
-                                 config['channels'],
-                                 config['nickname'], config['password'],
-                                 config['plugins'],
-                                 storage_path)
-
-    if not config['ssl']:
-        logger.info(
-            "Connecting over plaintext to %s:%d" %
-            (config['network'], config['port'])
-        )
+    configs = network_configs(config)
 
-        reactor.connectTCP(config['network'], config['port'], factory)
-    else:
-        logger.info(
-            "Connecting over SSL to %s:%d" %
-            (config['network'], config['port'])
+    # Split the networks between worker processes, each of which runs this
+    # script again with only its own networks
+    if args.worker is None and config['workers'] > 1:
+        if storage_path is not None:
+            socket_path = os.path.join(storage_path, 'supervisor.sock')
+        else:
+            socket_path = os.path.join(
+                os.path.dirname(os.path.realpath(__file__)),
+                'cardinal-supervisor.sock'
+            )
+
+        environment = {}
+        if args.password is not None:
+            environment[PASSWORD_ENVIRONMENT_VARIABLE] = args.password
+
+        command = [sys.executable, os.path.realpath(__file__)] + \
+            [arg for arg in sys.argv[1:] if arg != '--password']
+
+        supervisor = Supervisor(
+            command,
+            assign_networks([network['name'] for network in configs],
+                            config['workers']),
+            socket_path,
+            environment
         )
 
-        # For SSL, we need to import the SSL module from Twisted
-        from twisted.internet import ssl
-        reactor.connectSSL(config['network'], config['port'], factory,
-                           ssl.ClientContextFactory())
+        reactor.callWhenRunning(supervisor.start)
+        reactor.callWhenRunning(supervisor.install_signal_handlers)
+        reactor.run()
+
+        sys.exit()
+
+    if args.worker_networks is not None:
+        names = args.worker_networks.split(',')
+        configs = [network for network in configs if network['name'] in names]
+
+    # Each network gets its own factory, all running on the same reactor
+    networks = NetworkManager(config['shared_plugins'])
+    for network in configs:
+        logger.debug("Instantiating CardinalBotFactory for %s",
+                     network['name'])
+        factory = CardinalBotFactory(network['network'],
+                                     network['server_password'],
+                                     network['channels'],
+                                     network['nickname'],
+                                     network['password'],
+                                     network['plugins'],
+                                     storage_path,
+                                     config['thread_pools'],
+                                     config['timeouts'],
+                                     config['rate_limits'],
+                                     network['send_queue'],
+                                     network['name'])
+
+        networks.add(factory)
+        networks.connect(factory, network['port'], network['ssl'])
+
+    networks.install_signal_handlers()
+
+    # Workers report their stats to the supervisor
+    if args.stats_socket is not None:
+        StatsReporter(args.stats_socket, args.worker, networks).start()
 
     # Run the Twisted reactor
     reactor.run()
@@ -0,0 +1,84 @@
+import threading
+
+from twisted.internet import reactor
+from twisted.python import threadable
+
+
+class Batch(object):
+    """Accumulates items and delivers them together.
+
+    Items are delivered as a list once `size` items have accumulated, or
+    `interval` milliseconds after the first item was added, whichever comes
+    first. An interval of 0 delivers everything added during the current
+    reactor iteration at the start of the next one. Delivery always happens on
+    the reactor thread, but items may be added from any thread.
+    """
+
+    size = 100
+    """Number of items which triggers an immediate delivery"""
+
+    interval = 0
+    """Milliseconds to wait after the first item before delivering"""
+
+    def __init__(self, deliver, size=None, interval=None, clock=None):
+        """Initializes an empty batch.
+
+        Keyword arguments:
+          deliver -- Called with a list of items each time the batch is
+            delivered.
+          size -- Maximum number of items per delivery.
+          interval -- Milliseconds to wait before delivering.
+          clock -- Provider of IReactorTime, to allow for testing.
+        """
+        self.deliver = deliver
+
+        if size is not None:
+            self.size = size
+        if interval is not None:
+            self.interval = interval
+
+        self.clock = clock if clock is not None else reactor
+
+        self.items = []
+        self._delayed_call = None
+        self._lock = threading.Lock()
+
+    def add(self, item):
+        """Adds an item to the batch.
+
+        Keyword arguments:
+          item -- The item to add.
+        """
+        with self._lock:
+            self.items.append(item)
+            full = len(self.items) >= self.size
+            first = len(self.items) == 1
+
+        if threadable.isInIOThread():
+            if full:
+                self.flush()
+            elif first:
+                self._schedule()
+        elif full or first:
+            reactor.callFromThread(self.flush if full else self._schedule)
+
+    def _schedule(self):
+        if self._delayed_call is None or not self._delayed_call.active():
+            self._delayed_call = self.clock.callLater(
+                self.interval / 1000.0, self.flush)
+
+    def flush(self):
+        """Delivers any accumulated items immediately."""
+        self.cancel()
+
+        with self._lock:
+            items, self.items = self.items, []
+
+        if items:
+            self.deliver(items)
+
+    def cancel(self):
+        """Cancels a pending delivery, leaving the items in the batch."""
+        if self._delayed_call is not None and self._delayed_call.active():
+            self._delayed_call.cancel()
+        self._delayed_call = None
@@ -1,18 +1,30 @@
-import time
+import os
+import random
 import signal
 import logging
-import re
+import sys
 from datetime import datetime
 
 from twisted.words.protocols import irc
-from twisted.internet import protocol, reactor
-
+from twisted.internet import defer, protocol, reactor
+from twisted.python import threadable
+
+from cardinal.batching import Batch
+from cardinal.formatting import pack_messages, payload_length, split_message
+from cardinal.invocations import InvocationTracker
+from cardinal.message import Message
+from cardinal.metrics import Metrics
 from cardinal.plugins import PluginManager, EventManager
+from cardinal.ratelimit import RateLimiter
+from cardinal.sendqueue import SendQueue, PRIORITY_HIGH, PRIORITY_NORMAL
+from cardinal.state import StateTracker, irc_lower
+from cardinal.threadpools import ThreadPoolManager
+from cardinal.users import USER_REGEX, parse_user
 from cardinal.exceptions import (
-    CommandNotFoundError,
     ConfigNotFoundError,
     InternalError,
     PluginError,
+    WhoTimeoutError,
 )
 
 
@@ -25,15 +37,28 @@ class CardinalBot(irc.IRCClient, object):
     factory = None
     """Should contain an instance of CardinalBotFactory"""
 
-    user_regex = re.compile(r'^(.*?)!(.*?)@(.*?)$')
+    user_regex = USER_REGEX
     """Regex for identifying a user's nick, ident, and vhost"""
 
+    current_message = None
+    """The Message being handled, shared by every event it fires"""
+
     plugin_manager = None
     """Instance of PluginManager"""
 
     event_manager = None
     """Instance of EventManager"""
 
+    send_queue = None
+    """Instance of SendQueue pacing lines sent to the server"""
+
+    state = None
+    """Instance of StateTracker with the channels and users we can see"""
+
+    high_priority_commands = ('CAP', 'PASS', 'NICK', 'USER', 'PING', 'PONG',
+                              'QUIT')
+    """Commands which are sent ahead of any queued messages"""
+
     storage_path = None
     """Location of storage directory"""
 
@@ -43,6 +68,48 @@ class CardinalBot(irc.IRCClient, object):
     booted = None
     """Time that Cardinal was first launched"""
 
+    who_timeout = 30
+    """Seconds to wait for a WHO to finish before giving up on it"""
+
+    who_ttl = 60
+    """Seconds WHO results are cached for"""
+
+    who_batch_size = 10
+    """Most channels to ask about in one WHO, if the server allows several"""
+
+    whox_token = '372'
+    """Query type sent with WHOX requests, to recognize our replies"""
+
+    requested_capabilities = (
+        'multi-prefix',
+        'userhost-in-names',
+        'extended-join',
+        'away-notify',
+        'account-notify',
+        'message-tags',
+        'batch',
+    )
+    """IRCv3 capabilities to enable, if the server supports them"""
+
+    capabilities = None
+    """IRCv3 capabilities the server has enabled"""
+
+    batches = None
+    """Maps the reference of each open IRCv3 batch to its type, params and
+    the messages received in it so far"""
+
+    max_batches = 16
+    """Most IRCv3 batches to collect messages for at once"""
+
+    max_batch_messages = 1000
+    """Most messages to collect in one IRCv3 batch"""
+
+    userhost = None
+    """Our ident@host as the server sees it, once known"""
+
+    pack_separator = ' | '
+    """Placed between replies packed into one line by sendMsg()"""
+
     @property
     def network(self):
         return self.factory.network
@@ -51,6 +118,11 @@ class CardinalBot(irc.IRCClient, object):
     def network(self, value):
         self.factory.network = value
 
+    @property
+    def network_name(self):
+        """Name of the network, for keying anything stored per network"""
+        return self.factory.name
+
     @property
     def nickname(self):
         return self.factory.nickname
@@ -85,14 +157,174 @@ class CardinalBot(irc.IRCClient, object):
         self.logger = logging.getLogger(__name__)
         self.irc_logger = logging.getLogger("%s.irc" % __name__)
 
-        # State variables for the WHO command
+        # State variables for the WHO command, keyed by lowercased channel.
+        # The lock holds the delayed call which times out a pending query, the
+        # replies collect users until RPL_ENDOFWHO, and the cache holds the
+        # time each list was fetched along with the list.
         self.who_lock = {}
+        self.who_replies = {}
         self.who_cache = {}
         self.who_callbacks = {}
 
+        # Requests made in the same reactor iteration are sent together
+        self.who_batch = Batch(self._send_who)
+
+    def connectionMade(self):
+        """Called once the connection is made, before registering"""
+        self.send_queue = SendQueue(self._reallySendLine,
+                                    self.factory.send_queue)
+        self.state = StateTracker(self.nickname)
+
+        # Capabilities and batches only last as long as the connection
+        self.capabilities = set()
+        self.batches = {}
+        self.userhost = None
+        self._cap_negotiating = False
+        self._cap_available = set()
+
+        if self.factory.timeouts.get('who') is not None:
+            self.who_timeout = self.factory.timeouts['who']
+        if self.factory.timeouts.get('who_cache') is not None:
+            self.who_ttl = self.factory.timeouts['who_cache']
+
+        super(CardinalBot, self).connectionMade()
+
+    def connectionLost(self, reason):
+        """Called when the connection is lost, discarding queued lines"""
+        if self.send_queue is not None:
+            self.send_queue.clear()
+
+        # Pending WHOs will never be answered now, and open batches will
+        # never end
+        self.who_batch.cancel()
+        self.batches = {}
+        for key in list(self.who_callbacks):
+            self._fail_who(key, reason)
+
+        super(CardinalBot, self).connectionLost(reason)
+
+        # Plugins outlive the connection, so let them know it's gone
+        if self.event_manager is not None:
+            self.event_manager.fire("irc.disconnected",
+                                    reason.getErrorMessage())
+
+    def sendLine(self, line, priority=None, continuation=False):
+        """Queues a line to be sent to the server without flooding.
+
+        Twisted sends every line through here, including PONGs and messages
+        split by msg().
+
+        Keyword arguments:
+          line -- Line to send.
+          priority -- One of the sendqueue PRIORITY_* constants. Guessed from
+            the command if None given.
+          continuation -- Whether the line continues the previous line sent
+            to the same target, so it's only dropped as stale along with it.
+        """
+        if self.send_queue is None:
+            return super(CardinalBot, self).sendLine(line)
+
+        command, _, params = line.partition(' ')
+        command = command.upper()
+
+        target = None
+        if command in ('PRIVMSG', 'NOTICE'):
+            target = params.split(' ', 1)[0]
+
+        if priority is None:
+            if command in self.high_priority_commands:
+                priority = PRIORITY_HIGH
+            else:
+                priority = PRIORITY_NORMAL
+
+        self.send_queue.enqueue(line, target, priority, continuation)
+
+    def register(self, nickname, hostname='foo', servername='bar'):
+        """Asks for the server's capabilities, then registers.
+
+        Servers supporting capability negotiation hold registration until
+        CAP END is sent, which irc_CAP does once the capabilities we want
+        have been requested. Other servers ignore the CAP LS.
+        """
+        self._cap_negotiating = True
+        self._cap_available = set()
+        self.sendLine("CAP LS 302")
+
+        super(CardinalBot, self).register(nickname, hostname, servername)
+
+    def irc_CAP(self, prefix, params):
+        """Called with the server's replies during capability negotiation"""
+        subcommand = params[1].upper()
+        capabilities = params[-1].split()
+
+        if subcommand == 'LS':
+            # Version 302 replies may span several lines, all but the last
+            # marked with a *
+            self._cap_available.update(capability.split('=', 1)[0]
+                                       for capability in capabilities)
+            if len(params) > 3 and params[2] == '*':
+                return
+
+            self._request_capabilities(self._cap_available)
+        elif subcommand == 'NEW':
+            self._request_capabilities(capability.split('=', 1)[0]
+                                       for capability in capabilities)
+        elif subcommand == 'ACK':
+            for capability in capabilities:
+                if capability.startswith('-'):
+                    self.capabilities.discard(capability[1:])
+                else:
+                    self.capabilities.add(capability)
+
+            self.logger.info("Enabled capabilities: %s",
+                             ' '.join(sorted(self.capabilities)))
+            self._end_capabilities()
+        elif subcommand == 'NAK':
+            self.logger.warning("Server refused capabilities: %s",
+                                ' '.join(capabilities))
+            self._end_capabilities()
+        elif subcommand == 'DEL':
+            self.capabilities.difference_update(capabilities)
+
+    def _request_capabilities(self, available):
+        available = set(available)
+        wanted = [capability for capability in self.requested_capabilities
+                  if capability in available and
+                  capability not in self.capabilities]
+
+        if wanted:
+            self.sendLine("CAP REQ :%s" % ' '.join(wanted))
+        else:
+            self._end_capabilities()
+
+    def _end_capabilities(self):
+        if self._cap_negotiating:
+            self._cap_negotiating = False
+            self.sendLine("CAP END")
+
+    def irc_RPL_WELCOME(self, prefix, params):
+        """Called when we've registered, learning our hostmask if given"""
+        super(CardinalBot, self).irc_RPL_WELCOME(prefix, params)
+
+        # Most servers end the welcome message with our nick!ident@host
+        words = params[-1].split() if params else []
+        if words:
+            self._learn_userhost(words[-1])
+
+    def irc_396(self, prefix, params):
+        """Called when our displayed host changes (RPL_HOSTHIDDEN)"""
+        if len(params) > 1 and self.userhost is not None:
+            ident = self.userhost.split('@', 1)[0]
+            self.userhost = '%s@%s' % (ident, params[1])
+
+    def _learn_userhost(self, hostmask):
+        user = parse_user(hostmask)
+        if user is not None and self.state.is_me(user.nick):
+            self.userhost = '%s@%s' % (user.ident, user.host)
+
     def signedOn(self):
         """Called once we've connected to a network"""
-        self.logger.info("Signed on as %s" % self.nickname)
+        self.logger.info("Signed on as %s", self.nickname)
 
         # Give the factory access to the bot
         if self.factory is None:
@@ -101,33 +333,28 @@ class CardinalBot(irc.IRCClient, object):
         # Give the factory the instance it created in case it needs to
         # interface for error handling or metadata retention.
         self.factory.cardinal = self
+        self.factory.signed_on = reactor.seconds()
+
+        # The server may have changed our nick while registering
+        self.state.nickname = self.nickname
 
         # Attempt to identify with NickServ, if a password was given
         if self.factory.password:
             self.logger.info("Attempting to identify with NickServ")
             self.msg("NickServ", "IDENTIFY %s" % (self.factory.password,))
 
-        # Creates an instance of EventManager
-        self.logger.debug("Creating new EventManager instance")
-        self.event_manager = EventManager(self)
-
-        # Register events
-        self.event_manager.register("irc.raw", 2)
-        self.event_manager.register("irc.invite", 2)
-        self.event_manager.register("irc.privmsg", 3)
-        self.event_manager.register("irc.notice", 3)
-        self.event_manager.register("irc.nick", 2)
-        self.event_manager.register("irc.mode", 3)
-        self.event_manager.register("irc.topic", 3)
-        self.event_manager.register("irc.join", 2)
-        self.event_manager.register("irc.part", 3)
-        self.event_manager.register("irc.kick", 4)
-        self.event_manager.register("irc.quit", 2)
+        # The managers belong to the factory so that plugins and their state
+        # survive reconnects. Hand them to this connection, or create them if
+        # this is the first time we've signed on.
+        if self.factory.event_manager is None:
+            self._create_managers()
+        else:
+            self.logger.debug("Reusing managers from previous connection")
+            self.factory.event_manager.cardinal = self
+            self.factory.plugin_manager.cardinal = self
 
-        # Create an instance of PluginManager, giving it an instance of ourself
-        # to pass to plugins, as well as a list of initial plugins to load.
-        self.logger.debug("Creating new PluginManager instance")
-        self.plugin_manager = PluginManager(self, self.factory.plugins)
+        self.event_manager = self.factory.event_manager
+        self.plugin_manager = self.factory.plugin_manager
 
         # Attempt to join channels
         for channel in self.factory.channels:
@@ -137,39 +364,125 @@ class CardinalBot(irc.IRCClient, object):
         self.uptime = datetime.now()
         self.booted = self.factory.booted
 
+        self.event_manager.fire("irc.connected")
+
+    def _create_managers(self):
+        """Creates the EventManager and PluginManager, loading plugins"""
+        # Creates an instance of EventManager
+        self.logger.debug("Creating new EventManager instance")
+        self.factory.event_manager = EventManager(
+            self,
+            self.factory.thread_pools,
+            InvocationTracker(self.factory.timeouts.get('event'),
+                              self.factory.timeouts.get('slow')),
+            self.factory.metrics,
+            self.factory.timeouts.get('callback_budget'),
+        )
+
+        self.event_manager = self.factory.event_manager
+
+        # Register events
+        self.event_manager.register("irc.raw", 2,
+                                    params=('command', 'line'))
+        self.event_manager.register("irc.invite", 2,
+                                    params=('user', 'channel'))
+        self.event_manager.register("irc.privmsg", 3,
+                                    params=('user', 'channel', 'message'))
+        self.event_manager.register("irc.notice", 3,
+                                    params=('user', 'channel', 'message'))
+        self.event_manager.register("irc.nick", 2,
+                                    params=('user', 'nick'))
+        self.event_manager.register("irc.mode", 3,
+                                    params=('user', 'channel', 'mode'))
+        self.event_manager.register("irc.topic", 3,
+                                    params=('user', 'channel', 'topic'))
+        self.event_manager.register("irc.join", 2,
+                                    params=('user', 'channel'))
+        self.event_manager.register("irc.part", 3,
+                                    params=('user', 'channel', 'reason'))
+        self.event_manager.register("irc.kick", 4,
+                                    params=('user', 'channel', 'nick',
+                                            'reason'))
+        self.event_manager.register("irc.quit", 2,
+                                    params=('user', 'reason'))
+        self.event_manager.register("irc.connected", 0)
+        self.event_manager.register("irc.disconnected", 1,
+                                    params=('reason',))
+        self.event_manager.register("irc.batch", 3,
+                                    params=('type', 'params', 'messages'))
+
+        # Plugin instances may be shared with the other networks we're on
+        shared_plugins = None
+        if self.factory.networks is not None:
+            shared_plugins = self.factory.networks.shared_plugins
+
+        # Create an instance of PluginManager, giving it an instance of ourself
+        # to pass to plugins, as well as a list of initial plugins to load.
+        self.logger.debug("Creating new PluginManager instance")
+        self.factory.plugin_manager = PluginManager(
+            self,
+            self.factory.plugins,
+            self.factory.thread_pools,
+            InvocationTracker(self.factory.timeouts.get('command'),
+                              self.factory.timeouts.get('slow')),
+            self.factory.rate_limiter,
+            self.factory.metrics,
+            shared_plugins,
+        )
+
     def joined(self, channel):
         """Called when we join a channel.
 
         channel -- Channel joined. Provided by Twisted.
         """
-        self.logger.info("Joined %s" % channel)
+        self.logger.info("Joined %s", channel)
 
     def lineReceived(self, line):
         """Called for every line received from the server."""
         self.irc_logger.info(line)
 
-        parts = line.split(' ')
-        command = parts[1]
+        # This replaces IRCClient.lineReceived, so that the line is only
+        # parsed once
+        line = irc.lowDequote(line)
+        try:
+            message = Message(line)
+        except irc.IRCBadMessage:
+            self.badMessage(line, *sys.exc_info())
+            return
+
+        self.current_message = message
+
+        # Messages in a batch are still handled one by one, but are also
+        # collected so the whole batch can be handled once it ends
+        if 'batch' in message.tags:
+            batch = self.batches.get(message.tags['batch'])
+            if (batch is not None and
+                    len(batch['messages']) < self.max_batch_messages):
+                batch['messages'].append(message)
 
         # Don't fire if we haven't booted the event manager yet
         if self.event_manager:
-            self.event_manager.fire("irc.raw", command, line)
+            self.event_manager.fire("irc.raw", message.command, line)
 
         # Call Twisted handler
-        super(CardinalBot, self).lineReceived(line)
+        command = irc.numeric_to_symbolic.get(message.command,
+                                              message.command)
+        self.handleCommand(command, message.prefix, message.params)
 
     def irc_PRIVMSG(self, prefix, params):
         """Called when we receive a message in a channel or PM."""
         # Break down the user into usable groups
-        user = re.match(self.user_regex, prefix)
+        user = self.current_message.user
         channel = params[0]
         message = params[1]
 
         self.logger.debug(
-            "%s!%s@%s to %s: %s" %
-            (user.group(1), user.group(2), user.group(3), channel, message)
+            "%s!%s@%s to %s: %s",
+            user.group(1), user.group(2), user.group(3), channel, message
         )
 
+        self.state.seen(user.group(1), user.group(2), user.group(3))
+
         self.event_manager.fire("irc.privmsg", user, channel, message)
 
         # If the channel is ourselves, this is actually a PM to us, and so
@@ -179,89 +492,211 @@ class CardinalBot(irc.IRCClient, object):
             channel = user.group(1)
 
         # Attempt to call a command. If it doesn't appear to PluginManager to
-        # be a command, this will just fall through. If it matches command
-        # syntax but there is no matching command, then we should catch the
-        # exception.
-        try:
-            self.plugin_manager.call_command(user, channel, message)
-        except CommandNotFoundError:
-            # This is just an info, since anyone can trigger it, not really a
-            # bad thing.
-            self.logger.info(
-                "Unable to find a matching command", exc_info=True)
+        # be a command, this will just fall through.
+        self.plugin_manager.call_command(user, channel, message)
 
-    def who(self, channel, callback):
+    def who(self, channel, callback=None):
         """Lists the users in a channel.
 
+        Users are listed from the state tracker if it knows everyone in the
+        channel, which it will once we've been in the channel a moment.
+        Otherwise a WHO is sent to the server, unless one is already pending
+        for the channel or was answered recently.
+
         Keyword arguments:
           channel -- Channel to list users of.
           callback -- A callback that will receive the list of users.
 
         Returns:
-          None. However, the callback will receive a single argument,
-          which is the list of users.
+          Deferred -- Fires with a list of (nick, ident, host) tuples, or
+            fails with WhoTimeoutError if the server doesn't answer.
         """
-        if channel not in self.who_callbacks:
-            self.who_callbacks[channel] = []
-        self.who_callbacks[channel].append(callback)
+        if self.state.is_complete(channel):
+            d = defer.succeed(self.state.who(channel))
+        else:
+            d = self._who(channel)
+
+        if callback is not None:
+            d.addCallback(callback)
+
+        return d
+
+    def _who(self, channel):
+        key = irc_lower(channel)
+
+        try:
+            fetched, users = self.who_cache[key]
+        except KeyError:
+            pass
+        else:
+            if reactor.seconds() - fetched < self.who_ttl:
+                return defer.succeed(list(users))
+            del self.who_cache[key]
+
+        self.logger.info("WHO list requested for %s", channel)
+
+        d = defer.Deferred()
+        self.who_callbacks.setdefault(key, []).append(d)
 
-        self.logger.info("WHO list requested for %s" % channel)
+        # Only one query per channel may be pending at once
+        if key not in self.who_lock:
+            self.who_lock[key] = None
+            self.who_batch.add(channel)
+
+        return d
+
+    def _get_who_batch_size(self):
+        """Returns how many channels may be sent in one WHO.
+
+        Servers which accept several comma-separated targets for WHO say so
+        in the TARGMAX feature, where no value means there's no limit.
+        """
+        targmax = self.supported.getFeature('TARGMAX') or {}
+        if 'WHO' not in targmax:
+            return 1
+
+        return min(targmax['WHO'] or self.who_batch_size,
+                   self.who_batch_size)
+
+    def _send_who(self, channels):
+        """Sends WHO queries for a list of channels"""
+        size = self._get_who_batch_size()
+
+        for i in range(0, len(channels), size):
+            batch = channels[i:i + size]
+
+            for channel in batch:
+                key = irc_lower(channel)
+                self.who_replies[key] = []
+                self.who_lock[key] = reactor.callLater(
+                    self.who_timeout, self._who_timed_out, key)
 
-        if channel not in self.who_lock:
             self.logger.info("Making WHO request to server")
-            # Set a lock to prevent trying to track responses from the server
-            self.who_lock[channel] = True
 
-            # Empty the cache to ensure no old users show up.
-            # TODO: Add actual caching and user tracking.
-            self.who_cache[channel] = []
+            # WHOX lets us ask for just the fields we need. Either way,
+            # irc_RPL_WHOREPLY or irc_354 will receive each user.
+            if self.supported.hasFeature('WHOX'):
+                self.sendLine("WHO %s %%tcuhn,%s" %
+                              (','.join(batch), self.whox_token))
+            else:
+                self.sendLine("WHO %s" % ','.join(batch))
 
-            # Send the actual WHO command to the server. irc_RPL_WHOREPLY will
-            # receive a response when the server sends one.
-            self.sendLine("WHO %s" % channel)
+    def _who_timed_out(self, key):
+        self.logger.warning("WHO for %s wasn't answered within %s seconds",
+                            key, self.who_timeout)
 
-    def irc_RPL_WHOREPLY(self, *nargs):
-        "Receives reply from WHO command and sends to caller"
-        response = nargs[1]
+        self._fail_who(key, WhoTimeoutError("WHO for %s timed out" % key))
 
-        # Same format as other events (nickname!ident@hostname)
-        user = (
-            response[5],  # nickname
-            response[2],  # ident
-            response[3],  # hostname
-        )
-        channel = response[1]
+    def _fail_who(self, key, reason):
+        lock = self.who_lock.pop(key, None)
+        if lock is not None and lock.active():
+            lock.cancel()
+        self.who_replies.pop(key, None)
 
-        self.who_cache[channel].append(user)
+        for d in self.who_callbacks.pop(key, []):
+            d.errback(reason)
 
-    def irc_RPL_ENDOFWHO(self, *nargs):
-        "Called when WHO output is complete"
-        response = nargs[1]
-        channel = response[1]
+    def _who_reply(self, channel, nick, ident, host):
+        self.state.seen(nick, ident, host)
+
+        # Same format as other events (nickname!ident@hostname)
+        replies = self.who_replies.get(irc_lower(channel))
+        if replies is not None:
+            replies.append((nick, ident, host))
 
-        self.logger.info("Calling WHO callbacks for %s" % channel)
-        for callback in self.who_callbacks[channel]:
-            callback(self.who_cache[channel])
+    def irc_RPL_WHOREPLY(self, prefix, params):
+        "Receives reply from WHO command and sends to caller"
+        self._who_reply(params[1], params[5], params[2], params[3])
+
+    def irc_354(self, prefix, params):
+        "Receives reply from WHOX command and sends to caller"
+        if len(params) == 6 and params[1] == self.whox_token:
+            self._who_reply(params[2], params[5], params[3], params[4])
 
-        del self.who_callbacks[channel]
-        del self.who_lock[channel]
+    def irc_RPL_ENDOFWHO(self, prefix, params):
+        "Called when WHO output is complete"
+        # Batched queries end once for every channel asked about
+        for channel in params[1].split(','):
+            key = irc_lower(channel)
+            if key not in self.who_replies:
+                continue
+
+            lock = self.who_lock.pop(key, None)
+            if lock is not None and lock.active():
+                lock.cancel()
+
+            users = self.who_replies.pop(key)
+            self.who_cache[key] = (reactor.seconds(), users)
+
+            self.logger.info("Calling WHO callbacks for %s", channel)
+            for d in self.who_callbacks.pop(key, []):
+                d.callback(list(users))
+
+    def irc_RPL_NAMREPLY(self, prefix, params):
+        """Called with part of the member list when we join a channel"""
+        channel = params[2]
+
+        # Map prefixes such as @ back to the mode they represent
+        prefixes = dict((symbol, mode) for mode, (symbol, _) in
+                        self.supported.getFeature('PREFIX', {}).items())
+
+        # With multi-prefix, every prefix a user has is listed, and with
+        # userhost-in-names, each name is a full nick!ident@host
+        entries = []
+        for name in params[3].split():
+            modes = set()
+            while name and name[0] in prefixes:
+                modes.add(prefixes[name[0]])
+                name = name[1:]
+
+            if not name:
+                continue
+
+            user = parse_user(name)
+            if user is not None:
+                entries.append((user.nick, modes, user.ident, user.host))
+            else:
+                entries.append((name, modes, None, None))
+
+        self.state.names(channel, entries)
+
+    def irc_RPL_ENDOFNAMES(self, prefix, params):
+        """Called when the member list of a channel is complete"""
+        channel = params[1]
+        self.state.end_of_names(channel)
+
+        # Unless the server has enabled userhost-in-names, NAMES doesn't give
+        # us hosts, so fetch them once per channel. After this, JOINs keep the
+        # state tracker up to date.
+        if (self.state.get_channel(channel) is not None and
+                not self.state.is_complete(channel)):
+            self._who(channel).addErrback(
+                lambda failure: self.logger.warning(
+                    "Couldn't fetch users for %s: %s",
+                    channel, failure.getErrorMessage()))
+
+    def irc_RPL_TOPIC(self, prefix, params):
+        """Called with the topic of a channel when we join it"""
+        self.state.topic_changed(params[1], params[2])
+
+        super(CardinalBot, self).irc_RPL_TOPIC(prefix, params)
 
     def irc_NOTICE(self, prefix, params):
         """Called when a notice is sent to a channel or privately"""
-        user = re.match(self.user_regex, prefix)
+        user = self.current_message.user
         channel = params[0]
         message = params[1]
 
         # Sent by network, not a real user
         if not user:
             self.logger.debug(
-                "%s sent notice to %s: %s" % (prefix, channel, message)
+                "%s sent notice to %s: %s", prefix, channel, message
             )
             return
 
         self.logger.debug(
-            "%s!%s@%s sent notice to %s: %s" %
-            (user.group(1), user.group(2), user.group(3), channel, message)
+            "%s!%s@%s sent notice to %s: %s",
+            user.group(1), user.group(2), user.group(3), channel, message
         )
 
         # Lots of NOTICE messages when connecting, and event manager may not be
@@ -271,45 +706,51 @@ class CardinalBot(irc.IRCClient, object):
 
     def irc_NICK(self, prefix, params):
         """Called when a user changes their nick"""
-        user = re.match(self.user_regex, prefix)
+        user = self.current_message.user
         new_nick = params[0]
 
         self.logger.debug(
-            "%s!%s@%s changed nick to %s" %
-            (user.group(1), user.group(2), user.group(3), new_nick)
+            "%s!%s@%s changed nick to %s",
+            user.group(1), user.group(2), user.group(3), new_nick
         )
 
+        self.state.nick_changed(user.group(1), new_nick)
+
         self.event_manager.fire("irc.nick", user, new_nick)
 
     def irc_TOPIC(self, prefix, params):
         """Called when a new topic is set"""
-        user = re.match(self.user_regex, prefix)
+        user = self.current_message.user
         channel = params[0]
         topic = params[1]
 
         self.logger.debug(
-            "%s!%s@%s changed topic in %s to %s" %
-            (user.group(1), user.group(2), user.group(3), channel, topic)
+            "%s!%s@%s changed topic in %s to %s",
+            user.group(1), user.group(2), user.group(3), channel, topic
         )
 
+        self.state.topic_changed(channel, topic)
+
         self.event_manager.fire("irc.topic", user, channel, topic)
 
     def irc_MODE(self, prefix, params):
         """Called when a mode is set on a channel"""
-        user = re.match(self.user_regex, prefix)
+        user = self.current_message.user
         channel = params[0]
         mode = ' '.join(params[1:])
 
+        self._track_modes(channel, params[1], params[2:])
+
         # Sent by network, not a real user
         if not user:
             self.logger.debug(
-                "%s set mode on %s (%s)" % (prefix, channel, mode)
+                "%s set mode on %s (%s)", prefix, channel, mode
             )
             return
 
         self.logger.debug(
-            "%s!%s@%s set mode on %s (%s)" %
-            (user.group(1), user.group(2), user.group(3), channel, mode)
+            "%s!%s@%s set mode on %s (%s)",
+            user.group(1), user.group(2), user.group(3), channel, mode
         )
 
         # Can get called during connection, in which case EventManager won't be
@@ -317,21 +758,48 @@ class CardinalBot(irc.IRCClient, object):
         if self.event_manager:
             self.event_manager.fire("irc.mode", user, channel, mode)
 
+    def _track_modes(self, channel, modes, args):
+        """Updates the state tracker with a channel mode change"""
+        try:
+            added, removed = irc.parseModes(modes, args,
+                                            self.getChannelModeParams())
+        except irc.IRCBadModes:
+            self.logger.debug("Couldn't parse modes for %s: %s %s",
+                              channel, modes, ' '.join(args))
+            return
+
+        chanmodes = self.supported.getFeature('CHANMODES') or {}
+        self.state.mode_changed(channel, added, removed,
+                                self.supported.getFeature('PREFIX', {}),
+                                chanmodes.get('addressModes', ''))
+
     def irc_JOIN(self, prefix, params):
         """Called when a user joins a channel"""
-        user = re.match(self.user_regex, prefix)
+        user = self.current_message.user
         channel = params[0]
 
         self.logger.debug(
-            "%s!%s@%s joined %s" %
-            (user.group(1), user.group(2), user.group(3), channel)
+            "%s!%s@%s joined %s",
+            user.group(1), user.group(2), user.group(3), channel
         )
 
+        self.state.joined(user.group(1), user.group(2), user.group(3), channel)
+
+        # Our own JOIN shows the prefix the server adds to our messages
+        if self.state.is_me(user.group(1)):
+            self._learn_userhost(prefix)
+
+        # With extended-join, the user's account (or * if they aren't logged
+        # in) and real name follow the channel
+        if len(params) > 1 and 'extended-join' in self.capabilities:
+            self.state.account_changed(
+                user.group(1), params[1] if params[1] != '*' else None)
+
         self.event_manager.fire("irc.join", user, channel)
 
     def irc_PART(self, prefix, params):
         """Called when a user parts a channel"""
-        user = re.match(self.user_regex, prefix)
+        user = self.current_message.user
         channel = params[0]
         if len(params) == 1:
             reason = "No Message"
@@ -339,15 +807,17 @@ class CardinalBot(irc.IRCClient, object):
             reason = params[1]
 
         self.logger.debug(
-            "%s!%s@%s parted %s (%s)" %
-            (user.group(1), user.group(2), user.group(3), channel, reason)
+            "%s!%s@%s parted %s (%s)",
+            user.group(1), user.group(2), user.group(3), channel, reason
         )
 
+        self._parted(user.group(1), channel)
+
         self.event_manager.fire("irc.part", user, channel, reason)
 
     def irc_KICK(self, prefix, params):
         """Called when a user is kicked from a channel"""
-        user = re.match(self.user_regex, prefix)
+        user = self.current_message.user
         nick = params[1]
         channel = params[0]
         if len(params) == 2:
@@ -356,28 +826,77 @@ class CardinalBot(irc.IRCClient, object):
             reason = params[2]
 
         self.logger.debug(
-            "%s!%s@%s kicked %s from %s (%s)" %
-            (user.group(1), user.group(2), user.group(3),
-                nick, channel, reason)
+            "%s!%s@%s kicked %s from %s (%s)",
+            user.group(1), user.group(2), user.group(3), nick, channel, reason
         )
 
+        self._parted(nick, channel)
+
         self.event_manager.fire("irc.kick", user, channel, nick, reason)
 
+    def _parted(self, nick, channel):
+        self.state.parted(nick, channel)
+
+        # Once we've left, the cached WHO list can't be relied on, and if we
+        # rejoin, the state tracker needs a fresh WHO to learn hosts again
+        if self.state.is_me(nick):
+            self.who_cache.pop(irc_lower(channel), None)
+
     def irc_QUIT(self, prefix, params):
         """Called when a user quits the network"""
-        user = re.match(self.user_regex, prefix)
+        user = self.current_message.user
         if len(params) == 0:
             reason = "No Message"
         else:
             reason = params[0]
 
         self.logger.debug(
-            "%s!%s@%s quit (%s)" %
-            (user.group(1), user.group(2), user.group(3), reason)
+            "%s!%s@%s quit (%s)",
+            user.group(1), user.group(2), user.group(3), reason
         )
 
+        self.state.quit(user.group(1))
+
         self.event_manager.fire("irc.quit", user, reason)
 
+    def irc_AWAY(self, prefix, params):
+        """Called when a user goes away or comes back (away-notify)"""
+        user = self.current_message.user
+        if user is not None:
+            self.state.away_changed(user.nick, params[0] if params else None)
+
+    def irc_ACCOUNT(self, prefix, params):
+        """Called when a user logs in or out of an account (account-notify)"""
+        user = self.current_message.user
+        if user is not None and params:
+            self.state.account_changed(
+                user.nick, params[0] if params[0] != '*' else None)
+
+    def irc_BATCH(self, prefix, params):
+        """Called when an IRCv3 batch starts or ends"""
+        if not params or len(params[0]) < 2:
+            return
+
+        reference = params[0][1:]
+        if params[0][0] == '+' and len(params) > 1:
+            # The server should end every batch it starts, but in case it
+            # doesn't, don't collect messages for them forever
+            if len(self.batches) >= self.max_batches:
+                self.logger.warning(
+                    "Too many open batches, ignoring batch %s", reference)
+                return
+
+            self.batches[reference] = {
+                'type': params[1],
+                'params': params[2:],
+                'messages': [],
+            }
+        elif params[0][0] == '-':
+            batch = self.batches.pop(reference, None)
+            if batch is not None and self.event_manager:
+                self.event_manager.fire("irc.batch", batch['type'],
+                                        batch['params'], batch['messages'])
+
     def irc_unknown(self, prefix, command, params):
         """Called when Twisted doesn't understand an IRC command.
 
@@ -389,10 +908,10 @@ class CardinalBot(irc.IRCClient, object):
         # A user has invited us to a channel
         if command == "INVITE":
             # Break down the user into usable groups
-            user = re.match(self.user_regex, prefix)
+            user = self.current_message.user
             channel = params[1]
 
-            self.logger.debug("%s invited us to %s" % (user.group(1), channel))
+            self.logger.debug("%s invited us to %s", user.group(1), channel)
 
             # Fire invite event, so plugins can hook into it
             self.event_manager.fire("irc.invite", user, channel)
@@ -414,7 +933,7 @@ class CardinalBot(irc.IRCClient, object):
         if self.plugin_manager is None:
             self.logger.error(
                 "PluginManager has not been initialized! Can't return config "
-                "for plugin: %s" % plugin
+                "for plugin: %s", plugin
             )
             raise PluginError("PluginManager has not yet been initialized")
 
@@ -423,30 +942,91 @@ class CardinalBot(irc.IRCClient, object):
         except ConfigNotFoundError:
             # Log and raise the exception again
             self.logger.exception(
-                "Couldn't find config for plugin: %s" % plugin
+                "Couldn't find config for plugin: %s", plugin
             )
             raise
 
         return config
 
-    def sendMsg(self, channel, message, length=None):
+    def max_payload(self, target, command='PRIVMSG'):
+        """Returns how many bytes of text fit in one message to a target.
+
+        Once our ident and host are known, from the welcome message or our own
+        JOIN, this is exact. Until then, the longest ident and host a server
+        may use are assumed.
+
+        Keyword arguments:
+          target -- The channel or nick the message is sent to.
+          command -- The command the message is sent with.
+
+        Returns:
+          int -- The most bytes of text which can be sent in one line.
+        """
+        userhost = self.userhost
+        if userhost is None:
+            # Same guess as IRCClient._safeMaximumLineLength()
+            userhost = '%s@%s' % ('b' * 10, 'c' * 63)
+
+        nickname = self.state.nickname if self.state is not None else None
+        prefix = '%s!%s' % (nickname or self.nickname, userhost)
+
+        return payload_length(prefix, command, target)
+
+    def sendMsg(self, channel, message, length=None,
+                priority=PRIORITY_NORMAL):
         """Wrapper command to send messages.
 
+        This may safely be called from a blocking command running in a thread
+        pool, in which case the message is sent from the reactor thread.
+
+        Long messages are split into as few lines as possible, on spaces where
+        possible and never within a UTF-8 character. Given a list of replies,
+        they're packed together into as few lines as possible.
+
         Keyword arguments:
           channel -- Channel to send message to.
-          message -- Message to send.
-          length -- Length of message. Twisted will calculate if None given.
+          message -- Message to send, or a list of replies.
+          length -- Most bytes in each line sent, including the PRIVMSG and
+            line ending. Calculated from our hostmask if None given.
+          priority -- One of the sendqueue PRIORITY_* constants.
         """
-        self.logger.info("Sending in %s: %s" % (channel, message))
-        self.msg(channel, message, length)
+        if not threadable.isInIOThread():
+            reactor.callFromThread(self.sendMsg, channel, message, length,
+                                   priority)
+            return
+
+        self.logger.info("Sending in %s: %s", channel, message)
+
+        # Split the message ourselves, so each line can be queued with the
+        # requested priority
+        fmt = 'PRIVMSG %s :' % channel
+        if length is None:
+            payload = self.max_payload(channel)
+        else:
+            payload = length - len(fmt) - 2
+
+        if isinstance(message, (list, tuple)):
+            lines = pack_messages(message, payload, self.pack_separator)
+        else:
+            lines = split_message(message, payload)
+
+        for index, line in enumerate(lines):
+            self.sendLine(fmt + line, priority, continuation=index > 0)
 
     def send(self, message):
         """Send a raw message to the server.
 
+        This may safely be called from a blocking command running in a thread
+        pool, in which case the message is sent from the reactor thread.
+
         Keyword arguments:
           message -- Message to send.
         """
-        self.logger.info("Sending to server: %s" % message)
+        if not threadable.isInIOThread():
+            reactor.callFromThread(self.send, message)
+            return
+
+        self.logger.info("Sending to server: %s", message)
         self.sendLine(message)
 
     def disconnect(self, message=''):
@@ -476,6 +1056,12 @@ class CardinalBotFactory(protocol.ClientFactory):
     network = None
     """Network to connect to"""
 
+    name = None
+    """Name of the network, which anything stored per network is keyed by"""
+
+    networks = None
+    """Instance of NetworkManager running this network, if any"""
+
     server_password = None
     """Network password, if any"""
 
@@ -503,15 +1089,49 @@ class CardinalBotFactory(protocol.ClientFactory):
     last_reconnection_wait = None
     """Time in seconds since last reconnection attempt"""
 
+    reconnection_jitter = 0.2
+    """Fraction of the reconnection wait to randomly add or subtract"""
+
+    stable_connection_time = 60
+    """Seconds a connection must last before the reconnection wait resets"""
+
+    reconnect_call = None
+    """Delayed call for the pending reconnection attempt, if any"""
+
+    signed_on = None
+    """Time the current connection signed on, if it has"""
+
     booted = None
     """Datetime object holding time Cardinal first started up"""
 
     reloads = 0
     """Keeps track of plugin reloads from within Cardinal"""
 
+    thread_pools = None
+    """Instance of ThreadPoolManager shared by every connection"""
+
+    timeouts = None
+    """Timeouts for asynchronous commands and event callbacks"""
+
+    rate_limiter = None
+    """Instance of RateLimiter shared by every connection"""
+
+    metrics = None
+    """Instance of Metrics shared by every connection"""
+
+    event_manager = None
+    """Instance of EventManager, kept across reconnects"""
+
+    plugin_manager = None
+    """Instance of PluginManager, kept across reconnects"""
+
+    send_queue = None
+    """Pacing settings for each connection's SendQueue"""
+
     def __init__(self, network, server_password=None, channels=None,
                  nickname='Cardinal', password=None, plugins=None,
-                 storage=None):
+                 storage=None, thread_pools=None, timeouts=None,
+                 rate_limits=None, send_queue=None, name=None):
         """Boots the bot, triggers connection, and initializes logging.
 
         Keyword arguments:
@@ -520,36 +1140,120 @@ class CardinalBotFactory(protocol.ClientFactory):
           nickname -- A string with the nick to connect as.
           password -- A string with NickServ password, if any.
           plugins -- A list of plugins to load on boot.
+          storage -- Path to the storage directory.
+          thread_pools -- Config for the thread pools blocking commands run in.
+          timeouts -- A dictionary which may contain the `command`, `event`
+            and `who` timeouts, the `slow` threshold, the `callback_budget`
+            for synchronous event callbacks, and how long `who_cache` results
+            are kept, in seconds.
+          rate_limits -- Budgets for the command rate limiter.
+          send_queue -- Pacing settings for lines sent to the server.
+          name -- Name of the network. Defaults to the server.
         """
         if plugins is None:
             plugins = []
 
+        if timeouts is None:
+            timeouts = {}
+
         if channels is None:
             channels = []
 
         self.logger = logging.getLogger(__name__)
         self.network = network.lower()
+        self.name = name.lower() if name else self.network
         self.server_password = server_password
         self.password = password
         self.channels = channels
         self.nickname = nickname
         self.plugins = plugins
         self.storage_path = storage
-
-        # Register SIGINT handler, so we can close the connection cleanly
+        self.thread_pools = ThreadPoolManager(thread_pools)
+        self.timeouts = timeouts
+        self.rate_limiter = RateLimiter(rate_limits)
+        self.send_queue = send_queue
+
+        # Keep latency metrics across reconnects, and write them to storage
+        self.metrics = Metrics()
+        if storage is not None:
+            self.metrics.start_dumping(
+                os.path.join(storage, 'metrics-%s.json' % self.name))
+
+        # Register SIGINT handler, so we can close the connection cleanly. A
+        # NetworkManager registers its own for all of its networks instead.
         signal.signal(signal.SIGINT, self._sigint)
 
         self.booted = datetime.now()
 
     def _sigint(self, signal, frame):
-        """Called when a SIGINT is received.
+        """Called when a SIGINT is received."""
+        self.shutdown('Received SIGINT.')
+
+    def shutdown(self, message=''):
+        """Disconnects from the network for good.
 
         Set disconnect to true since this was user-triggered, and make Cardinal
-        send a valid IRC QUIT.
+        send a valid IRC QUIT. If we're waiting to reconnect there's no
+        connection to quit, so stop waiting and shut down instead.
+
+        Keyword arguments:
+          message -- Message to insert into QUIT, if any.
         """
         self.disconnect = True
-        if self.cardinal:
-            self.cardinal.quit('Received SIGINT.')
+        if self.cancel_reconnect():
+            self._stop()
+        elif self.cardinal:
+            self.cardinal.quit(message)
+
+    def _stop(self):
+        """Stops the reactor, unless other networks are still running"""
+        if self.networks is not None:
+            self.networks.stopped(self)
+        else:
+            reactor.stop()
+
+    def _get_reconnection_wait(self):
+        """Returns the time to wait before the next connection attempt.
+
+        The wait doubles after each attempt, up to the maximum, and is then
+        jittered so that many bots disconnected at once (e.g. by a netsplit)
+        don't all reconnect at the same moment.
+        """
+        if not self.last_reconnection_wait:
+            wait_time = self.minimum_reconnection_wait
+        else:
+            wait_time = min(self.last_reconnection_wait * 2,
+                            self.maximum_reconnection_wait)
+
+        self.last_reconnection_wait = wait_time
+
+        jitter = wait_time * self.reconnection_jitter
+        return wait_time + random.uniform(-jitter, jitter)
+
+    def _schedule_reconnect(self, connector, wait_time):
+        self.cancel_reconnect()
+        self.reconnect_call = reactor.callLater(
+            wait_time, self._reconnect, connector)
+
+    def _reconnect(self, connector):
+        self.reconnect_call = None
+        connector.connect()
+
+    def cancel_reconnect(self):
+        """Cancels a pending reconnection attempt, if any.
+
+        Returns:
+          bool -- Whether a reconnection attempt was cancelled.
+        """
+        if self.reconnect_call is None or not self.reconnect_call.active():
+            self.reconnect_call = None
+            return False
+
+        self.reconnect_call.cancel()
+        self.reconnect_call = None
+        self.logger.info("Cancelled reconnection attempt")
+
+        return True
 
     def clientConnectionLost(self, connector, reason):
         """Called when we lose connection to the server.
@@ -561,23 +1265,27 @@ class CardinalBotFactory(protocol.ClientFactory):
         # This flag tells us if Cardinal was told to disconnect by a user. If
         # not, we'll attempt to reconnect.
         if not self.disconnect:
+            # If the connection was stable, start backing off from the minimum
+            # wait again. Otherwise we're flapping, so keep backing off.
+            if (self.signed_on is not None and
+                    reactor.seconds() - self.signed_on >=
+                    self.stable_connection_time):
+                self.last_reconnection_wait = None
+            self.signed_on = None
+
+            wait_time = self._get_reconnection_wait()
             self.logger.info(
-                "Connection lost (%s), reconnecting in %d seconds." %
-                (reason, self.minimum_reconnection_wait)
+                "Connection lost (%s), reconnecting in %d seconds.",
+                reason, wait_time
             )
 
-            # Reset the last reconnection wait time since this is the first
-            # time we've disconnected since a successful connection and then
-            # wait before connecting.
-            self.last_reconnection_wait = self.minimum_reconnection_wait
-            time.sleep(self.minimum_reconnection_wait)
-            connector.connect()
+            self._schedule_reconnect(connector, wait_time)
         else:
             self.logger.info(
-                "Disconnected successfully (%s), quitting." % reason
+                "Disconnected successfully (%s), quitting.", reason
             )
 
-            reactor.stop()
+            self._stop()
 
     def clientConnectionFailed(self, connector, reason):
         """Called when a connection attempt fails.
@@ -586,24 +1294,15 @@ class CardinalBotFactory(protocol.ClientFactory):
           connector -- Twisted IRC connector. Provided by Twisted.
           reason -- Reason connection failed. Provided by Twisted.
         """
-        # If we disconnected on our first connection attempt, then we don't
-        # need to calculate a wait time, we can just use the minimum time
-        if not self.last_reconnection_wait:
-            wait_time = self.minimum_reconnection_wait
-        else:
-            # We'll attempt to reconnect after waiting twice as long as the
-            # last time we waited, unless it exceeds the maximum wait time, in
-            # which case we'll wait that long instead
-            wait_time = self.last_reconnection_wait * 2
-            if wait_time > self.maximum_reconnection_wait:
-                wait_time = self.maximum_reconnection_wait
+        if self.disconnect:
+            self.logger.info("Could not connect (%s), quitting.", reason)
+            self._stop()
+            return
 
+        wait_time = self._get_reconnection_wait()
         self.logger.info(
-            "Could not connect (%s), retrying in %d seconds" %
-            (reason, wait_time)
+            "Could not connect (%s), retrying in %d seconds",
+            reason, wait_time
         )
 
-        # Update the last connection wait time, then wait and try to connect
-        self.last_reconnection_wait = wait_time
-        time.sleep(wait_time)
-        connector.connect()
+        self._schedule_reconnect(connector, wait_time)
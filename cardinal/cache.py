@@ -0,0 +1,206 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+
+class LRUCache(object):
+    """A size-bounded cache which evicts the least recently used entries.
+
+    Entries may optionally expire after a time to live. All operations are
+    protected by a lock, so a cache may be shared between the reactor thread
+    and the thread pools blocking commands run in.
+    """
+
+    max_size = 128
+    """Maximum number of entries to hold"""
+
+    ttl = None
+    """Seconds an entry is valid for, or None if entries never expire"""
+
+    hits = 0
+    """Number of lookups that found a valid entry"""
+
+    misses = 0
+    """Number of lookups that didn't find a valid entry"""
+
+    def __init__(self, max_size=None, ttl=None, clock=time.time):
+        """Initializes the cache.
+
+        Keyword arguments:
+          max_size -- Maximum number of entries to hold.
+          ttl -- Seconds an entry is valid for. None means forever.
+          clock -- Function returning the current time, to allow for testing.
+        """
+        if max_size is not None:
+            self.max_size = max_size
+        if ttl is not None:
+            self.ttl = ttl
+
+        self.clock = clock
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Returns the value for a key, if it's cached and hasn't expired.
+
+        Keyword arguments:
+          key -- Key to look up.
+          default -- Value to return if the key isn't cached.
+
+        Returns:
+          object -- The cached value or the default.
+        """
+        with self._lock:
+            try:
+                value, expires = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires is not None and expires <= self.clock():
+                self.misses += 1
+                return default
+
+            # Re-insert the entry so it's the most recently used
+            self._entries[key] = (value, expires)
+            self.hits += 1
+
+            return value
+
+    def set(self, key, value):
+        """Caches a value, evicting the least recently used entry if full.
+
+        Keyword arguments:
+          key -- Key to cache the value under.
+          value -- Value to cache.
+        """
+        expires = None
+        if self.ttl is not None:
+            expires = self.clock() + self.ttl
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def keys(self):
+        """Returns the keys of entries which haven't expired.
+
+        Returns:
+          list -- Keys, from least to most recently used.
+        """
+        now = self.clock()
+        with self._lock:
+            return [key for key, (_, expires) in self._entries.items()
+                    if expires is None or expires > now]
+
+    def clear(self):
+        """Removes every entry from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+
+_caches = defaultdict(dict)
+"""Maps plugin names to a dictionary of function names to LRUCaches"""
+
+
+def register_cache(plugin, name, cache):
+    """Registers a cache so it can be inspected and flushed by plugin name.
+
+    A name is registered again when a plugin is reloaded. If the cache
+    already registered under it has the same size and TTL, it's kept so its
+    entries survive the reload. Otherwise the new cache replaces it.
+
+    Keyword arguments:
+      plugin -- Name of the plugin the cache belongs to.
+      name -- Name of the cached function.
+      cache -- The LRUCache.
+
+    Returns:
+      LRUCache -- The registered cache, which should be used in place of the
+        one given.
+    """
+    existing = _caches[plugin].get(name)
+    if existing is not None and \
+            existing.max_size == cache.max_size and existing.ttl == cache.ttl:
+        return existing
+
+    _caches[plugin][name] = cache
+    return cache
+
+
+def get_caches(plugin=None):
+    """Returns registered caches.
+
+    Keyword arguments:
+      plugin -- If given, only return this plugin's caches.
+
+    Returns:
+      dict -- Maps plugin names to a dictionary of function names to caches.
+    """
+    if plugin is None:
+        return dict((name, dict(caches)) for name, caches in _caches.items())
+
+    if plugin not in _caches:
+        return {}
+
+    return {plugin: dict(_caches[plugin])}
+
+
+def get_stats(plugin=None):
+    """Returns the number of entries, hits and misses of each plugin's caches.
+
+    Keyword arguments:
+      plugin -- If given, only return stats for this plugin.
+
+    Returns:
+      dict -- Maps plugin names to a dictionary of `entries`, `hits` and
+        `misses` totalled over all of the plugin's caches.
+    """
+    stats = {}
+    for name, caches in get_caches(plugin).items():
+        stats[name] = {
+            'entries': sum(len(cache) for cache in caches.values()),
+            'hits': sum(cache.hits for cache in caches.values()),
+            'misses': sum(cache.misses for cache in caches.values()),
+        }
+
+    return stats
+
+
+def get_keys(plugin):
+    """Returns the keys of a plugin's cached entries.
+
+    Keyword arguments:
+      plugin -- Name of the plugin.
+
+    Returns:
+      dict -- Maps function names to a list of keys, from least to most
+        recently used.
+    """
+    return dict((name, cache.keys())
+                for name, cache in _caches.get(plugin, {}).items())
+
+
+def flush(plugin=None):
+    """Removes every entry from registered caches.
+
+    Keyword arguments:
+      plugin -- If given, only flush this plugin's caches.
+
+    Returns:
+      int -- Number of entries removed.
+    """
+    flushed = 0
+    for caches in get_caches(plugin).values():
+        for cache in caches.values():
+            flushed += len(cache)
+            cache.clear()
+
+    return flushed
@@ -1,11 +1,17 @@
 import re
+import inspect
 import functools
 
+from cardinal.cache import LRUCache, register_cache
+from cardinal.threadpools import plugin_name
+
 
 _RETYPE = type(re.compile('foobar'))
 
+_MISSING = object()
+
 
-def command(triggers):
+def command(triggers, blocking=False, timeout=None):
     if isinstance(triggers, basestring):
         triggers = [triggers]
 
@@ -18,12 +24,16 @@ def command(triggers):
             return f(*args, **kwargs)
 
         inner.commands = triggers
+        if blocking:
+            inner.blocking = True
+        if timeout is not None:
+            inner.timeout = timeout
         return inner
 
     return wrap
 
 
-def regex(expression):
+def regex(expression, blocking=False, timeout=None):
     if (not isinstance(expression, basestring) and
             not isinstance(expression, _RETYPE)):
         raise TypeError("Regular expression must be a string or regex type")
@@ -34,6 +44,10 @@ def regex(expression):
             return f(*args, **kwargs)
 
         inner.regex = expression
+        if blocking:
+            inner.blocking = True
+        if timeout is not None:
+            inner.timeout = timeout
         return inner
 
     return wrap
@@ -59,19 +73,112 @@ def help(line):
     return wrap
 
 
-def event(triggers):
+def event(triggers, blocking=False, timeout=None, priority=None,
+          channels=None, commands=None, prefix=None, batch=None):
     if isinstance(triggers, basestring):
         triggers = [triggers]
 
     if not isinstance(triggers, list):
         raise TypeError("Event must be a trigger string or list of triggers")
 
+    filters = {}
+    for name, values in (('channels', channels), ('commands', commands)):
+        if values is None:
+            continue
+        if isinstance(values, basestring):
+            values = [values]
+        if not isinstance(values, list):
+            raise TypeError("Filter must be a string or list of strings")
+        filters[name] = values
+
+    if prefix is not None:
+        if not isinstance(prefix, basestring):
+            raise TypeError("Prefix filter must be a string")
+        filters['prefix'] = prefix
+
+    if batch is not None and batch is not True and not isinstance(batch, dict):
+        raise TypeError("Batch must be True or a dictionary of options")
+
     def wrap(f):
         @functools.wraps(f)
         def inner(*args, **kwargs):
             return f(*args, **kwargs)
 
         inner.events = triggers
+        if blocking:
+            inner.blocking = True
+        if timeout is not None:
+            inner.timeout = timeout
+        if priority is not None:
+            inner.priority = priority
+        if filters:
+            inner.filters = filters
+        if batch is not None:
+            inner.batch = batch
+        return inner
+
+    return wrap
+
+
+def _normalize_key(value):
+    """Normalizes an argument for use in a cache key.
+
+    Strings are lowercased with whitespace collapsed, so ".wiki Python" and
+    ".wiki  python" share an entry. Lists and tuples are normalized
+    recursively, and dictionaries are converted to sorted tuples of items.
+    """
+    if isinstance(value, basestring):
+        return ' '.join(value.split()).lower()
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalize_key(element) for element in value)
+    if isinstance(value, dict):
+        return tuple(sorted((_normalize_key(k), _normalize_key(v))
+                            for k, v in value.iteritems()))
+
+    return value
+
+
+def cached(ttl=300, key=None, max_size=128):
+    if not isinstance(ttl, (int, long, float)) and ttl is not None:
+        raise TypeError("TTL must be a number of seconds or None")
+
+    if key is not None and not callable(key):
+        raise TypeError("Key must be a callable")
+
+    def wrap(f):
+        # A reloaded plugin gets back the cache its previous version used
+        cache = register_cache(plugin_name(f), f.__name__,
+                               LRUCache(max_size, ttl))
+
+        # The instance a method is bound to is left out of the default key, so
+        # keys stay readable and entries survive the plugin being reloaded
+        try:
+            is_method = inspect.getargspec(f).args[:1] == ['self']
+        except TypeError:
+            is_method = False
+
+        @functools.wraps(f)
+        def inner(*args, **kwargs):
+            if key is not None:
+                cache_key = key(*args, **kwargs)
+            elif is_method:
+                cache_key = _normalize_key((args[1:], kwargs))
+            else:
+                cache_key = _normalize_key((args, kwargs))
+
+            try:
+                value = cache.get(cache_key, _MISSING)
+            except TypeError:
+                # Unhashable arguments can't be cached
+                return f(*args, **kwargs)
+
+            if value is _MISSING:
+                value = f(*args, **kwargs)
+                cache.set(cache_key, value)
+
+            return value
+
+        inner.cache = cache
         return inner
 
     return wrap
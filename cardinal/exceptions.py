@@ -11,7 +11,12 @@ class PluginError(CardinalException):
 	pass
 
 class CommandNotFoundError(CardinalException):
-	"""Raised when a given command isn't loaded."""
+	"""Raised when a given command isn't loaded.
+
+	Cardinal itself no longer raises this, since PluginManager.call_command()
+	returns whether a command matched, but it's kept for plugins which import
+	or catch it.
+	"""
 	pass
 
 class ConfigNotFoundError(CardinalException):
@@ -31,3 +36,9 @@ class EventCallbackError(CardinalException):
 
 class EventRejectedMessage(CardinalException):
 	"""Raised when an event callback wants to reject an event."""
+
+class ThreadPoolFullError(CardinalException):
+	"""Raised when a plugin's thread pool has too many queued calls."""
+
+class WhoTimeoutError(CardinalException):
+	"""Raised when the server doesn't finish replying to a WHO in time."""
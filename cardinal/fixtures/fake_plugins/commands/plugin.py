@@ -0,0 +1,35 @@
+from twisted.internet import defer
+
+from cardinal.decorators import command, regex
+
+
+class TestCommandsPlugin(object):
+    def __init__(self):
+        self.calls = []
+
+    @command(['foo', 'bar'])
+    def foo(self, cardinal, user, channel, msg):
+        self.calls.append(('foo', msg))
+
+    @regex(r'^baz')
+    def baz(self, cardinal, user, channel, msg):
+        self.calls.append(('baz', msg))
+
+    @command('ping')
+    @regex(r'(?i)^ping[.?!]?$')
+    def ping(self, cardinal, user, channel, msg):
+        self.calls.append(('ping', msg))
+
+    @command('blocking', blocking=True)
+    def blocking_command(self, cardinal, user, channel, msg):
+        self.calls.append(('blocking', msg))
+
+    @command('deferred', timeout=5)
+    def deferred_command(self, cardinal, user, channel, msg):
+        self.calls.append(('deferred', msg))
+        self.deferred = defer.Deferred()
+        return self.deferred
+
+
+def setup():
+    return TestCommandsPlugin()
@@ -0,0 +1,9 @@
+class TestSharedPlugin(object):
+    closed = []
+
+    def close(self):
+        self.closed.append(self)
+
+
+def setup():
+    return TestSharedPlugin()
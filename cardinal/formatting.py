@@ -0,0 +1,114 @@
+MAX_LINE_LENGTH = 512
+"""Most bytes in a line relayed by the server, including the CRLF"""
+
+
+def payload_length(prefix, command, target):
+    """Returns how many bytes of text fit in a message once it's relayed.
+
+    The server adds our prefix to each message before sending it on, and the
+    whole line must fit in MAX_LINE_LENGTH, so the text must leave room for
+    the prefix as well as the command and target.
+
+    Keyword arguments:
+      prefix -- Our nick!ident@host, as the server sees it.
+      command -- The command, e.g. PRIVMSG.
+      target -- The channel or nick the message is sent to.
+
+    Returns:
+      int -- The most bytes of text which can be sent in one line.
+    """
+    # :prefix COMMAND target :text\r\n
+    framing = len(':%s %s %s :' % (prefix, command, target)) + 2
+
+    return MAX_LINE_LENGTH - framing
+
+
+def _to_bytes(message):
+    if isinstance(message, unicode):
+        return message.encode('utf-8')
+
+    return message
+
+
+def split_message(message, length):
+    """Splits a message into lines of at most `length` bytes.
+
+    Messages are split on newlines, and then on the last space which fits.
+    Words too long for a line are split between UTF-8 characters, so that
+    no character is ever cut in half. Empty lines are dropped, since they
+    can't be sent.
+
+    Keyword arguments:
+      message -- The message, either UTF-8 encoded or unicode.
+      length -- The most bytes in a line.
+
+    Returns:
+      list -- UTF-8 encoded lines.
+
+    Raises:
+      ValueError -- If the length is less than one.
+    """
+    if length < 1:
+        raise ValueError("Length must be at least 1")
+
+    lines = []
+    for line in _to_bytes(message).split('\n'):
+        line = line.rstrip('\r')
+
+        while len(line) > length:
+            cut = line.rfind(' ', 0, length + 1)
+            if cut > 0:
+                lines.append(line[:cut].rstrip(' '))
+                line = line[cut:].lstrip(' ')
+                continue
+
+            # No space to split on, so split between characters, backing up
+            # over UTF-8 continuation bytes (10xxxxxx)
+            cut = length
+            while cut > 0 and 0x80 <= ord(line[cut]) < 0xC0:
+                cut -= 1
+            if cut == 0:
+                cut = length
+
+            lines.append(line[:cut])
+            line = line[cut:]
+
+        lines.append(line)
+
+    return [line for line in lines if line]
+
+
+def pack_messages(messages, length, separator=' | '):
+    """Packs several replies into as few lines as possible.
+
+    Replies are kept in order, and joined by the separator on a line as long
+    as they fit. Replies which are too long for a line by themselves are
+    split with split_message().
+
+    Keyword arguments:
+      messages -- A list of messages, either UTF-8 encoded or unicode.
+      length -- The most bytes in a line.
+      separator -- Placed between replies sharing a line.
+
+    Returns:
+      list -- UTF-8 encoded lines.
+    """
+    separator = _to_bytes(separator)
+
+    lines = []
+    current = None
+    for message in messages:
+        for chunk in split_message(message, length):
+            if (current is not None and
+                    len(current) + len(separator) + len(chunk) <= length):
+                current += separator + chunk
+                continue
+
+            if current is not None:
+                lines.append(current)
+            current = chunk
+
+    if current is not None:
+        lines.append(current)
+
+    return lines
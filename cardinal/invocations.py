@@ -0,0 +1,113 @@
+import itertools
+import logging
+
+from twisted.internet import defer, reactor
+
+
+class InvocationTracker(object):
+    """Keeps track of asynchronous command and event callback invocations.
+
+    Commands and callbacks may return a Deferred (as do blocking commands run
+    in a thread pool.) Each one is tracked until it fires, is cancelled once
+    it exceeds its timeout, and is logged if it was slow to complete.
+    """
+
+    logger = None
+    """Logging object for InvocationTracker"""
+
+    timeout = 30
+    """Default seconds an invocation may run for before it's cancelled"""
+
+    slow_threshold = 5
+    """Seconds after which a completed invocation is logged as slow"""
+
+    in_flight = None
+    """Maps invocation IDs to a tuple of their key and start time"""
+
+    def __init__(self, timeout=None, slow_threshold=None, clock=None):
+        """Initializes the tracker.
+
+        Keyword arguments:
+          timeout -- Default timeout in seconds. None uses the class default,
+            and 0 disables timeouts.
+          slow_threshold -- Seconds after which to log an invocation as slow.
+          clock -- Provider of IReactorTime, to allow for testing.
+        """
+        self.logger = logging.getLogger(__name__)
+
+        if timeout is not None:
+            self.timeout = timeout
+        if slow_threshold is not None:
+            self.slow_threshold = slow_threshold
+
+        self.clock = clock if clock is not None else reactor
+
+        self.in_flight = {}
+        self._ids = itertools.count()
+
+    def track(self, key, d, timeout=None):
+        """Tracks a Deferred returned by an invocation until it fires.
+
+        Keyword arguments:
+          key -- Name of what was invoked, for logging (e.g. plugin.command).
+          d -- The Deferred to track.
+          timeout -- Seconds before the Deferred is cancelled. None uses the
+            default timeout, and 0 disables the timeout.
+
+        Returns:
+          Deferred -- The same Deferred. If it times out it will fail with
+            CancelledError.
+        """
+        if timeout is None:
+            timeout = self.timeout
+
+        invocation_id = next(self._ids)
+        started = self.clock.seconds()
+        self.in_flight[invocation_id] = (key, started)
+
+        timeout_call = None
+        if timeout:
+            timeout_call = self.clock.callLater(
+                timeout, self._timed_out, key, timeout, d)
+
+        def finished(result):
+            del self.in_flight[invocation_id]
+            if timeout_call is not None and timeout_call.active():
+                timeout_call.cancel()
+
+            elapsed = self.clock.seconds() - started
+            if elapsed >= self.slow_threshold:
+                self.logger.warning(
+                    "%s was slow to complete (%.2f seconds)", key, elapsed)
+
+            return result
+
+        d.addBoth(finished)
+
+        return d
+
+    def _timed_out(self, key, timeout, d):
+        self.logger.warning(
+            "%s timed out after %s seconds, cancelling it", key, timeout)
+        d.cancel()
+
+    def count(self, key=None):
+        """Returns the number of invocations that haven't completed.
+
+        Keyword arguments:
+          key -- If given, only count invocations with this key.
+
+        Returns:
+          int -- Number of in-flight invocations.
+        """
+        if key is None:
+            return len(self.in_flight)
+
+        return len([invocation_key
+                    for invocation_key, _ in self.in_flight.itervalues()
+                    if invocation_key == key])
+
+    @staticmethod
+    def is_timeout(failure):
+        """Whether a failure was caused by an invocation timing out."""
+        return failure.check(defer.CancelledError) is not None
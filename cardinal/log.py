@@ -0,0 +1,202 @@
+import gzip
+import logging
+import logging.handlers
+import os
+import shutil
+import threading
+from Queue import Queue, Empty, Full
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """A RotatingFileHandler which compresses the files it rotates out.
+
+    Rotated files are named like `cardinal.log.1.gz`, with `.1` the most
+    recent.
+    """
+
+    def __init__(self, filename, mode='a', maxBytes=0, backupCount=0,
+                 encoding=None, delay=False, compress=True):
+        """Opens the log file.
+
+        Keyword arguments:
+          compress -- Whether to gzip rotated files. The other arguments are
+            those of RotatingFileHandler.
+        """
+        # Make sure storage/logs exists before the file is opened
+        directory = os.path.dirname(os.path.abspath(filename))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.compress = compress
+
+        logging.handlers.RotatingFileHandler.__init__(
+            self, filename, mode, maxBytes, backupCount, encoding, delay)
+
+    def doRollover(self):
+        if not self.compress:
+            return logging.handlers.RotatingFileHandler.doRollover(self)
+
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        if self.backupCount > 0:
+            for i in range(self.backupCount - 1, 0, -1):
+                source = "%s.%d.gz" % (self.baseFilename, i)
+                dest = "%s.%d.gz" % (self.baseFilename, i + 1)
+                if os.path.exists(source):
+                    if os.path.exists(dest):
+                        os.remove(dest)
+                    os.rename(source, dest)
+
+            dest = "%s.1.gz" % self.baseFilename
+            if os.path.exists(dest):
+                os.remove(dest)
+
+            if os.path.exists(self.baseFilename):
+                with open(self.baseFilename, 'rb') as source:
+                    with gzip.open(dest, 'wb') as compressed:
+                        shutil.copyfileobj(source, compressed)
+
+        if os.path.exists(self.baseFilename):
+            os.remove(self.baseFilename)
+
+        if not self.delay:
+            self.stream = self._open()
+
+
+class AsyncRotatingFileHandler(CompressingRotatingFileHandler):
+    """Writes log records to a rotating file from a background thread.
+
+    emit() only puts the record on a queue, so logging never blocks the
+    reactor thread on disk I/O. A writer thread formats queued records, writes
+    them in batches and flushes once per batch, and handles rotation and
+    compression.
+
+    Records are formatted by the writer thread, so the arguments of a log
+    call must not be modified after it's made. If the queue fills up, records
+    are dropped rather than blocking the caller.
+    """
+
+    batch_size = 500
+    """Most records to write before flushing the file"""
+
+    queue_size = 10000
+    """Most records which may wait to be written"""
+
+    dropped = 0
+    """Number of records dropped because the queue was full"""
+
+    def __init__(self, filename, mode='a', maxBytes=0, backupCount=0,
+                 encoding=None, delay=False, compress=True, batch_size=None,
+                 queue_size=None):
+        """Opens the log file and starts the writer thread.
+
+        Keyword arguments:
+          batch_size -- Most records to write before flushing.
+          queue_size -- Most records which may wait to be written. The other
+            arguments are those of CompressingRotatingFileHandler.
+        """
+        CompressingRotatingFileHandler.__init__(
+            self, filename, mode, maxBytes, backupCount, encoding, delay,
+            compress)
+
+        if batch_size is not None:
+            self.batch_size = batch_size
+        if queue_size is not None:
+            self.queue_size = queue_size
+
+        self.queue = Queue(self.queue_size)
+
+        if self.stream is not None:
+            self.stream.seek(0, os.SEEK_END)
+
+        self._writer = threading.Thread(target=self._write_records,
+                                        name="cardinal-log-writer")
+        self._writer.daemon = True
+        self._writer.start()
+
+    def handle(self, record):
+        # Unlike Handler.handle(), don't hold the handler's lock while
+        # queueing, since the writer thread may be busy with the file
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+
+        return rv
+
+    def emit(self, record):
+        # Tracebacks must be formatted while they're still current, but
+        # anything else can wait for the writer thread
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+    def _write_records(self):
+        while True:
+            records = [self.queue.get()]
+            try:
+                while len(records) < self.batch_size:
+                    records.append(self.queue.get_nowait())
+            except Empty:
+                pass
+
+            for record in records:
+                if record is not None:
+                    self._write(record)
+
+            if self.stream is not None:
+                self.stream.flush()
+
+            if None in records:
+                return
+
+    def _write(self, record):
+        try:
+            message = self.format(record) + '\n'
+            if self.encoding:
+                if isinstance(message, str):
+                    message = message.decode('utf-8', 'replace')
+            elif isinstance(message, unicode):
+                message = message.encode('utf-8')
+
+            if self.stream is None:
+                self._reopen()
+
+            # The same check as shouldRollover(), without formatting the
+            # record a second time
+            if (self.maxBytes > 0 and
+                    self.stream.tell() + len(message) >= self.maxBytes):
+                self.doRollover()
+                if self.stream is None:
+                    self._reopen()
+
+            self.stream.write(message)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def _reopen(self):
+        self.stream = self._open()
+
+        # Files opened for appending don't report their size until written to
+        self.stream.seek(0, os.SEEK_END)
+
+    def flush(self):
+        # The writer thread flushes after each batch, and owns the file
+        pass
+
+    def close(self):
+        """Writes any queued records, stops the writer and closes the file."""
+        if self._writer.is_alive():
+            self.queue.put(None)
+            self._writer.join()
+
+        CompressingRotatingFileHandler.close(self)
@@ -0,0 +1,110 @@
+from twisted.words.protocols.irc import IRCBadMessage
+
+from cardinal.users import parse_user
+
+_TAG_ESCAPES = {
+    ':': ';',
+    's': ' ',
+    '\\': '\\',
+    'r': '\r',
+    'n': '\n',
+}
+
+
+def _unescape_tag_value(value):
+    if '\\' not in value:
+        return value
+
+    chars = []
+    escaped = False
+    for char in value:
+        if escaped:
+            chars.append(_TAG_ESCAPES.get(char, char))
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        else:
+            chars.append(char)
+
+    return ''.join(chars)
+
+
+def parse_tags(tags):
+    """Parses IRCv3 message tags.
+
+    Keyword arguments:
+      tags -- The tags, without the leading @.
+
+    Returns:
+      dict -- Maps tag names to their unescaped value, or None for tags
+        without one.
+    """
+    parsed = {}
+    for tag in tags.split(';'):
+        if not tag:
+            continue
+
+        name, sep, value = tag.partition('=')
+        parsed[name] = _unescape_tag_value(value) if sep and value else None
+
+    return parsed
+
+
+class Message(object):
+    """A single line received from the server.
+
+    The line is parsed once on creation. The user who sent it is only parsed
+    from the prefix the first time it's asked for, and is then shared by
+    every handler and event for the line.
+    """
+
+    __slots__ = ('line', 'tags', 'prefix', 'command', 'params', '_user')
+
+    def __init__(self, line):
+        """Parses a line.
+
+        Keyword arguments:
+          line -- The line, without its line ending.
+
+        Raises:
+          IRCBadMessage -- If the line is empty or has no command.
+        """
+        self.line = line
+        self.tags = {}
+        self.prefix = ''
+        self._user = None
+
+        if line.startswith('@'):
+            tags, _, line = line.partition(' ')
+            self.tags = parse_tags(tags[1:])
+
+        if line.startswith(':'):
+            prefix, _, line = line.partition(' ')
+            self.prefix = prefix[1:]
+
+        line, sep, trailing = line.partition(' :')
+        params = line.split()
+        if sep:
+            params.append(trailing)
+
+        if not params:
+            raise IRCBadMessage("Empty line.")
+
+        self.command = params.pop(0)
+        self.params = params
+
+    @property
+    def user(self):
+        """The nick, ident and host of the sender.
+
+        Returns:
+          User -- The sender, or None if the message wasn't sent by a user
+            (e.g. by the server).
+        """
+        if self._user is None and self.prefix:
+            self._user = parse_user(self.prefix) or False
+
+        return self._user or None
+
+    def __repr__(self):
+        return "<Message %r>" % self.line
@@ -0,0 +1,232 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+from twisted.internet import reactor, task
+from twisted.python.failure import Failure
+
+from cardinal.exceptions import EventRejectedMessage
+
+
+class Histogram(object):
+    """Counts durations into fixed buckets.
+
+    Recording is a binary search and a few increments, so it's cheap enough to
+    do for every command and event callback.
+    """
+
+    buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+    """Upper bounds of each bucket in seconds. Anything slower overflows."""
+
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, elapsed, error=False):
+        """Records a duration.
+
+        Keyword arguments:
+          elapsed -- Duration in seconds.
+          error -- Whether the call failed.
+        """
+        self.counts[bisect.bisect_left(self.buckets, elapsed)] += 1
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        if error:
+            self.errors += 1
+
+    def percentile(self, percent):
+        """Estimates a percentile from the bucket counts.
+
+        Keyword arguments:
+          percent -- Percentile to estimate, from 0 to 100.
+
+        Returns:
+          float -- Upper bound of the bucket the percentile falls in, or the
+            maximum duration if it falls in the overflow bucket.
+        """
+        if self.count == 0:
+            return 0.0
+
+        threshold = self.count * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= threshold and count > 0:
+                if index < len(self.buckets):
+                    return min(self.buckets[index], self.max)
+                break
+
+        return self.max
+
+    def to_dict(self):
+        """Returns the histogram as a JSON serializable dictionary."""
+        bounds = list(self.buckets) + ['+Inf']
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total': self.total,
+            'max': self.max,
+            'buckets': [[bound, count]
+                        for bound, count in zip(bounds, self.counts)],
+        }
+
+
+class Metrics(object):
+    """Records the latency of commands and event callbacks per plugin."""
+
+    logger = None
+    """Logging object for Metrics"""
+
+    histograms = None
+    """Maps plugin names to a dictionary of names to Histograms"""
+
+    dump_interval = 60
+    """Seconds between writing the metrics to disk"""
+
+    def __init__(self, clock=time.time):
+        """Initializes the metrics.
+
+        Keyword arguments:
+          clock -- Function returning the current time, to allow for testing.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.clock = clock
+
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._dump_loop = None
+
+    def record(self, plugin, name, started, error=False):
+        """Records a call that has completed.
+
+        Keyword arguments:
+          plugin -- Name of the plugin the call belongs to.
+          name -- Name of the command or callback.
+          started -- Time the call started, from `clock()`.
+          error -- Whether the call failed.
+
+        Returns:
+          float -- Seconds the call took.
+        """
+        elapsed = self.clock() - started
+
+        with self._lock:
+            try:
+                histogram = self.histograms[plugin][name]
+            except KeyError:
+                histogram = Histogram()
+                self.histograms.setdefault(plugin, {})[name] = histogram
+
+            histogram.record(elapsed, error)
+
+        return elapsed
+
+    def track(self, plugin, name, started, d):
+        """Records a call once the Deferred it returned fires.
+
+        A failure counts as an error, unless it's an EventRejectedMessage.
+
+        Keyword arguments:
+          plugin -- Name of the plugin the call belongs to.
+          name -- Name of the command or callback.
+          started -- Time the call started, from `clock()`.
+          d -- The Deferred.
+
+        Returns:
+          Deferred -- The same Deferred.
+        """
+        def finished(result):
+            error = (isinstance(result, Failure) and
+                     not result.check(EventRejectedMessage))
+            self.record(plugin, name, started, error)
+
+            return result
+
+        return d.addBoth(finished)
+
+    def stats(self, plugin=None):
+        """Returns a summary of each command and callback's latency.
+
+        Keyword arguments:
+          plugin -- If given, only return stats for this plugin.
+
+        Returns:
+          dict -- Maps plugin names to a dictionary mapping names to a
+            dictionary of `count`, `errors`, and `total`, `mean`, `p95` and
+            `max` latency in seconds.
+        """
+        with self._lock:
+            if plugin is None:
+                plugins = self.histograms.items()
+            elif plugin in self.histograms:
+                plugins = [(plugin, self.histograms[plugin])]
+            else:
+                plugins = []
+
+            return dict(
+                (name, dict(
+                    (key, {
+                        'count': histogram.count,
+                        'errors': histogram.errors,
+                        'total': histogram.total,
+                        'mean': histogram.total / histogram.count,
+                        'p95': histogram.percentile(95),
+                        'max': histogram.max,
+                    })
+                    for key, histogram in histograms.items()
+                ))
+                for name, histograms in plugins
+            )
+
+    def dump(self, path):
+        """Writes every histogram to a JSON file.
+
+        The file is written to a temporary path and then renamed, so readers
+        never see a partially written file.
+
+        Keyword arguments:
+          path -- Path of the file to write.
+        """
+        with self._lock:
+            data = {
+                'generated': self.clock(),
+                'plugins': dict(
+                    (plugin, dict((name, histogram.to_dict())
+                                  for name, histogram in histograms.items()))
+                    for plugin, histograms in self.histograms.items()
+                ),
+            }
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.rename(tmp_path, path)
+
+    def _dump(self, path):
+        try:
+            self.dump(path)
+        except (IOError, OSError):
+            self.logger.exception("Unable to write metrics to %s", path)
+
+    def start_dumping(self, path):
+        """Periodically writes the metrics to a file, and again on shutdown.
+
+        Keyword arguments:
+          path -- Path of the file to write.
+        """
+        if self._dump_loop is not None:
+            return
+
+        self._dump_loop = task.LoopingCall(self._dump, path)
+        self._dump_loop.start(self.dump_interval, now=False)
+
+        reactor.addSystemEventTrigger('before', 'shutdown', self._dump, path)
@@ -0,0 +1,180 @@
+import logging
+import signal
+
+from twisted.internet import reactor
+
+from cardinal.plugins import SharedPlugins
+
+NETWORK_OPTIONS = (
+    'name',
+    'network',
+    'port',
+    'ssl',
+    'server_password',
+    'nickname',
+    'password',
+    'channels',
+    'plugins',
+    'send_queue',
+)
+"""Options which may be set for each network"""
+
+
+def network_configs(config):
+    """Returns the config of each network Cardinal should connect to.
+
+    Each entry in the `networks` option may set any of NETWORK_OPTIONS, and
+    falls back to the top-level value of any option it doesn't set. Without a
+    `networks` option, the top-level options describe the only network.
+
+    A network's name defaults to the server it connects to. It's used to key
+    anything stored per network, so it must be unique.
+
+    Keyword arguments:
+      config -- The merged config, as a dictionary.
+
+    Returns:
+      list -- A dictionary of NETWORK_OPTIONS for each network.
+
+    Raises:
+      ValueError -- When a network is invalid, or two share a name.
+    """
+    networks = config.get('networks') or [{}]
+
+    configs = []
+    names = set()
+    for network in networks:
+        if not isinstance(network, dict):
+            raise ValueError("Each network must be a dictionary")
+
+        unknown = set(network) - set(NETWORK_OPTIONS)
+        if unknown:
+            raise ValueError("Unknown network options: %s" %
+                             ', '.join(sorted(unknown)))
+
+        merged = dict((option, config.get(option))
+                      for option in NETWORK_OPTIONS)
+        merged.update(network)
+
+        if not merged['network']:
+            raise ValueError("Network has no server to connect to")
+
+        if not merged['name']:
+            merged['name'] = merged['network']
+        merged['name'] = merged['name'].lower()
+
+        if merged['name'] in names:
+            raise ValueError("Network name is not unique: %s" %
+                             merged['name'])
+        names.add(merged['name'])
+
+        configs.append(merged)
+
+    return configs
+
+
+class NetworkManager(object):
+    """Runs Cardinal on several networks with one reactor.
+
+    Each network has its own CardinalBotFactory, and so its own nickname,
+    channels and plugins. The reactor is stopped once every network has been
+    disconnected from for good.
+    """
+
+    logger = None
+    """Logging object for NetworkManager"""
+
+    factories = None
+    """The CardinalBotFactory of each network, in the order they were added"""
+
+    shared_plugins = None
+    """Instance of SharedPlugins used by every network's PluginManager"""
+
+    def __init__(self, shared_plugins=None):
+        """Creates a manager without any networks.
+
+        Keyword arguments:
+          shared_plugins -- A list of plugins which every network loading them
+            should share one instance of.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.factories = []
+        self.shared_plugins = SharedPlugins(shared_plugins)
+
+        self._running = set()
+
+    def add(self, factory):
+        """Adds a network to be run.
+
+        Keyword arguments:
+          factory -- The network's CardinalBotFactory.
+
+        Raises:
+          ValueError -- When a network with the same name was already added.
+        """
+        if self.get(factory.name) is not None:
+            raise ValueError("Network already added: %s" % factory.name)
+
+        factory.networks = self
+        self.factories.append(factory)
+
+    def get(self, name):
+        """Returns the factory of the network with a given name, or None."""
+        for factory in self.factories:
+            if factory.name == name:
+                return factory
+
+        return None
+
+    def connect(self, factory, port, ssl=False):
+        """Connects to a network.
+
+        Keyword arguments:
+          factory -- The network's CardinalBotFactory.
+          port -- Port of the server to connect to.
+          ssl -- Whether to connect over SSL.
+        """
+        if factory not in self.factories:
+            self.add(factory)
+
+        self._running.add(factory.name)
+
+        if not ssl:
+            self.logger.info("Connecting over plaintext to %s:%d (%s)",
+                             factory.network, port, factory.name)
+
+            reactor.connectTCP(factory.network, port, factory)
+        else:
+            self.logger.info("Connecting over SSL to %s:%d (%s)",
+                             factory.network, port, factory.name)
+
+            # For SSL, we need to import the SSL module from Twisted
+            from twisted.internet import ssl
+            reactor.connectSSL(factory.network, port, factory,
+                               ssl.ClientContextFactory())
+
+    def install_signal_handlers(self):
+        """Disconnects from every network on SIGINT."""
+        signal.signal(signal.SIGINT, self._sigint)
+
+    def _sigint(self, signal, frame):
+        for factory in self.factories:
+            factory.shutdown('Received SIGINT.')
+
+    def stopped(self, factory):
+        """Called by a factory once it has disconnected for good.
+
+        Stops the reactor once no network is left running.
+
+        Keyword arguments:
+          factory -- The network's CardinalBotFactory.
+        """
+        self._running.discard(factory.name)
+
+        if self._running:
+            self.logger.info("Stopped %s, %d network(s) still running",
+                             factory.name, len(self._running))
+            return
+
+        self.logger.info("Stopped every network, quitting")
+        reactor.stop()
@@ -3,17 +3,24 @@ import sys
 import re
 import string
 import logging
+import functools
 import importlib
+import itertools
 import inspect
 import linecache
 import random
 import json
+import sre_parse
+import sre_constants
 import yaml
-from collections import defaultdict
+from collections import defaultdict, deque
 
+from twisted.internet import defer, reactor
+from twisted.python import threadable
+
+from cardinal.batching import Batch
 from cardinal.exceptions import (
     AmbiguousConfigError,
-    CommandNotFoundError,
     ConfigNotFoundError,
     EventAlreadyExistsError,
     EventCallbackError,
@@ -21,6 +28,334 @@ from cardinal.exceptions import (
     EventRejectedMessage,
     PluginError,
 )
+from cardinal.invocations import InvocationTracker
+from cardinal.metrics import Metrics
+from cardinal.ratelimit import RateLimiter
+from cardinal.threadpools import ThreadPoolManager, plugin_name
+
+
+class LiteralMatcher(object):
+    """Finds which of a set of literal strings occur within a message.
+
+    This is an Aho-Corasick automaton, compiled down to a full transition
+    table, so a message is scanned exactly once regardless of how many literals
+    are being searched for.
+    """
+
+    def __init__(self, literals):
+        """Compiles the automaton for a list of literals.
+
+        Keyword arguments:
+          literals -- An iterable of strings to search for.
+        """
+        goto = [{}]
+        output = [set()]
+
+        # Build a trie out of the literals, marking the state each literal
+        # ends on as an output of that literal
+        for literal in literals:
+            state = 0
+            for char in literal:
+                if char not in goto[state]:
+                    goto.append({})
+                    output.append(set())
+                    goto[state][char] = len(goto) - 1
+                state = goto[state][char]
+            output[state].add(literal)
+
+        # Breadth-first walk of the trie to compute failure links, and fill in
+        # the transitions for every state so that matching never needs to
+        # follow a failure link itself
+        fail = [0] * len(goto)
+        transitions = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            transitions[state] = dict(transitions[fail[state]])
+
+            for char, next_state in goto[state].iteritems():
+                fail[next_state] = transitions[fail[state]].get(char, 0)
+                transitions[state][char] = next_state
+                queue.append(next_state)
+
+            output[state] |= output[fail[state]]
+
+        self.transitions = transitions
+        self.output = [frozenset(literals) for literals in output]
+
+    def search(self, message):
+        """Returns the set of literals found within a message.
+
+        Keyword arguments:
+          message -- String to search.
+
+        Returns:
+          set -- Literals found in the message.
+        """
+        transitions = self.transitions
+        output = self.output
+
+        found = set()
+        state = 0
+        for char in message:
+            state = transitions[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+
+        return found
+
+
+class RegexDispatcher(object):
+    """Decides which regex commands need to be tested against a message.
+
+    When a set of commands is given to the dispatcher, a literal that any
+    match must contain is pulled out of each command's regex (for example
+    "ping" out of `^ping[.?!]?$`, or "!" out of `^!(.*)`.) All of these
+    literals are combined into a single `LiteralMatcher`, so each message is
+    scanned once, and only commands whose literal appears in the message have
+    their regex evaluated. Commands with no extractable literal are always
+    evaluated.
+
+    Literals are matched case-insensitively, which is a superset of what a
+    case-sensitive regex can match, so no command is ever skipped wrongly.
+    """
+
+    def __init__(self, commands=()):
+        """Compiles the dispatcher for a sequence of regex commands.
+
+        Keyword arguments:
+          commands -- A sequence of (plugin name, command) pairs. Each command
+            must have a `regex` attribute.
+        """
+        self.commands = tuple(commands)
+
+        self._regexes = []
+        self._unfiltered = []
+        self._literals = defaultdict(list)
+
+        for index, (_, command) in enumerate(self.commands):
+            if isinstance(command.regex, basestring):
+                regex = re.compile(command.regex)
+            else:
+                regex = command.regex
+            self._regexes.append(regex)
+
+            literal = self._required_literal(regex)
+            if literal:
+                self._literals[literal].append(index)
+            else:
+                self._unfiltered.append(index)
+
+        self._matcher = LiteralMatcher(self._literals.keys())
+
+    @classmethod
+    def _required_literal(cls, regex):
+        """Returns the longest literal any match of a regex must contain.
+
+        Keyword arguments:
+          regex -- A compiled regex.
+
+        Returns:
+          string -- A lowercase literal, or None if one couldn't be found.
+        """
+        try:
+            parsed = sre_parse.parse(regex.pattern, regex.flags)
+        except Exception:
+            return None
+
+        runs = cls._required_runs(parsed)
+        if not runs:
+            return None
+
+        return max(runs, key=len).lower()
+
+    @classmethod
+    def _required_runs(cls, subpattern):
+        """Finds runs of literal characters a parsed pattern must contain.
+
+        Only ASCII characters are considered part of a literal, so that
+        lowercasing them is consistent between patterns and messages. Anything
+        which isn't a mandatory literal (optional repeats, alternations,
+        character classes, etc.) ends the current run.
+
+        Keyword arguments:
+          subpattern -- A pattern parsed by `sre_parse`.
+
+        Returns:
+          list -- Literal strings which must all appear in a match.
+        """
+        runs = []
+        run = []
+
+        for op, av in subpattern:
+            char = None
+            if op == sre_constants.LITERAL:
+                char = av
+            elif (op == sre_constants.IN and len(av) == 1 and
+                    av[0][0] == sre_constants.LITERAL):
+                char = av[0][1]
+
+            if char is not None and char < 128:
+                run.append(chr(char))
+                continue
+
+            if run:
+                runs.append(''.join(run))
+                run = []
+
+            if op == sre_constants.SUBPATTERN:
+                runs.extend(cls._required_runs(av[-1]))
+            elif (op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+                    and av[0] >= 1):
+                runs.extend(cls._required_runs(av[2]))
+
+        if run:
+            runs.append(''.join(run))
+
+        return runs
+
+    def match(self, message):
+        """Finds the commands whose regex matches a message.
+
+        Keyword arguments:
+          message -- String to match against.
+
+        Returns:
+          list -- (plugin name, command) pairs in their original order.
+        """
+        candidates = list(self._unfiltered)
+        for literal in self._matcher.search(message.lower()):
+            candidates.extend(self._literals[literal])
+
+        if not candidates:
+            return []
+
+        candidates.sort()
+
+        return [self.commands[index] for index in candidates
+                if self._regexes[index].search(message)]
+
+
+class DispatchView(object):
+    """A precompiled, read-only set of the commands available in a channel.
+
+    Views are built by PluginManager from every loaded plugin except those
+    which have been blacklisted, so that dispatching a message doesn't need to
+    check any blacklists. They must not be modified once built; PluginManager
+    discards and rebuilds them when plugins or blacklists change.
+    """
+
+    __slots__ = ('plugins', 'command_index', 'regex_dispatcher')
+
+    def __init__(self, plugins):
+        """Builds a view from a list of plugins.
+
+        Commands are indexed by each of their triggers, so that a standard or
+        natural command can be resolved with a single dictionary lookup rather
+        than by checking every command of every plugin. Commands registered
+        with a regex are compiled into a RegexDispatcher so that only those
+        which could possibly match a message are tested against it.
+
+        Keyword arguments:
+          plugins -- A list of plugin dictionaries, as stored by PluginManager,
+            in the order their commands should be called.
+        """
+        command_index = defaultdict(list)
+        regex_commands = []
+
+        for plugin in plugins:
+            for command in plugin['commands']:
+                if hasattr(command, 'regex'):
+                    regex_commands.append((plugin['name'], command))
+
+                if hasattr(command, 'commands'):
+                    for trigger in command.commands:
+                        command_index[trigger].append(
+                            (plugin['name'], command))
+
+        self.plugins = tuple(plugin['name'] for plugin in plugins)
+        self.command_index = dict(
+            (trigger, tuple(commands))
+            for trigger, commands in command_index.iteritems()
+        )
+        self.regex_dispatcher = RegexDispatcher(regex_commands)
+
+
+class SharedPlugins(object):
+    """Plugin instances shared by the PluginManagers of several networks.
+
+    A shared plugin is set up by the first network to load it, and every
+    other network loading it uses the same instance. It's only closed once no
+    network is using it anymore. Commands and callbacks are still given the
+    `CardinalBot` of the network they were triggered on, but setup() is only
+    given the first network's, so plugins which keep it or store anything per
+    network shouldn't be shared.
+    """
+
+    plugins = None
+    """Names of the plugins which are shared"""
+
+    instances = None
+    """Maps each shared plugin's name to its current instance"""
+
+    def __init__(self, plugins=None):
+        """Creates an empty set of shared instances.
+
+        Keyword arguments:
+          plugins -- A list of the plugins to share.
+        """
+        self.plugins = set(plugins or ())
+        self.instances = {}
+
+        # Number of PluginManagers using each instance, keyed by its id()
+        self._references = {}
+
+    def __contains__(self, plugin):
+        return plugin in self.plugins
+
+    def acquire(self, plugin, create, reload=False):
+        """Returns the shared instance of a plugin, creating it if necessary.
+
+        Keyword arguments:
+          plugin -- Name of the plugin.
+          create -- Called with no arguments to create a new instance.
+          reload -- Whether to replace the current instance with a new one.
+            Networks already using the old one keep it until they reload.
+
+        Returns:
+          object -- The instance of the plugin.
+        """
+        instance = self.instances.get(plugin)
+        if instance is None or reload:
+            instance = create()
+            self.instances[plugin] = instance
+
+        key = id(instance)
+        self._references[key] = self._references.get(key, 0) + 1
+
+        return instance
+
+    def release(self, plugin, instance):
+        """Stops a PluginManager from using an instance of a plugin.
+
+        Keyword arguments:
+          plugin -- Name of the plugin.
+          instance -- The instance which was returned by acquire().
+
+        Returns:
+          bool -- Whether no other network is using the instance, and it
+            should be closed.
+        """
+        key = id(instance)
+        self._references[key] = self._references.get(key, 1) - 1
+        if self._references[key] > 0:
+            return False
+
+        del self._references[key]
+        if self.instances.get(plugin) is instance:
+            del self.instances[plugin]
+
+        return True
 
 
 class PluginManager(object):
@@ -38,6 +373,25 @@ class PluginManager(object):
     plugins = None
     """List of loaded plugins"""
 
+    thread_pools = None
+    """Instance of ThreadPoolManager used to run blocking commands"""
+
+    invocations = None
+    """Instance of InvocationTracker for commands that return Deferreds"""
+
+    rate_limiter = None
+    """Instance of RateLimiter which commands must be allowed by"""
+
+    metrics = None
+    """Instance of Metrics to record command latency in"""
+
+    shared_plugins = None
+    """Instance of SharedPlugins, if plugins are shared with other networks"""
+
+    dispatch_views = None
+    """Maps channels with blacklisted plugins to the DispatchView of commands
+    usable in them"""
+
     command_regex = re.compile(r'\.([A-Za-z0-9_-]+)\s?.*$')
     """Regex for matching standard commands.
 
@@ -57,13 +411,24 @@ class PluginManager(object):
     (additional arguments) which will be up to the plugin for handling.
     """
 
-    def __init__(self, cardinal, plugins=None,
-                 _plugin_module_import_prefix='plugins'):
+    def __init__(self, cardinal, plugins=None, thread_pools=None,
+                 invocations=None, rate_limiter=None, metrics=None,
+                 shared_plugins=None, _plugin_module_import_prefix='plugins'):
         """Creates a new instance, optionally with a list of plugins to load
 
         Keyword arguments:
           cardinal -- An instance of `CardinalBot` to pass to plugins.
           plugins -- A list of plugins to be loaded when instanced.
+          thread_pools -- An instance of `ThreadPoolManager` to run blocking
+            commands in. One will be created if not given.
+          invocations -- An instance of `InvocationTracker` to track commands
+            returning Deferreds with. One will be created if not given.
+          rate_limiter -- An instance of `RateLimiter` to throttle commands
+            with. One will be created if not given.
+          metrics -- An instance of `Metrics` to record command latency in.
+            One will be created if not given.
+          shared_plugins -- An instance of `SharedPlugins` holding plugin
+            instances shared with other networks, if any.
 
         Raises:
           TypeError -- When the `plugins` argument is not a list.
@@ -79,6 +444,28 @@ class PluginManager(object):
         # Set default to empty object
         self.plugins = {}
 
+        if thread_pools is None:
+            thread_pools = ThreadPoolManager()
+        self.thread_pools = thread_pools
+
+        if invocations is None:
+            invocations = InvocationTracker()
+        self.invocations = invocations
+
+        if rate_limiter is None:
+            rate_limiter = RateLimiter()
+        self.rate_limiter = rate_limiter
+
+        if metrics is None:
+            metrics = Metrics()
+        self.metrics = metrics
+
+        self.shared_plugins = shared_plugins
+
+        # Empty dispatch views until plugins are loaded
+        self.dispatch_views = {}
+        self._rebuild_dispatch_views()
+
         # To prevent circular dependencies, we can't sanity check this. Hope
         # for the best.
         self.cardinal = cardinal
@@ -265,6 +652,11 @@ class PluginManager(object):
 
         instance = self.plugins[plugin]['instance']
 
+        # Other networks may still be using a shared instance
+        if self._is_shared(plugin) and \
+                not self.shared_plugins.release(plugin, instance):
+            return
+
         if hasattr(instance, 'close') and inspect.ismethod(instance.close):
             # The plugin has a close method, so we now need to check how
             # many arguments the method has. If it only has one, then the
@@ -282,6 +674,10 @@ class PluginManager(object):
             else:
                 raise PluginError("Unknown arguments for close function")
 
+    def _is_shared(self, plugin):
+        return (self.shared_plugins is not None and
+                plugin in self.shared_plugins)
+
     def _load_plugin_config(self, plugin):
         """Loads a JSON or YAML config for a given plugin
 
@@ -311,12 +707,12 @@ class PluginManager(object):
         # File did not exist or we can't open it for another reason
         except IOError:
             self.logger.debug(
-                "Can't open %s - maybe it doesn't exist?" % file
+                "Can't open %s - maybe it doesn't exist?", file
             )
         # Thrown by json.load() when the content isn't valid JSON
         except ValueError:
             self.logger.warning(
-                "Invalid JSON in %s, skipping it" % file
+                "Invalid JSON in %s, skipping it", file
             )
 
         # Attempt to load and parse YAML config file
@@ -332,11 +728,11 @@ class PluginManager(object):
             f.close()
         except IOError:
             self.logger.debug(
-                "Can't open %s - maybe it doesn't exist?" % file
+                "Can't open %s - maybe it doesn't exist?", file
             )
         except ValueError:
             self.logger.warning(
-                "Invalid YAML in %s, skipping it" % file
+                "Invalid YAML in %s, skipping it", file
             )
         # Loaded YAML successfully
         else:
@@ -409,21 +805,75 @@ class PluginManager(object):
 
         return callbacks
 
+    def _rebuild_dispatch_views(self):
+        """Discards all dispatch views and rebuilds the default view.
+
+        The default view contains the commands of every loaded plugin, and is
+        shared by every channel which has no blacklisted plugins. This must be
+        called whenever the set of loaded plugins changes.
+        """
+        # Plugins are indexed in name order so that the order commands are
+        # called in is stable.
+        self._default_view = DispatchView(
+            [self.plugins[name] for name in sorted(self.plugins.keys())])
+        self._invalidate_dispatch_views()
+
+    def _invalidate_dispatch_views(self):
+        """Rebuilds the dispatch views of channels with blacklisted plugins.
+
+        Only channels named in a blacklist get a view of their own, so the
+        number of views is bounded by the blacklists rather than by every
+        channel and nick messages are received from. Channels with the same
+        set of blacklisted plugins share a view. This must be called whenever
+        a blacklist changes.
+        """
+        blacklists = defaultdict(set)
+        for name, plugin in self.plugins.iteritems():
+            for channel in plugin['blacklist']:
+                blacklists[channel].add(name)
+
+        views_by_blacklist = {}
+        self.dispatch_views = {}
+        for channel, blacklisted in blacklists.iteritems():
+            blacklisted = frozenset(blacklisted)
+
+            view = views_by_blacklist.get(blacklisted)
+            if view is None:
+                view = views_by_blacklist[blacklisted] = DispatchView([
+                    self.plugins[name] for name in sorted(self.plugins.keys())
+                    if name not in blacklisted
+                ])
+
+            self.dispatch_views[channel] = view
+
+    def dispatch_view(self, channel=None):
+        """Returns the DispatchView of commands usable in a channel.
+
+        Keyword arguments:
+          channel -- Channel to return the view for. If None, a view of every
+            loaded plugin's commands is returned.
+
+        Returns:
+          DispatchView -- Commands of plugins not blacklisted in the channel.
+        """
+        if channel is None:
+            return self._default_view
+
+        return self.dispatch_views.get(channel, self._default_view)
+
     def itercommands(self, channel=None):
         """Simple generator to iterate through all commands of loaded plugins.
 
         Returns:
           iterator -- Iterator for looping through commands
         """
-        # Loop through each plugin we have loaded
-        for name, plugin in self.plugins.items():
-            if channel is not None and channel in plugin['blacklist']:
-                continue
-
+        # Loop through each plugin we have loaded that isn't blacklisted in
+        # this channel
+        for name in self.dispatch_view(channel).plugins:
             # Loop through each of the plugins' commands (these are actually
             # class methods with attributes assigned to them, so they are all
             # callable) and yield the command
-            for command in plugin['commands']:
+            for command in self.plugins[name]['commands']:
                 yield command
 
     def load(self, plugins):
@@ -459,23 +909,26 @@ class PluginManager(object):
             # Reload flag so we can update the reload counter if necessary
             reload_flag = False
 
-            self.logger.info("Attempting to load plugin: %s" % plugin)
+            self.logger.info("Attempting to load plugin: %s", plugin)
 
             # Import each plugin's module with our own hacky function to reload
             # modules that have already been imported previously
             try:
                 if plugin in self.plugins.keys():
-                    self.logger.info("Already loaded, reloading: %s" % plugin)
+                    self.logger.info("Already loaded, reloading: %s", plugin)
                     reload_flag = True
 
                     # We don't consider this a failed plugin unless it doesn't
-                    # load correctly
-                    try:
-                        self._close_plugin_instance(plugin)
-                    except Exception:
-                        self.logger.exception(
-                            "Didn't close plugin cleanly: %s" % plugin
-                        )
+                    # load correctly. A shared instance is released when the
+                    # old plugin is unloaded instead, since other networks may
+                    # still be using it.
+                    if not self._is_shared(plugin):
+                        try:
+                            self._close_plugin_instance(plugin)
+                        except Exception:
+                            self.logger.exception(
+                                "Didn't close plugin cleanly: %s", plugin
+                            )
                     module_to_import = self.plugins[plugin]['module']
                 else:
                     module_to_import = plugin
@@ -484,7 +937,7 @@ class PluginManager(object):
             except Exception:
                 # Probably a syntax error in the plugin, log the exception
                 self.logger.exception(
-                    "Could not load plugin module: %s" % plugin
+                    "Could not load plugin module: %s", plugin
                 )
                 failed_plugins.append(plugin)
 
@@ -496,21 +949,28 @@ class PluginManager(object):
                 config = self._load_plugin_config(plugin)
             except AmbiguousConfigError:
                 # If two configs exist for the plugin, bail on loading
-                self.logger.exception("Could not load plugin: %s" % plugin)
+                self.logger.exception("Could not load plugin: %s", plugin)
                 failed_plugins.append(plugin)
 
                 continue
             except ConfigNotFoundError:
                 self.logger.debug(
-                    "No config found for plugin: %s" % plugin
+                    "No config found for plugin: %s", plugin
                 )
 
             # Instanstiate the plugin
             try:
-                instance = self._create_plugin_instance(module, config)
+                if self._is_shared(plugin):
+                    instance = self.shared_plugins.acquire(
+                        plugin,
+                        functools.partial(self._create_plugin_instance,
+                                          module, config),
+                        reload_flag)
+                else:
+                    instance = self._create_plugin_instance(module, config)
             except Exception:
                 self.logger.exception(
-                    "Could not instantiate plugin: %s" % plugin
+                    "Could not instantiate plugin: %s", plugin
                 )
                 failed_plugins.append(plugin)
 
@@ -523,10 +983,13 @@ class PluginManager(object):
                 callback_ids = self._register_plugin_callbacks(callbacks)
             except Exception:
                 self.logger.exception(
-                    "Could not register events for plugin: %s" % plugin
+                    "Could not register events for plugin: %s", plugin
                 )
                 failed_plugins.append(plugin)
 
+                if self._is_shared(plugin):
+                    self.shared_plugins.release(plugin, instance)
+
                 continue
 
             if plugin in self.plugins:
@@ -540,13 +1003,15 @@ class PluginManager(object):
                 'callbacks': callbacks,
                 'callback_ids': callback_ids,
                 'config': config,
-                'blacklist': [],
+                'blacklist': set(),
             }
 
             if reload_flag:
                 self.cardinal.reloads += 1
 
-            self.logger.info("Plugin %s successfully loaded" % plugin)
+            self.logger.info("Plugin %s successfully loaded", plugin)
+
+        self._rebuild_dispatch_views()
 
         return failed_plugins
 
@@ -579,10 +1044,10 @@ class PluginManager(object):
         failed_plugins = []
 
         for plugin in plugins:
-            self.logger.info("Attempting to unload plugin: %s" % plugin)
+            self.logger.info("Attempting to unload plugin: %s", plugin)
 
             if plugin not in self.plugins:
-                self.logger.warning("Plugin was never loaded: %s" % plugin)
+                self.logger.warning("Plugin was never loaded: %s", plugin)
                 failed_plugins.append(plugin)
                 continue
 
@@ -604,7 +1069,7 @@ class PluginManager(object):
                 # plugin, but don't skip over the plugin. We'll still
                 # unload it.
                 self.logger.exception(
-                    "Didn't close plugin cleanly: %s" % plugin
+                    "Didn't close plugin cleanly: %s", plugin
                 )
                 failed_plugins.append(plugin)
 
@@ -613,6 +1078,8 @@ class PluginManager(object):
             # location, so we'll get rid of that now.
             del self.plugins[plugin]
 
+        self._rebuild_dispatch_views()
+
         return failed_plugins
 
     def unload_all(self):
@@ -646,7 +1113,8 @@ class PluginManager(object):
         if plugin not in self.plugins:
             return False
 
-        self.plugins[plugin]['blacklist'].extend(channels)
+        self.plugins[plugin]['blacklist'].update(channels)
+        self._invalidate_dispatch_views()
 
         return True
 
@@ -680,6 +1148,8 @@ class PluginManager(object):
 
             self.plugins[plugin]['blacklist'].remove(channel)
 
+        self._invalidate_dispatch_views()
+
         return not_blacklisted
 
     def get_config(self, plugin):
@@ -707,76 +1177,139 @@ class PluginManager(object):
 
         return self.plugins[plugin]['config']
 
+    def _call_command(self, plugin, command, user, channel, message,
+                      rate_limit=True):
+        """Calls a single command.
+
+        Commands which have declared themselves blocking are run in their
+        plugin's thread pool, rather than on the reactor thread. If the command
+        runs asynchronously (either because it's blocking or because it
+        returned a Deferred) it's tracked until it completes or times out.
+
+        Commands are throttled by the rate limiter before any plugin code runs,
+        unless `rate_limit` is False. The time each command takes to complete
+        is recorded in the metrics.
+
+        Keyword arguments:
+          plugin -- Name of the plugin the command belongs to.
+          command -- The command to call.
+          user -- A tuple containing a user's nick, ident, and hostname.
+          channel -- A string representing where replies should be sent.
+          message -- A string containing a message received by CardinalBot.
+          rate_limit -- Whether to check the rate limiter first.
+        """
+        name = '%s.%s' % (plugin, command.__name__)
+        if rate_limit and not self.rate_limiter.allow(
+                '%s@%s' % (user.group(2), user.group(3)), channel, name):
+            return
+
+        started = self.metrics.clock()
+        if getattr(command, 'blocking', False):
+            d = self.thread_pools.run(plugin, command,
+                                      self.cardinal, user, channel, message)
+        else:
+            try:
+                d = command(self.cardinal, user, channel, message)
+            except Exception:
+                self.metrics.record(plugin, name, started, error=True)
+                raise
+
+            if not isinstance(d, defer.Deferred):
+                self.metrics.record(plugin, name, started)
+                return
+
+        self.invocations.track(name, d, getattr(command, 'timeout', None))
+        self.metrics.track(plugin, name, started, d)
+        d.addErrback(self._log_command_failure, plugin, command)
+
+    def _log_command_failure(self, failure, plugin, command):
+        """Logs an exception raised by a command that ran asynchronously."""
+        # Timeouts have already been logged by the tracker
+        if InvocationTracker.is_timeout(failure):
+            return
+
+        self.logger.error(
+            "Exception in command %s of plugin %s",
+            command.__name__, plugin,
+            exc_info=(failure.type, failure.value,
+                      failure.getTracebackObject())
+        )
+
     def call_command(self, user, channel, message):
         """Checks a message to see if it appears to be a command and calls it.
 
-        This is done by checking both the `command_regex` and
-        `natural_command_regex` properties on this object. If one or both of
-        these tests succeeds, we then check whether any plugins have registered
-        a matching command. If both of these tests fail, we will check whether
-        any plugins have registered a custom regex expression matching the
-        message.
+        Any plugins which have registered a custom regex expression matching
+        the message will be called first. We then check both the
+        `command_regex` and `natural_command_regex` properties on this object.
+        If one of these tests succeeds, the trigger is looked up in the command
+        index and any matching commands that weren't already called by regex
+        are called.
+
+        Only commands called by a trigger are rate limited, since regexes match
+        ordinary chatter, unless the rate limiter's `limit_regex` is set.
 
         Keyword arguments:
           user -- A tuple containing a user's nick, ident, and hostname.
           channel -- A string representing where replies should be sent.
           message -- A string containing a message received by CardinalBot.
 
-        Raises:
-          CommandNotFoundError -- If the message appeared to be a command but
-            no matching plugins are loaded.
+        Returns:
+          bool -- Whether any command matched, even if the rate limiter
+            stopped it from being called.
         """
-        # Keep track of whether we called a command for logging purposes
-        called_command = False
+        # Only commands from plugins not blacklisted in this channel
+        view = self.dispatch_view(channel)
+
+        # Keep track of the commands we've called so a command registered with
+        # both a regex and a trigger isn't called twice for the same message
+        called_commands = []
+
+        for name, command in view.regex_dispatcher.match(message):
+            self._call_command(name, command, user, channel, message,
+                               rate_limit=self.rate_limiter.limit_regex)
+            called_commands.append(command)
 
         # Perform a regex match of the message to our command regexes, since
         # only one of these can match, and the matching groups are in the same
         # order, we only need to check the second one if the first fails, and
         # we only need to use one variable to track this.
-        get_command = re.match(self.command_regex, message)
+        get_command = self.command_regex.match(message)
         if not get_command:
             get_command = re.match(
                 self.natural_command_regex % re.escape(self.cardinal.nickname),
                 message, flags=re.IGNORECASE)
 
-        # Iterate through all loaded commands
-        for command in self.itercommands(channel):
+        # Since standard command regex wasn't found, we weren't exactly
+        # expecting to find a command anyway.
+        if not get_command:
+            return len(called_commands) > 0
 
-            # Check whether the current command has a regex to match by, and if
-            # it does, and the message given to us matches the regex, then call
-            # the command.
-            if hasattr(command, 'regex') and re.search(command.regex, message):
-                command(self.cardinal, user, channel, message)
-                called_command = True
+        trigger = get_command.group(1)
+        for name, command in view.command_index.get(trigger, ()):
+            if command in called_commands:
                 continue
 
-            # If the message didn't match a typical command regex, then we can
-            # skip to the next command without checking whether this one
-            # matches the message.
-            if not get_command:
-                continue
+            self._call_command(name, command, user, channel, message)
+            called_commands.append(command)
 
-            # Check if the plugin defined any standard commands and whether any
-            # of them match the command we found in the message.
-            if (hasattr(command, 'commands') and
-                    get_command.group(1) in command.commands):
-                # Matched this command, so call it.
-                called_command = True
-                command(self.cardinal, user, channel, message)
-                continue
-
-        # Since standard command regex wasn't found, there's no need to raise
-        # an exception - we weren't exactly expecting to find a command anyway.
-        # Alternatively, if we called a command, no need to raise an exception.
-        if not get_command or called_command:
-            return
+        if len(called_commands) > 0:
+            return True
 
         # Since we found something that matched a command regex, yet no plugins
-        # that were loaded had a command matching, we can raise an exception.
-        raise CommandNotFoundError(
-            "Command syntax detected, but no matching command found: %s" %
-            message
-        )
+        # that were loaded had a command matching, log it. Anyone can trigger
+        # this, so it's not really a bad thing.
+        self.logger.info("Unable to find a matching command: %s", trigger)
+
+        return False
+
+
+_FILTER_PARAMS = {
+    'channels': ('channel', lambda value: value.lower()),
+    'commands': ('command', lambda value: value.upper()),
+    'prefix': ('message', None),
+}
+"""Maps callback filters to the event parameter they test, and a function
+normalizing values before they're compared"""
 
 
 class EventManager(object):
@@ -789,86 +1322,251 @@ class EventManager(object):
     registered_callbacks = None
     """Contains all the registered callbacks"""
 
-    def __init__(self, cardinal):
-        """Initializes the logger"""
+    event_params = None
+    """Maps event names to a tuple naming their parameters, if given"""
+
+    compiled_callbacks = None
+    """Maps registered event names to a tuple of their callbacks in order.
+
+    Each callback is represented by a tuple of its ID, the callable, its
+    plugin's name, its metrics key, its compiled filters, and its Batch (for
+    batched callbacks), so fire() doesn't have to work them out each time.
+    Rebuilt whenever an event or callback is added or removed.
+    """
+
+    callback_filters = None
+    """Maps event names to a dictionary of callback IDs to their filters"""
+
+    callback_batches = None
+    """Maps event names to a dictionary of callback IDs to their Batch"""
+
+    callback_priorities = None
+    """Maps event names to a dictionary of callback IDs to sort keys"""
+
+    first_acceptor_events = None
+    """Names of events which stop at the first callback to accept them"""
+
+    thread_pools = None
+    """Instance of ThreadPoolManager used to run blocking callbacks"""
+
+    invocations = None
+    """Instance of InvocationTracker for callbacks that return Deferreds"""
+
+    metrics = None
+    """Instance of Metrics to record callback latency in"""
+
+    event_timeouts = None
+    """Maps event names to the timeout for their callbacks, if registered"""
+
+    callback_budget = 0.25
+    """Seconds a callback may run synchronously before a warning is logged"""
+
+    slow_warning_interval = 60
+    """Minimum seconds between slow warnings for the same callback"""
+
+    def __init__(self, cardinal, thread_pools=None, invocations=None,
+                 metrics=None, callback_budget=None):
+        """Initializes the logger
+
+        Keyword arguments:
+          cardinal -- An instance of `CardinalBot` to pass to callbacks.
+          thread_pools -- An instance of `ThreadPoolManager` to run blocking
+            callbacks in. One will be created if not given.
+          invocations -- An instance of `InvocationTracker` to track callbacks
+            returning Deferreds with. One will be created if not given.
+          metrics -- An instance of `Metrics` to record callback latency in.
+            One will be created if not given.
+          callback_budget -- Seconds a callback may run synchronously before a
+            warning is logged.
+        """
         self.cardinal = cardinal
         self.logger = logging.getLogger(__name__)
 
+        if thread_pools is None:
+            thread_pools = ThreadPoolManager()
+        self.thread_pools = thread_pools
+
+        if invocations is None:
+            invocations = InvocationTracker()
+        self.invocations = invocations
+
+        if metrics is None:
+            metrics = Metrics()
+        self.metrics = metrics
+
+        if callback_budget is not None:
+            self.callback_budget = callback_budget
+
+        # Maps metrics keys to when a slow warning was last logged for them,
+        # and how many were suppressed since
+        self._slow_warnings = {}
+
+        self.event_timeouts = {}
+        self.event_params = {}
+        self.first_acceptor_events = set()
+
         self.registered_events = defaultdict(dict)
         self.registered_callbacks = defaultdict(dict)
+        self.callback_priorities = defaultdict(dict)
+        self.callback_filters = defaultdict(dict)
+        self.callback_batches = defaultdict(dict)
+        self.compiled_callbacks = {}
+
+        # Used to keep callbacks of equal priority in registration order
+        self._callback_counter = itertools.count()
 
-    def register(self, name, required_params):
+    def register(self, name, required_params, timeout=None,
+                 first_acceptor=False, params=None):
         """Registers a plugin's event so other events can set callbacks.
 
         Keyword arguments:
           name -- Name of the event.
           required_params -- Number of parameters a callback must take.
+          timeout -- Seconds a callback returning a Deferred may take before
+            it's cancelled. Overrides the default, but not a timeout set on the
+            callback itself.
+          first_acceptor -- Whether firing the event should stop at the first
+            callback which accepts it, rather than calling every callback.
+          params -- A tuple naming each parameter. Callbacks may only filter
+            on parameters named `channel`, `command` or `message`.
 
         Raises:
           EventAlreadyExistsError -- If register is attempted for an event name
             already in use.
-          TypeError -- If required_params is not a number.
+          TypeError -- If required_params is not a number, or params doesn't
+            name each parameter.
         """
-        self.logger.debug("Attempting to register event: %s" % name)
+        self.logger.debug("Attempting to register event: %s", name)
 
         if name in self.registered_events:
-            self.logger.debug("Event already exists: %s" % name)
+            self.logger.debug("Event already exists: %s", name)
             raise EventAlreadyExistsError("Event already exists: %s" % name)
 
         if not isinstance(required_params, (int, long)):
-            self.logger.debug("Invalid required params: %s" % name)
+            self.logger.debug("Invalid required params: %s", name)
             raise TypeError("Required params must be an integer")
 
+        if params is not None and len(params) != required_params:
+            self.logger.debug("Invalid param names: %s", name)
+            raise TypeError("Params must name each required param")
+
         self.registered_events[name] = required_params
+        if params is not None:
+            self.event_params[name] = tuple(params)
+        if timeout is not None:
+            self.event_timeouts[name] = timeout
+        if first_acceptor:
+            self.first_acceptor_events.add(name)
         if name not in self.registered_callbacks:
             self.registered_callbacks[name] = {}
 
-        self.logger.info("Registered event: %s" % name)
+        # Callbacks may have been registered before the event was
+        self._compile_callbacks(name)
+
+        self.logger.info("Registered event: %s", name)
 
     def remove(self, name):
         """Removes a registered event."""
-        self.logger.debug("Attempting to unregister event: %s" % name)
+        self.logger.debug("Attempting to unregister event: %s", name)
 
         if name not in self.registered_events:
-            self.logger.debug("Event does not exist: %s" % name)
+            self.logger.debug("Event does not exist: %s", name)
             raise EventDoesNotExistError(
                 "Can't remove nonexistent event: %s" % name
             )
 
+        for batch in self.callback_batches.pop(name, {}).values():
+            batch.cancel()
+
         del self.registered_events[name]
         del self.registered_callbacks[name]
+        del self.compiled_callbacks[name]
+        self.callback_priorities.pop(name, None)
+        self.callback_filters.pop(name, None)
+        self.event_params.pop(name, None)
+        self.event_timeouts.pop(name, None)
+        self.first_acceptor_events.discard(name)
 
-        self.logger.info("Removed event: %s" % name)
+        self.logger.info("Removed event: %s", name)
 
-    def register_callback(self, event_name, callback):
+    def register_callback(self, event_name, callback, priority=None,
+                          filters=None, batch=None):
         """Registers a callback to be called when an event fires.
 
         Keyword arguments:
           event_name -- Event name to bind callback to.
           callback -- Callable to bind.
+          priority -- Callbacks with a higher priority are called first.
+            Defaults to the callback's `priority` attribute (set by the
+            `@event` decorator) or 0. Callbacks of equal priority are called
+            in the order they were registered.
+          filters -- A dictionary limiting which firings the callback is
+            called for. `channels` and `commands` are lists of values the
+            event's `channel` or `command` parameter must be one of (ignoring
+            case) and `prefix` is a string the `message` parameter must start
+            with. Defaults to the callback's `filters` attribute (set by the
+            `@event` decorator.)
+          batch -- True, or a dictionary which may contain a `size` and an
+            `interval` in milliseconds, to have the callback called with a
+            list of each firing's params once `size` firings have accumulated
+            or `interval` has passed. By default, firings are delivered at the
+            end of the reactor iteration. Batched callbacks take a single
+            param (after CardinalBot) and don't count towards fire()'s return
+            value. Defaults to the callback's `batch` attribute (set by the
+            `@event` decorator.)
 
         Raises:
-          EventCallbackError -- If an invalid callback is passed in.
+          EventCallbackError -- If an invalid callback is passed in, or its
+            filters can't be applied to the event.
         """
         self.logger.debug(
-            "Attempting to register callback for event: %s" % event_name
+            "Attempting to register callback for event: %s", event_name
         )
 
         if not callable(callback):
-            self.logger.debug("Invalid callback for event: %s" % event_name)
+            self.logger.debug("Invalid callback for event: %s", event_name)
             raise EventCallbackError(
                 "Can't register callback that isn't callable"
             )
 
+        if filters is None:
+            filters = getattr(callback, 'filters', None)
+
+        for key in filters or ():
+            if key not in _FILTER_PARAMS:
+                self.logger.debug("Invalid filter for event: %s", event_name)
+                raise EventCallbackError("Unknown callback filter: %s" % key)
+
+        if batch is None:
+            batch = getattr(callback, 'batch', None)
+        if batch is True:
+            batch = {}
+        if batch is not None and not isinstance(batch, dict):
+            self.logger.debug("Invalid batch for event: %s", event_name)
+            raise EventCallbackError("Batch must be True or a dictionary")
+
         # If no event is registered, we will still register the callback but
         # we can't sanity check it since the event hasn't been registered yet
         if event_name not in self.registered_events:
-            return self._add_callback(event_name, callback)
+            return self._add_callback(event_name, callback, priority, filters,
+                                      batch)
+
+        params = self.event_params.get(event_name, ())
+        for key in filters or ():
+            if _FILTER_PARAMS[key][0] not in params:
+                self.logger.debug("Invalid filter for event: %s", event_name)
+                raise EventCallbackError(
+                    "Can't filter event %s by %s" % (event_name, key)
+                )
 
         argspec = inspect.getargspec(callback)
         num_func_args = len(argspec.args)
-        # Add one to needed args to account for CardinalBot being passed in
-        num_needed_args = self.registered_events[event_name] + 1
+        # Add one to needed args to account for CardinalBot being passed in.
+        # Batched callbacks receive a single list of params.
+        if batch is not None:
+            num_needed_args = 2
+        else:
+            num_needed_args = self.registered_events[event_name] + 1
 
         # If it's a method, it'll have an arbitrary "self" argument we don't
         # want to include in our param count
@@ -877,14 +1575,15 @@ class EventManager(object):
 
         if (num_func_args != num_needed_args and
                 not argspec.varargs):
-            self.logger.debug("Invalid callback for event: %s" % event_name)
+            self.logger.debug("Invalid callback for event: %s", event_name)
             raise EventCallbackError(
                 "Can't register callback with wrong number of arguments "
                 "(%d needed, %d given)" %
                 (num_needed_args, num_func_args)
             )
 
-        return self._add_callback(event_name, callback)
+        return self._add_callback(event_name, callback, priority, filters,
+                                  batch)
 
     def remove_callback(self, event_name, callback_id):
         """Removes a callback with a given ID from an event's callback list.
@@ -894,24 +1593,30 @@ class EventManager(object):
           callback_id -- The ID generated when the callback was added.
         """
         self.logger.debug(
-            "Removing callback %s from callback list for event: %s" %
-            (callback_id, event_name)
+            "Removing callback %s from callback list for event: %s",
+            callback_id, event_name
         )
 
         if event_name not in self.registered_callbacks:
             self.logger.debug(
-                "Callback %s: Event has no callback list" % callback_id
+                "Callback %s: Event has no callback list", callback_id
             )
             return
 
         if callback_id not in self.registered_callbacks[event_name]:
             self.logger.debug(
-                "Callback %s: Callback does not exist in callback list" %
+                "Callback %s: Callback does not exist in callback list",
                 callback_id
             )
             return
 
         del self.registered_callbacks[event_name][callback_id]
+        del self.callback_priorities[event_name][callback_id]
+        self.callback_filters[event_name].pop(callback_id, None)
+        batch = self.callback_batches[event_name].pop(callback_id, None)
+        if batch is not None:
+            batch.cancel()
+        self._compile_callbacks(event_name)
 
         self.logger.info("Removed callback %s for event: %s",
                          callback_id, event_name)
@@ -919,6 +1624,20 @@ class EventManager(object):
     def fire(self, name, *params):
         """Calls all callbacks with given event name.
 
+        Callbacks are called in order of priority. If the event was registered
+        with `first_acceptor`, no more callbacks are called once one has
+        accepted the event (i.e. didn't raise EventRejectedMessage).
+
+        Callbacks which have declared themselves blocking are run in their
+        plugin's thread pool when the event is fired from the reactor thread.
+        Since they can't accept or reject the event before fire() returns, they
+        don't count towards its return value. If the event is fired from
+        another thread (e.g. by a blocking command) they are called directly.
+
+        A callback may also return a Deferred, in which case it's considered to
+        have accepted the event. It will be cancelled if it doesn't fire within
+        the callback's timeout.
+
         Keyword arguments:
           name -- Event name to fire.
           params -- Params to pass to callbacks.
@@ -929,52 +1648,195 @@ class EventManager(object):
         Returns:
           boolean -- Whether a callback (or multiple) was called successfully.
         """
-        self.logger.debug("Attempting to fire event: %s" % name)
-
-        if name not in self.registered_events:
-            self.logger.debug("Event does not exist: %s" % name)
+        try:
+            callbacks = self.compiled_callbacks[name]
+        except KeyError:
+            self.logger.debug("Event does not exist: %s", name)
             raise EventDoesNotExistError(
                 "Can't call an event that does not exist: %s" % name
             )
 
-        callbacks = self.registered_callbacks[name]
-        self.logger.debug(
-            "Calling %d callbacks for event: %s" %
-            (len(callbacks), name)
-        )
+        # Most lines fire events nobody is listening to, so bail out early
+        if not callbacks:
+            return False
+
+        self.logger.debug("Calling %d callbacks for event: %s",
+                          len(callbacks), name)
+
+        in_reactor_thread = threadable.isInIOThread()
+        first_acceptor = name in self.first_acceptor_events
 
         accepted = False
-        for callback_id, callback in callbacks.iteritems():
+        for entry in callbacks:
+            callback_id, callback, plugin, key, filters, batch = entry
+
+            # Evaluate filters before calling into plugin code
+            if filters and not self._filters_match(filters, params):
+                continue
+
+            if batch is not None:
+                batch.add(params)
+                continue
+
+            if in_reactor_thread and getattr(callback, 'blocking', False):
+                self._fire_in_thread(name, entry, params)
+                continue
+
+            started = self.metrics.clock()
             try:
-                callback(self.cardinal, *params)
-                self.logger.debug(
-                    "Callback %s accepted event: %s" %
-                    (callback_id, name)
-                )
+                result = callback(self.cardinal, *params)
+                if isinstance(result, defer.Deferred):
+                    self._track_callback(name, entry, result, started)
+                else:
+                    self._record_callback(plugin, key, started)
+
+                self.logger.debug("Callback %s accepted event: %s",
+                                  callback_id, name)
                 accepted = True
             # If this exception is received, the plugin told us not to set the
             # called flag true, so we can just log it and continue on. This
             # might happen if a plugin realizes the event does not apply to it
             # and wants the original caller to handle it normally.
             except EventRejectedMessage:
-                self.logger.debug(
-                    "Callback %s rejected event: %s" %
-                    (callback_id, name)
-                )
+                self._record_callback(plugin, key, started)
+                self.logger.debug("Callback %s rejected event: %s",
+                                  callback_id, name)
             except Exception:
+                self._record_callback(plugin, key, started, error=True)
                 self.logger.exception(
-                    "Exception during callback %s for event: %s" %
-                    (callback_id, name)
-                )
+                    "Exception during callback %s for event: %s",
+                    callback_id, name)
+
+            if accepted and first_acceptor:
+                break
 
         return accepted
 
-    def _add_callback(self, event_name, callback):
+    def _fire_in_thread(self, name, entry, params):
+        """Calls a blocking callback in its plugin's thread pool.
+
+        Keyword arguments:
+          name -- Event name being fired.
+          entry -- The callback's entry in `compiled_callbacks`.
+          params -- Params to pass to the callback.
+        """
+        _, callback, plugin, _, _, _ = entry
+
+        started = self.metrics.clock()
+        d = self.thread_pools.run(plugin, callback, self.cardinal, *params)
+        self._track_callback(name, entry, d, started)
+
+    def _deliver_batch(self, name, entry, items):
+        """Calls a batched callback with the params of accumulated firings.
+
+        Keyword arguments:
+          name -- Event name the firings were for.
+          entry -- The callback's entry in `compiled_callbacks`.
+          items -- A list of params, one tuple per firing.
+        """
+        callback_id, callback, plugin, key, _, _ = entry
+        if getattr(callback, 'blocking', False):
+            self._fire_in_thread(name, entry, (items,))
+            return
+
+        started = self.metrics.clock()
+        try:
+            result = callback(self.cardinal, items)
+            if isinstance(result, defer.Deferred):
+                self._track_callback(name, entry, result, started)
+            else:
+                self._record_callback(plugin, key, started)
+        except EventRejectedMessage:
+            self._record_callback(plugin, key, started)
+        except Exception:
+            self._record_callback(plugin, key, started, error=True)
+            self.logger.exception(
+                "Exception during batched callback %s for event: %s",
+                callback_id, name)
+
+    def _record_callback(self, plugin, key, started, error=False):
+        """Records a callback which ran synchronously, warning if it was slow.
+
+        Warnings for each callback are rate limited, so a callback that's slow
+        every time a busy event fires doesn't flood the log.
+
+        Keyword arguments:
+          plugin -- Name of the plugin the callback belongs to.
+          key -- Metrics key of the callback.
+          started -- Time the callback was called.
+          error -- Whether the callback raised an exception.
+        """
+        elapsed = self.metrics.record(plugin, key, started, error)
+        if elapsed <= self.callback_budget:
+            return
+
+        now = self.metrics.clock()
+        last_warned, suppressed = self._slow_warnings.get(key, (None, 0))
+        if (last_warned is not None and
+                now - last_warned < self.slow_warning_interval):
+            self._slow_warnings[key] = (last_warned, suppressed + 1)
+            return
+
+        self._slow_warnings[key] = (now, 0)
+        self.logger.warning(
+            "Callback %s of plugin %s took %.3f seconds, over the budget of "
+            "%.3f seconds (%d more slow calls since the last warning)",
+            key, plugin, elapsed, self.callback_budget, suppressed)
+
+    def _track_callback(self, name, entry, d, started):
+        """Tracks a callback running asynchronously until it completes.
+
+        Keyword arguments:
+          name -- Event name being fired.
+          entry -- The callback's entry in `compiled_callbacks`.
+          d -- Deferred which fires when the callback completes.
+          started -- Time the callback was called, for metrics.
+        """
+        # Events may be fired from thread pools, e.g. by blocking commands,
+        # but the tracker schedules timeouts, which is only safe on the
+        # reactor thread
+        if not threadable.isInIOThread():
+            reactor.callFromThread(self._track_callback, name, entry, d,
+                                   started)
+            return
+
+        callback_id, callback, plugin, key, _, _ = entry
+
+        def log_failure(failure):
+            # Timeouts have already been logged by the tracker
+            if InvocationTracker.is_timeout(failure):
+                return
+
+            if failure.check(EventRejectedMessage):
+                self.logger.debug(
+                    "Callback %s rejected event: %s", callback_id, name)
+                return
+
+            self.logger.error(
+                "Exception during callback %s for event: %s",
+                callback_id, name,
+                exc_info=(failure.type, failure.value,
+                          failure.getTracebackObject())
+            )
+
+        timeout = getattr(callback, 'timeout', None)
+        if timeout is None:
+            timeout = self.event_timeouts.get(name)
+
+        self.invocations.track(key, d, timeout)
+        self.metrics.track(plugin, key, started, d)
+        d.addErrback(log_failure)
+
+    def _add_callback(self, event_name, callback, priority=None,
+                      filters=None, batch=None):
         """Adds a callback to the event's callback list and returns an ID.
 
         Keyword arguments:
           event_name -- Event name to add the callback to.
           callback -- The callback to add.
+          priority -- Priority of the callback. See register_callback().
+          filters -- Filters for the callback. See register_callback().
+          batch -- Batch options for the callback. See register_callback().
 
         Returns:
           string -- A callback ID to reference the callback with for removal.
@@ -984,14 +1846,111 @@ class EventManager(object):
                 callback_id in self.registered_callbacks[event_name]):
             callback_id = self._generate_id()
 
+        if priority is None:
+            priority = getattr(callback, 'priority', 0)
+
         self.registered_callbacks[event_name][callback_id] = callback
-        self.logger.info(
-            "Registered callback %s for event: %s" %
-            (callback_id, event_name)
-        )
+        self.callback_priorities[event_name][callback_id] = \
+            (-priority, next(self._callback_counter))
+        if filters:
+            self.callback_filters[event_name][callback_id] = filters
+        if batch is not None:
+            entry = (callback_id, callback, plugin_name(callback),
+                     '%s:%s' % (event_name, callback_id), (), None)
+            self.callback_batches[event_name][callback_id] = Batch(
+                functools.partial(self._deliver_batch, event_name, entry),
+                batch.get('size'), batch.get('interval'))
+        self._compile_callbacks(event_name)
+
+        self.logger.info("Registered callback %s for event: %s",
+                         callback_id, event_name)
 
         return callback_id
 
+    def _compile_callbacks(self, event_name):
+        """Rebuilds the ordered tuple of callbacks fire() iterates over.
+
+        Nothing is compiled for events which haven't been registered, since
+        they can't be fired.
+
+        Keyword arguments:
+          event_name -- Event name to compile the callbacks of.
+        """
+        if event_name not in self.registered_events:
+            return
+
+        priorities = self.callback_priorities[event_name]
+        callbacks = sorted(self.registered_callbacks[event_name].items(),
+                           key=lambda item: priorities[item[0]])
+
+        compiled = []
+        for callback_id, callback in callbacks:
+            try:
+                filters = self._compile_filters(
+                    event_name, self.callback_filters[event_name].get(
+                        callback_id, {}))
+            except KeyError as e:
+                # Registered before the event, so it couldn't be checked
+                self.logger.warning(
+                    "Callback %s can't filter event %s by %s, ignoring it",
+                    callback_id, event_name, e.args[0])
+                continue
+
+            compiled.append((callback_id,
+                             callback,
+                             plugin_name(callback),
+                             '%s:%s' % (event_name, callback_id),
+                             filters,
+                             self.callback_batches[event_name].get(
+                                 callback_id)))
+
+        self.compiled_callbacks[event_name] = tuple(compiled)
+
+    def _compile_filters(self, event_name, filters):
+        """Converts a callback's filters into tuples fire() can test quickly.
+
+        Keyword arguments:
+          event_name -- Event name the filters apply to.
+          filters -- The callback's filters.
+
+        Returns:
+          tuple -- A tuple per filter of the index of the parameter tested,
+            the function normalizing it (or None) and either a frozenset of
+            allowed values or a prefix string.
+
+        Raises:
+          KeyError -- If the event has no parameter a filter applies to.
+        """
+        params = self.event_params.get(event_name, ())
+
+        compiled = []
+        for key, value in filters.items():
+            param, normalize = _FILTER_PARAMS[key]
+            if param not in params:
+                raise KeyError(key)
+
+            if normalize is not None:
+                if isinstance(value, basestring):
+                    value = [value]
+                value = frozenset(normalize(v) for v in value)
+
+            compiled.append((params.index(param), normalize, value))
+
+        return tuple(compiled)
+
+    @staticmethod
+    def _filters_match(filters, params):
+        """Whether event parameters pass a callback's compiled filters."""
+        for index, normalize, value in filters:
+            param = params[index]
+            if normalize is None:
+                if not param.startswith(value):
+                    return False
+            elif normalize(param) not in value:
+                return False
+
+        return True
+
     def _generate_id(size=6, chars=string.ascii_uppercase + string.digits):
         """
         Thank you StackOverflow: http://stackoverflow.com/a/2257449/242129
@@ -0,0 +1,195 @@
+import logging
+
+from twisted.internet import reactor
+
+
+class TokenBucket(object):
+    """Allows events at a steady rate, with bursts up to a fixed size.
+
+    The bucket holds up to `burst` tokens and is refilled at `rate` tokens per
+    second. Each event consumes a single token, and events are refused while
+    the bucket is empty.
+    """
+
+    rate = None
+    """Tokens added to the bucket per second"""
+
+    burst = None
+    """Maximum number of tokens the bucket can hold"""
+
+    tokens = None
+    """Number of tokens currently in the bucket"""
+
+    updated = None
+    """Time the tokens were last refilled"""
+
+    def __init__(self, rate, burst, now):
+        """Initializes a full bucket.
+
+        Keyword arguments:
+          rate -- Tokens added per second.
+          burst -- Maximum number of tokens.
+          now -- The current time.
+        """
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated = now
+
+    def refill(self, now):
+        """Adds the tokens accumulated since the bucket was last refilled.
+
+        Keyword arguments:
+          now -- The current time.
+
+        Returns:
+          float -- Number of tokens in the bucket.
+        """
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+        return self.tokens
+
+    def is_full(self, now):
+        """Whether the bucket has refilled completely.
+
+        Keyword arguments:
+          now -- The current time.
+        """
+        return self.refill(now) >= self.burst
+
+
+class RateLimiter(object):
+    """Limits how often commands can be triggered.
+
+    Separate token buckets are kept for each ident@host, each channel, and each
+    command, and a command is only allowed if every one has a token to spare.
+    Every scope is disabled unless configured, so commands aren't limited at
+    all by default. The command budget is shared by every user and channel,
+    and individual commands may be given their own. Buckets are created
+    lazily and discarded once they've refilled, so memory use is bounded by
+    the number of recently active users and channels.
+    """
+
+    logger = None
+    """Logging object for RateLimiter"""
+
+    budgets = {
+        'user': None,
+        'channel': None,
+        'command': None,
+    }
+    """Default rate and burst for each scope. None disables a scope."""
+
+    limit_regex = False
+    """Whether commands matched by their regex, rather than by a trigger, are
+    rate limited. Regexes such as URL matchers see ordinary chatter, so they
+    aren't by default."""
+
+    max_buckets = 1024
+    """Number of buckets to hold before discarding full ones"""
+
+    buckets = None
+    """Maps (scope, key) tuples to TokenBucket instances"""
+
+    dropped = 0
+    """Number of commands refused since the limiter was created"""
+
+    def __init__(self, config=None, clock=None):
+        """Initializes the limiter.
+
+        Keyword arguments:
+          config -- A dictionary which may contain `user`, `channel` and
+            `command` budgets, each a dictionary with a `rate` (per second) and
+            `burst`, or None to disable that scope. A `commands` dictionary
+            may override the command budget for individual commands, keyed by
+            `plugin.command`. Setting `regex` to true rate limits commands
+            matched by their regex as well.
+          clock -- Provider of IReactorTime, to allow for testing.
+        """
+        self.logger = logging.getLogger(__name__)
+
+        if config is None:
+            config = {}
+
+        self.budgets = dict(self.budgets)
+        for scope in ('user', 'channel', 'command'):
+            if scope in config:
+                self.budgets[scope] = config[scope]
+
+        self.command_budgets = config.get('commands', {})
+        self.limit_regex = config.get('regex', self.limit_regex)
+
+        self.clock = clock if clock is not None else reactor
+
+        self.buckets = {}
+
+        for scope in ('user', 'channel', 'command'):
+            budget = self.budgets[scope]
+            if budget is not None:
+                self.logger.info(
+                    "Rate limiting commands per %s to %s a second, bursts of "
+                    "%s", scope, budget['rate'], budget['burst'])
+        for command, budget in sorted(self.command_budgets.items()):
+            self.logger.info(
+                "Rate limiting %s to %s a second, bursts of %s",
+                command, budget['rate'], budget['burst'])
+
+    def _get_bucket(self, scope, key, budget, now):
+        try:
+            return self.buckets[(scope, key)]
+        except KeyError:
+            pass
+
+        if len(self.buckets) >= self.max_buckets:
+            self._prune(now)
+
+        bucket = TokenBucket(budget['rate'], budget['burst'], now)
+        self.buckets[(scope, key)] = bucket
+
+        return bucket
+
+    def _prune(self, now):
+        """Discards buckets which have refilled, since they're equivalent to
+        new ones."""
+        for key, bucket in self.buckets.items():
+            if bucket.is_full(now):
+                del self.buckets[key]
+
+    def allow(self, hostmask, channel, command):
+        """Consumes a token for a command, if every bucket has one available.
+
+        Keyword arguments:
+          hostmask -- The ident@host of the user who triggered the command.
+          channel -- Channel the command was triggered in.
+          command -- Name of the command, as `plugin.command`.
+
+        Returns:
+          bool -- Whether the command may be called.
+        """
+        now = self.clock.seconds()
+
+        budgets = (
+            ('user', hostmask, self.budgets['user']),
+            ('channel', channel, self.budgets['channel']),
+            ('command', command,
+             self.command_budgets.get(command, self.budgets['command'])),
+        )
+
+        buckets = [self._get_bucket(scope, key, budget, now)
+                   for scope, key, budget in budgets
+                   if budget is not None]
+
+        for bucket in buckets:
+            if bucket.refill(now) < 1:
+                self.dropped += 1
+                self.logger.debug("Rate limited %s from %s in %s",
+                                  command, hostmask, channel)
+                return False
+
+        for bucket in buckets:
+            bucket.tokens -= 1
+
+        return True
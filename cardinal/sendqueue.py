@@ -0,0 +1,275 @@
+import logging
+from collections import OrderedDict, deque
+
+from twisted.internet import reactor
+
+from cardinal.ratelimit import TokenBucket
+
+PRIORITY_HIGH = 0
+"""Protocol and admin traffic, which skips per-target pacing and never
+goes stale"""
+
+PRIORITY_NORMAL = 1
+"""Ordinary replies"""
+
+PRIORITY_LOW = 2
+"""Bulk output which may wait behind everything else"""
+
+
+class SendQueue(object):
+    """Paces lines sent to the server so the bot isn't killed for flooding.
+
+    Most ircds allow a short burst of lines and then penalize clients which
+    keep sending faster than about one line a second. Every line must take a
+    token from a global bucket, and lines addressed to a target (a channel or
+    nick) must also take one from that target's bucket, so one busy channel
+    can't starve the others. Targets take turns, and higher priority lines are
+    always sent first.
+
+    Lines which have been queued for longer than `max_age` are dropped rather
+    than sent late. A long reply is split into a first line followed by
+    continuation lines, which are dropped along with a stale first line but
+    are otherwise never stale, so once a reply has begun it's sent in full
+    however long pacing takes. Commands which have the same effect however
+    many times they're sent (e.g. MODE) are merged into an identical line
+    already waiting, but messages never are, since saying the same thing
+    twice may be intended.
+    """
+
+    logger = None
+    """Logging object for SendQueue"""
+
+    rate = 1
+    """Lines per second allowed by the global bucket"""
+
+    burst = 5
+    """Size of the global bucket"""
+
+    target_rate = 0.5
+    """Lines per second allowed to a single target"""
+
+    target_burst = 3
+    """Size of each target's bucket"""
+
+    max_age = 30
+    """Seconds a line, other than a continuation, may wait before it's
+    dropped as stale"""
+
+    mergeable_commands = ('MODE', 'TOPIC', 'WHO', 'NAMES')
+    """Commands whose duplicates are merged while queued"""
+
+    max_buckets = 256
+    """Number of target buckets to hold before discarding full ones"""
+
+    sent = 0
+    """Number of lines sent"""
+
+    dropped = 0
+    """Number of lines dropped for being stale"""
+
+    merged = 0
+    """Number of lines merged into identical queued lines"""
+
+    last_lag = 0
+    """Seconds the most recently sent line spent in the queue"""
+
+    def __init__(self, send, config=None, clock=None):
+        """Initializes an empty queue.
+
+        Keyword arguments:
+          send -- Called with each line once it may be sent.
+          config -- A dictionary which may contain the `rate`, `burst`,
+            `target_rate`, `target_burst` and `max_age` settings.
+          clock -- Provider of IReactorTime, to allow for testing.
+        """
+        self.logger = logging.getLogger(__name__)
+
+        self.send = send
+
+        if config is None:
+            config = {}
+
+        for option in ('rate', 'burst', 'target_rate', 'target_burst',
+                       'max_age'):
+            if option in config:
+                setattr(self, option, config[option])
+
+        self.clock = clock if clock is not None else reactor
+
+        self.bucket = TokenBucket(self.rate, self.burst, self.clock.seconds())
+        self.target_buckets = {}
+
+        # Maps each priority to an OrderedDict of targets to a deque of
+        # (line, time queued, continuation) tuples. Targets are moved to the
+        # end after sending so they take turns.
+        self.queues = dict((priority, OrderedDict())
+                           for priority in (PRIORITY_HIGH,
+                                            PRIORITY_NORMAL,
+                                            PRIORITY_LOW))
+
+        self._delayed_call = None
+
+    def __len__(self):
+        return sum(len(lines)
+                   for targets in self.queues.values()
+                   for lines in targets.values())
+
+    def enqueue(self, line, target=None, priority=PRIORITY_NORMAL,
+                continuation=False):
+        """Queues a line, sending it straight away if pacing allows.
+
+        Keyword arguments:
+          line -- The line to send.
+          target -- Channel or nick the line is addressed to, if any.
+          priority -- One of the PRIORITY_* constants.
+          continuation -- Whether the line continues the line queued before
+            it to the same target, such as the rest of a long reply.
+        """
+        if target is not None:
+            target = target.lower()
+
+        lines = self.queues[priority].setdefault(target, deque())
+
+        command = line.split(' ', 1)[0].upper()
+        if command in self.mergeable_commands:
+            for queued, _, _ in lines:
+                if queued == line:
+                    self.merged += 1
+                    self.logger.debug("Merging duplicate line: %s", line)
+                    return
+
+        lines.append((line, self.clock.seconds(), continuation))
+        self._pump()
+
+    def clear(self):
+        """Discards every queued line, e.g. when the connection is lost."""
+        if self._delayed_call is not None and self._delayed_call.active():
+            self._delayed_call.cancel()
+        self._delayed_call = None
+
+        for targets in self.queues.values():
+            targets.clear()
+
+    def stats(self):
+        """Returns the state of the queue.
+
+        Returns:
+          dict -- The queue `depth`, the `lag` in seconds of the oldest queued
+            line, the `last_lag` of the most recently sent line, and the
+            number of lines `sent`, `dropped` and `merged`.
+        """
+        now = self.clock.seconds()
+        oldest = min([lines[0][1]
+                      for targets in self.queues.values()
+                      for lines in targets.values()
+                      if lines] or [now])
+
+        return {
+            'depth': len(self),
+            'lag': now - oldest,
+            'last_lag': self.last_lag,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'merged': self.merged,
+        }
+
+    def _get_target_bucket(self, target, now):
+        try:
+            return self.target_buckets[target]
+        except KeyError:
+            pass
+
+        if len(self.target_buckets) >= self.max_buckets:
+            for key, bucket in self.target_buckets.items():
+                if bucket.is_full(now):
+                    del self.target_buckets[key]
+
+        bucket = TokenBucket(self.target_rate, self.target_burst, now)
+        self.target_buckets[target] = bucket
+
+        return bucket
+
+    def _next(self, now):
+        """Finds the next line that may be sent.
+
+        Returns:
+          tuple -- The priority, target, and target bucket (None if the line
+            isn't paced per target) of the next line, or None and the seconds
+            until a line may be sent if nothing can be sent yet.
+        """
+        wait = None
+        for priority in sorted(self.queues):
+            for target in self.queues[priority]:
+                if target is None or priority == PRIORITY_HIGH:
+                    return priority, target, None
+
+                bucket = self._get_target_bucket(target, now)
+                tokens = bucket.refill(now)
+                if tokens >= 1:
+                    return priority, target, bucket
+
+                target_wait = (1 - tokens) / bucket.rate
+                if wait is None or target_wait < wait:
+                    wait = target_wait
+
+        return None, wait
+
+    def _pump(self):
+        """Sends as many lines as pacing allows, then schedules the rest."""
+        while True:
+            now = self.clock.seconds()
+
+            tokens = self.bucket.refill(now)
+            if tokens < 1:
+                if len(self):
+                    self._schedule((1 - tokens) / self.bucket.rate)
+                return
+
+            found = self._next(now)
+            if found[0] is None:
+                if found[1] is not None:
+                    self._schedule(found[1])
+                return
+
+            priority, target, target_bucket = found
+            targets = self.queues[priority]
+            lines = targets.pop(target)
+
+            line, queued_at, continuation = lines.popleft()
+
+            if (priority != PRIORITY_HIGH and not continuation and
+                    now - queued_at > self.max_age):
+                self._drop(target, line, now - queued_at)
+
+                # The rest of the reply would make no sense without its start
+                while lines and lines[0][2]:
+                    self._drop(target, lines.popleft()[0], now - queued_at)
+
+                if lines:
+                    targets[target] = lines
+                continue
+
+            # Take turns by moving the target to the back of the queue
+            if lines:
+                targets[target] = lines
+
+            self.bucket.tokens -= 1
+            if target_bucket is not None:
+                target_bucket.tokens -= 1
+
+            self.last_lag = now - queued_at
+            self.sent += 1
+            self.send(line)
+
+    def _drop(self, target, line, age):
+        self.dropped += 1
+        self.logger.warning("Dropping line to %s queued %.0f seconds ago: %s",
+                            target, age, line)
+
+    def _schedule(self, delay):
+        if self._delayed_call is not None and self._delayed_call.active():
+            if self._delayed_call.getTime() <= self.clock.seconds() + delay:
+                return
+            self._delayed_call.cancel()
+
+        self._delayed_call = self.clock.callLater(delay, self._pump)
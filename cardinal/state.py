@@ -0,0 +1,366 @@
+import string
+
+_RFC1459_LOWER = string.maketrans(string.ascii_uppercase + '[]\\~',
+                                  string.ascii_lowercase + '{}|^')
+_RFC1459_LOWER_UNICODE = dict((ord(upper), ord(lower)) for upper, lower in
+                              zip(string.ascii_uppercase + '[]\\~',
+                                  string.ascii_lowercase + '{}|^'))
+
+
+def irc_lower(name):
+    """Lowercases a nick or channel name using rfc1459 casemapping, under
+    which [, ], \\ and ~ are the uppercase forms of {, }, | and ^."""
+    if isinstance(name, unicode):
+        return name.translate(_RFC1459_LOWER_UNICODE)
+
+    return name.translate(_RFC1459_LOWER)
+
+
+class UserState(object):
+    """A user in at least one of the channels we're in."""
+
+    nick = None
+    """The user's nick"""
+
+    ident = None
+    """The user's ident, or None if it isn't known yet"""
+
+    host = None
+    """The user's host, or None if it isn't known yet"""
+
+    account = None
+    """The account the user is logged in to, if known"""
+
+    away = None
+    """The user's away message, if they're known to be away"""
+
+    channels = None
+    """Lowercased names of the channels we share with the user"""
+
+    def __init__(self, nick, ident=None, host=None):
+        self.nick = nick
+        self.ident = ident
+        self.host = host
+        self.channels = set()
+
+    def __repr__(self):
+        return "<UserState %s!%s@%s>" % (self.nick, self.ident, self.host)
+
+
+class ChannelState(object):
+    """A channel we're in."""
+
+    name = None
+    """Name of the channel"""
+
+    topic = None
+    """The channel topic, if one is set"""
+
+    modes = None
+    """Maps channel modes to their parameter, or None if they have none"""
+
+    users = None
+    """Maps lowercased nicks to a set of their prefix modes (e.g. 'o')"""
+
+    synced = False
+    """Whether the member list is complete, i.e. NAMES has finished"""
+
+    pending = 0
+    """Number of members whose host isn't known yet"""
+
+    def __init__(self, name):
+        self.name = name
+        self.modes = {}
+        self.users = {}
+
+    def __repr__(self):
+        return "<ChannelState %s (%d users)>" % (self.name, len(self.users))
+
+
+class StateTracker(object):
+    """Tracks the channels we're in, and the users in them.
+
+    State is updated incrementally from the JOIN, PART, KICK, QUIT, NICK, MODE
+    and TOPIC messages the server sends us, along with the NAMES list sent when
+    we join a channel. Unless the server has enabled userhost-in-names, NAMES
+    only lists nicks, so a WHO is needed once per channel to learn everyone's
+    ident and host. After that, lookups never need to go to the server.
+
+    Channel and nick names are compared case-insensitively, using rfc1459
+    casemapping.
+    """
+
+    nickname = None
+    """Our own nick, to recognize when we join or leave channels"""
+
+    channels = None
+    """Maps lowercased channel names to ChannelState instances"""
+
+    users = None
+    """Maps lowercased nicks to UserState instances"""
+
+    def __init__(self, nickname=None):
+        """Initializes an empty tracker.
+
+        Keyword arguments:
+          nickname -- Our own nick.
+        """
+        self.nickname = nickname
+        self.channels = {}
+        self.users = {}
+
+        # NAMES replies are collected here until RPL_ENDOFNAMES
+        self._names = {}
+
+    def is_me(self, nick):
+        """Whether a nick is our own."""
+        return (self.nickname is not None and
+                irc_lower(nick) == irc_lower(self.nickname))
+
+    def get_channel(self, channel):
+        """Returns the ChannelState for a channel, or None if we're not in it.
+        """
+        return self.channels.get(irc_lower(channel))
+
+    def get_user(self, nick):
+        """Returns the UserState for a nick, or None if we share no channels.
+        """
+        return self.users.get(irc_lower(nick))
+
+    def is_on(self, nick, channel):
+        """Whether a user is in a channel we're in."""
+        state = self.channels.get(irc_lower(channel))
+        return state is not None and irc_lower(nick) in state.users
+
+    def has_mode(self, nick, channel, mode):
+        """Whether a user has a prefix mode (e.g. 'o' or 'v') in a channel."""
+        state = self.channels.get(irc_lower(channel))
+        if state is None:
+            return False
+
+        return mode in state.users.get(irc_lower(nick), ())
+
+    def is_complete(self, channel):
+        """Whether the member list and every member's host are known.
+
+        Returns:
+          bool -- False if a WHO is needed before the channel can be listed.
+        """
+        state = self.channels.get(irc_lower(channel))
+        if state is None or not state.synced:
+            return False
+
+        return state.pending == 0
+
+    def who(self, channel):
+        """Lists the users in a channel.
+
+        Returns:
+          list -- A (nick, ident, host) tuple for each user, in the same format
+            as CardinalBot.who().
+        """
+        state = self.channels.get(irc_lower(channel))
+        if state is None:
+            return []
+
+        return [(user.nick, user.ident, user.host)
+                for user in (self.users[nick] for nick in state.users)]
+
+    def _add_user(self, state, nick, modes=None):
+        key = irc_lower(nick)
+
+        user = self.users.get(key)
+        if user is None:
+            user = self.users[key] = UserState(nick)
+
+        if key not in state.users and user.host is None:
+            state.pending += 1
+
+        user.channels.add(irc_lower(state.name))
+        state.users[key] = set(modes) if modes else set()
+
+        return user
+
+    def _remove_user(self, state, key):
+        if state.users.pop(key, None) is None:
+            return
+
+        user = self.users[key]
+        if user.host is None:
+            state.pending -= 1
+
+        user.channels.discard(irc_lower(state.name))
+        if not user.channels:
+            del self.users[key]
+
+    def _set_host(self, user, ident, host):
+        # Keep each channel's count of unknown hosts in step with the user
+        if (user.host is None) != (host is None):
+            change = 1 if host is None else -1
+            for channel in user.channels:
+                self.channels[channel].pending += change
+
+        user.ident = ident
+        user.host = host
+
+    def joined(self, nick, ident, host, channel):
+        """Called when a user, or we, join a channel."""
+        key = irc_lower(channel)
+
+        if self.is_me(nick):
+            self.channels[key] = ChannelState(channel)
+            self._names.pop(key, None)
+
+        state = self.channels.get(key)
+        if state is None:
+            return
+
+        user = self._add_user(state, nick)
+        user.nick = nick
+        self._set_host(user, ident, host)
+
+    def parted(self, nick, channel):
+        """Called when a user, or we, leave or are kicked from a channel."""
+        key = irc_lower(channel)
+
+        state = self.channels.get(key)
+        if state is None:
+            return
+
+        if self.is_me(nick):
+            for member in list(state.users):
+                self._remove_user(state, member)
+            del self.channels[key]
+            self._names.pop(key, None)
+            return
+
+        self._remove_user(state, irc_lower(nick))
+
+    def quit(self, nick):
+        """Called when a user quits the network."""
+        user = self.users.get(irc_lower(nick))
+        if user is None:
+            return
+
+        for channel in list(user.channels):
+            self._remove_user(self.channels[channel], irc_lower(nick))
+
+    def nick_changed(self, old_nick, new_nick):
+        """Called when a user, or we, change nick."""
+        if self.is_me(old_nick):
+            self.nickname = new_nick
+
+        old_key, new_key = irc_lower(old_nick), irc_lower(new_nick)
+
+        user = self.users.pop(old_key, None)
+        if user is None:
+            return
+
+        user.nick = new_nick
+        self.users[new_key] = user
+
+        for channel in user.channels:
+            users = self.channels[channel].users
+            users[new_key] = users.pop(old_key, set())
+
+    def topic_changed(self, channel, topic):
+        """Called when a channel's topic is set or reported."""
+        state = self.channels.get(irc_lower(channel))
+        if state is not None:
+            state.topic = topic or None
+
+    def mode_changed(self, channel, added, removed, prefix_modes=(),
+                     list_modes=()):
+        """Called when modes are set or unset on a channel.
+
+        Keyword arguments:
+          channel -- The channel.
+          added -- A list of (mode, param) tuples which were set.
+          removed -- A list of (mode, param) tuples which were unset.
+          prefix_modes -- Modes which are given to users, e.g. 'o' and 'v'.
+          list_modes -- Modes which hold lists of masks, e.g. 'b'. These
+            aren't tracked.
+        """
+        state = self.channels.get(irc_lower(channel))
+        if state is None:
+            return
+
+        for modes, setting in ((added, True), (removed, False)):
+            for mode, param in modes:
+                if mode in prefix_modes:
+                    user_modes = state.users.get(irc_lower(param or ''))
+                    if user_modes is None:
+                        continue
+                    if setting:
+                        user_modes.add(mode)
+                    else:
+                        user_modes.discard(mode)
+                elif mode in list_modes:
+                    continue
+                elif setting:
+                    state.modes[mode] = param
+                else:
+                    state.modes.pop(mode, None)
+
+    def names(self, channel, entries):
+        """Called for each RPL_NAMREPLY.
+
+        Keyword arguments:
+          channel -- The channel.
+          entries -- A list of (nick, prefix modes) tuples, or of (nick, prefix
+            modes, ident, host) tuples if the server sent hostmasks
+            (userhost-in-names).
+        """
+        self._names.setdefault(irc_lower(channel), []).extend(entries)
+
+    def end_of_names(self, channel):
+        """Called on RPL_ENDOFNAMES, replacing the channel's member list."""
+        key = irc_lower(channel)
+
+        entries = self._names.pop(key, [])
+        state = self.channels.get(key)
+        if state is None:
+            return
+
+        # Users we already know keep their ident and host, unless we're given
+        # new ones
+        nicks = set(irc_lower(entry[0]) for entry in entries)
+        for member in list(state.users):
+            if member not in nicks:
+                self._remove_user(state, member)
+
+        for entry in entries:
+            user = self._add_user(state, entry[0], entry[1])
+            if len(entry) > 2 and entry[3] is not None:
+                self._set_host(user, entry[2], entry[3])
+
+        state.synced = True
+
+    def seen(self, nick, ident, host):
+        """Records the ident and host of a user we share a channel with, e.g.
+        from a WHO reply or a message they sent."""
+        user = self.users.get(irc_lower(nick))
+        if user is not None:
+            self._set_host(user, ident, host)
+
+    def account_changed(self, nick, account):
+        """Called when a user logs in to or out of an account.
+
+        Keyword arguments:
+          nick -- The user's nick.
+          account -- The account, or None if they logged out.
+        """
+        user = self.users.get(irc_lower(nick))
+        if user is not None:
+            user.account = account
+
+    def away_changed(self, nick, message):
+        """Called when a user goes away or comes back.
+
+        Keyword arguments:
+          nick -- The user's nick.
+          message -- Their away message, or None if they came back.
+        """
+        user = self.users.get(irc_lower(nick))
+        if user is not None:
+            user.away = message
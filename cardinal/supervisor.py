@@ -0,0 +1,535 @@
+import copy
+import json
+import logging
+import os
+import random
+import signal
+
+from twisted.internet import error, protocol, reactor, task
+from twisted.protocols import basic
+
+PASSWORD_ENVIRONMENT_VARIABLE = 'CARDINAL_NICKSERV_PASSWORD'
+"""Environment variable a NickServ password prompted for is passed in"""
+
+MAX_REPORT_LENGTH = 16 * 1024 * 1024
+"""Longest stats report, in bytes, sent or accepted over the stats socket"""
+
+
+def assign_networks(names, workers):
+    """Splits networks between worker processes.
+
+    Networks are dealt out in turn, so each worker gets either the same number
+    of networks as the others or one fewer.
+
+    Keyword arguments:
+      names -- The name of each network, in config order.
+      workers -- The most worker processes to use.
+
+    Returns:
+      list -- A list of network names for each worker. There are never more
+        lists than networks.
+    """
+    if workers < 1:
+        raise ValueError("There must be at least one worker")
+
+    shards = [[] for _ in range(min(workers, len(names)))]
+    for index, name in enumerate(names):
+        shards[index % len(shards)].append(name)
+
+    return shards
+
+
+def worker_logging_config(config, worker):
+    """Gives a worker its own log files.
+
+    Rotating file handlers can't be shared between processes, so the worker's
+    number is added to the name of every file logged to.
+
+    Keyword arguments:
+      config -- A logging config for logging.config.dictConfig().
+      worker -- The worker's number.
+
+    Returns:
+      dict -- A copy of the config.
+    """
+    config = copy.deepcopy(config)
+
+    for handler in config.get('handlers', {}).values():
+        if handler.get('filename'):
+            root, ext = os.path.splitext(handler['filename'])
+            handler['filename'] = '%s-worker%d%s' % (root, worker, ext)
+
+    return config
+
+
+def merge_stats(stats):
+    """Combines command and callback latency from several Metrics.
+
+    Counts, errors and totals are summed, and the mean is recomputed from
+    them. Percentiles can't be combined exactly, so the `p95` is the highest
+    of the given ones, an upper bound of the real one.
+
+    Keyword arguments:
+      stats -- A list of the results of `Metrics.stats()`.
+
+    Returns:
+      dict -- Stats in the same format as `Metrics.stats()`.
+    """
+    merged = {}
+    for plugins in stats:
+        for plugin, names in plugins.items():
+            for name, histogram in names.items():
+                current = merged.setdefault(plugin, {}).get(name)
+                if current is None:
+                    merged[plugin][name] = dict(histogram)
+                    continue
+
+                current['count'] += histogram['count']
+                current['errors'] += histogram['errors']
+                current['total'] += histogram['total']
+                current['mean'] = current['total'] / current['count']
+                current['p95'] = max(current['p95'], histogram['p95'])
+                current['max'] = max(current['max'], histogram['max'])
+
+    return merged
+
+
+class Worker(object):
+    """A worker process and the networks it runs."""
+
+    number = None
+    """Number identifying the worker, which it keeps across restarts"""
+
+    networks = None
+    """Names of the networks the worker runs"""
+
+    process = None
+    """Twisted process transport, while the worker is running"""
+
+    started = None
+    """Time the worker was last started"""
+
+    restarts = 0
+    """Number of times the worker has been restarted"""
+
+    last_restart_wait = None
+    """Time in seconds waited before the last restart"""
+
+    restart_call = None
+    """Delayed call for the pending restart, if any"""
+
+    stats = None
+    """The stats the worker last reported"""
+
+    reported = None
+    """Time the worker last reported its stats"""
+
+    def __init__(self, number, networks):
+        self.number = number
+        self.networks = networks
+        self.stats = {}
+
+
+class WorkerProcessProtocol(protocol.ProcessProtocol):
+    """Tells the supervisor when a worker process exits."""
+
+    def __init__(self, supervisor, worker):
+        self.supervisor = supervisor
+        self.worker = worker
+
+    def processEnded(self, reason):
+        self.supervisor.worker_ended(self.worker, reason)
+
+
+class ReportReceiver(basic.LineReceiver):
+    """Receives newline delimited stats reports.
+
+    Reports hold the metrics of every command and callback a worker runs, so
+    they're allowed to be far longer than LineReceiver's default limit. A
+    report longer than even that is logged and skipped, rather than dropping
+    the connection, so the reports after it are still received.
+    """
+
+    delimiter = '\n'
+
+    MAX_LENGTH = MAX_REPORT_LENGTH
+
+    _discarding = False
+    _remainder = None
+
+    def dataReceived(self, data):
+        while data:
+            # Skip the rest of an oversized report
+            if self._discarding:
+                if self.delimiter not in data:
+                    return
+                data = data.split(self.delimiter, 1)[1]
+                self._discarding = False
+
+            basic.LineReceiver.dataReceived(self, data)
+
+            # LineReceiver stops parsing after an oversized line, so carry on
+            # with whatever followed it
+            data, self._remainder = self._remainder, None
+
+    def lineLengthExceeded(self, line):
+        logging.getLogger(__name__).warning(
+            "Ignoring stats report longer than %d bytes", self.MAX_LENGTH)
+
+        if self.delimiter in line:
+            self._remainder = line.split(self.delimiter, 1)[1]
+        else:
+            self._discarding = True
+
+
+class StatsProtocol(ReportReceiver):
+    """A connection to the supervisor's stats socket.
+
+    Workers send a JSON object with their `worker` number and `stats` on each
+    line. Anyone else can send `STATS` to be sent the combined stats of every
+    worker, after which the connection is closed.
+    """
+
+    def lineReceived(self, line):
+        supervisor = self.factory.supervisor
+
+        if line.strip() == 'STATS':
+            self.sendLine(json.dumps(supervisor.stats()))
+            self.transport.loseConnection()
+            return
+
+        try:
+            report = json.loads(line)
+            supervisor.report(report['worker'], report['stats'])
+        except (ValueError, KeyError, TypeError):
+            supervisor.logger.warning("Invalid stats report: %r", line)
+
+
+class Supervisor(object):
+    """Runs Cardinal's networks in several worker processes.
+
+    Each worker is Cardinal itself, started with a subset of the networks.
+    Workers which crash are restarted, waiting longer each time one crashes
+    soon after starting. Workers which exit cleanly, because every network
+    they ran was told to quit, aren't restarted. Workers report their stats
+    over a UNIX socket, which can also be asked for the combined stats.
+    """
+
+    logger = None
+    """Logging object for Supervisor"""
+
+    workers = None
+    """List of Worker instances"""
+
+    minimum_restart_wait = 1
+    """Minimum time in seconds before restarting a worker"""
+
+    maximum_restart_wait = 60
+    """Maximum time in seconds before restarting a worker"""
+
+    restart_jitter = 0.2
+    """Fraction of the restart wait to randomly add or subtract"""
+
+    stable_run_time = 60
+    """Seconds a worker must run before the restart wait resets"""
+
+    stopping = False
+    """Whether the workers have been told to shut down"""
+
+    def __init__(self, command, shards, socket_path, environment=None,
+                 clock=None):
+        """Creates the supervisor without starting any workers.
+
+        Keyword arguments:
+          command -- Arguments to start Cardinal with. Each worker is also
+            given `--worker`, `--worker-networks` and `--stats-socket`.
+          shards -- A list of network names for each worker, as returned by
+            assign_networks().
+          socket_path -- Path of the UNIX socket to collect stats on.
+          environment -- Extra environment variables for the workers.
+          clock -- An IReactorTime provider. Defaults to the reactor.
+        """
+        self.logger = logging.getLogger(__name__)
+
+        self.command = command
+        self.socket_path = socket_path
+        self.environment = dict(os.environ)
+        self.environment.update(environment or {})
+        self.clock = clock if clock is not None else reactor
+
+        self.workers = [Worker(number, networks)
+                        for number, networks in enumerate(shards)]
+
+        self._listener = None
+
+    def start(self):
+        """Starts listening for stats and starts every worker."""
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        factory = protocol.ServerFactory()
+        factory.protocol = StatsProtocol
+        factory.supervisor = self
+        self._listener = reactor.listenUNIX(self.socket_path, factory)
+
+        for worker in self.workers:
+            self._start_worker(worker)
+
+    def install_signal_handlers(self):
+        """Shuts the workers down on SIGINT and SIGTERM.
+
+        Twisted installs its own SIGTERM handler once the reactor is running,
+        so this must be called after that.
+        """
+        signal.signal(signal.SIGINT, self._signal)
+        signal.signal(signal.SIGTERM, self._signal)
+
+    def _signal(self, signum, frame):
+        self.stop()
+
+    def _worker_args(self, worker):
+        return self.command + [
+            '--worker', str(worker.number),
+            '--worker-networks', ','.join(worker.networks),
+            '--stats-socket', self.socket_path,
+        ]
+
+    def _spawn(self, worker):
+        args = self._worker_args(worker)
+
+        # Workers log to our stdout and stderr
+        return reactor.spawnProcess(WorkerProcessProtocol(self, worker),
+                                    args[0], args, env=self.environment,
+                                    childFDs={0: 'w', 1: 1, 2: 2})
+
+    def _start_worker(self, worker):
+        worker.restart_call = None
+        worker.started = self.clock.seconds()
+        worker.process = self._spawn(worker)
+
+        self.logger.info("Started worker %d (pid %s) for %s", worker.number,
+                         worker.process.pid, ', '.join(worker.networks))
+
+    def _get_restart_wait(self, worker):
+        """Returns the time to wait before restarting a worker.
+
+        Like reconnection attempts, the wait doubles each time the worker
+        crashes soon after starting, up to the maximum, and is jittered.
+        """
+        if (worker.started is not None and
+                self.clock.seconds() - worker.started >=
+                self.stable_run_time):
+            worker.last_restart_wait = None
+
+        if not worker.last_restart_wait:
+            wait_time = self.minimum_restart_wait
+        else:
+            wait_time = min(worker.last_restart_wait * 2,
+                            self.maximum_restart_wait)
+
+        worker.last_restart_wait = wait_time
+
+        jitter = wait_time * self.restart_jitter
+        return wait_time + random.uniform(-jitter, jitter)
+
+    def worker_ended(self, worker, reason):
+        """Called when a worker process exits.
+
+        Keyword arguments:
+          worker -- The Worker whose process exited.
+          reason -- Failure describing how it exited.
+        """
+        worker.process = None
+
+        if self.stopping or reason.check(error.ProcessDone):
+            self.logger.info("Worker %d stopped", worker.number)
+            if not self.running() and not self.restarting():
+                self._stopped()
+            return
+
+        wait_time = self._get_restart_wait(worker)
+        self.logger.warning("Worker %d exited (%s), restarting in %d seconds",
+                            worker.number, reason.getErrorMessage(),
+                            wait_time)
+
+        worker.restarts += 1
+        worker.restart_call = self.clock.callLater(
+            wait_time, self._start_worker, worker)
+
+    def running(self):
+        """Returns a list of the workers whose process is running."""
+        return [worker for worker in self.workers
+                if worker.process is not None]
+
+    def restarting(self):
+        """Returns a list of the workers waiting to be restarted."""
+        return [worker for worker in self.workers
+                if worker.restart_call is not None]
+
+    def stop(self):
+        """Tells every worker to disconnect, and stops once they have."""
+        self.stopping = True
+
+        for worker in self.workers:
+            if worker.restart_call is not None and \
+                    worker.restart_call.active():
+                worker.restart_call.cancel()
+            worker.restart_call = None
+
+        running = self.running()
+        if not running:
+            self._stopped()
+            return
+
+        for worker in running:
+            self.logger.info("Stopping worker %d", worker.number)
+            try:
+                worker.process.signalProcess('INT')
+            except Exception:
+                self.logger.exception("Couldn't signal worker %d",
+                                      worker.number)
+
+    def _stopped(self):
+        self.logger.info("Every worker has stopped, quitting")
+
+        if self._listener is not None:
+            self._listener.stopListening()
+            self._listener = None
+
+        if reactor.running:
+            reactor.stop()
+
+    def report(self, number, stats):
+        """Records the stats a worker reported.
+
+        Keyword arguments:
+          number -- The worker's number.
+          stats -- The worker's stats, as collected by StatsReporter.
+        """
+        if not 0 <= number < len(self.workers):
+            raise KeyError(number)
+
+        worker = self.workers[number]
+        worker.stats = stats
+        worker.reported = self.clock.seconds()
+
+    def stats(self):
+        """Returns the combined stats of every worker.
+
+        Returns:
+          dict -- The `workers` with their pid, networks, restart count and
+            how long ago they last reported; the stats of each of the
+            `networks`; and the latency of `plugins` across every network.
+        """
+        now = self.clock.seconds()
+
+        workers = []
+        networks = {}
+        for worker in self.workers:
+            workers.append({
+                'worker': worker.number,
+                'pid': worker.process.pid if worker.process else None,
+                'networks': worker.networks,
+                'restarts': worker.restarts,
+                'uptime': now - worker.started if worker.process else None,
+                'reported': (now - worker.reported
+                             if worker.reported is not None else None),
+            })
+            networks.update(worker.stats)
+
+        return {
+            'workers': workers,
+            'networks': networks,
+            'plugins': merge_stats([network.get('metrics', {})
+                                    for network in networks.values()]),
+        }
+
+
+class StatsReportingProtocol(ReportReceiver):
+    def connectionMade(self):
+        self.factory.reporter.protocol = self
+
+    def connectionLost(self, reason):
+        if self.factory.reporter.protocol is self:
+            self.factory.reporter.protocol = None
+
+
+class StatsReporter(object):
+    """Periodically sends a worker's stats to the supervisor."""
+
+    logger = None
+    """Logging object for StatsReporter"""
+
+    interval = 10
+    """Seconds between reports"""
+
+    protocol = None
+    """Connection to the supervisor, while connected"""
+
+    def __init__(self, socket_path, worker, networks):
+        """Creates a reporter without connecting.
+
+        Keyword arguments:
+          socket_path -- Path of the supervisor's stats socket.
+          worker -- The number of this worker.
+          networks -- The NetworkManager running this worker's networks.
+        """
+        self.logger = logging.getLogger(__name__)
+
+        self.socket_path = socket_path
+        self.worker = worker
+        self.networks = networks
+
+        self._loop = None
+
+    def start(self):
+        """Connects to the supervisor and starts reporting."""
+        factory = protocol.ReconnectingClientFactory()
+        factory.protocol = StatsReportingProtocol
+        factory.reporter = self
+        factory.maxDelay = self.interval
+        reactor.connectUNIX(self.socket_path, factory)
+
+        self._loop = task.LoopingCall(self.report)
+        self._loop.start(self.interval, now=False)
+
+    def collect(self):
+        """Returns the stats of each of the worker's networks.
+
+        Returns:
+          dict -- Maps network names to whether they're `connected`, their
+            `metrics`, the stats of their plugins' `thread_pools`, and the
+            stats of their `send_queue`, if connected.
+        """
+        stats = {}
+        for factory in self.networks.factories:
+            connected = factory.signed_on is not None
+            send_queue = None
+            if connected and factory.cardinal.send_queue is not None:
+                send_queue = factory.cardinal.send_queue.stats()
+
+            stats[factory.name] = {
+                'connected': connected,
+                'metrics': factory.metrics.stats(),
+                'thread_pools': factory.thread_pools.stats(),
+                'send_queue': send_queue,
+            }
+
+        return stats
+
+    def report(self):
+        """Sends the current stats, if connected to the supervisor."""
+        if self.protocol is None:
+            return
+
+        report = json.dumps({
+            'worker': self.worker,
+            'stats': self.collect(),
+        })
+        if len(report) > MAX_REPORT_LENGTH:
+            self.logger.warning(
+                "Not sending stats report of %d bytes, the most the "
+                "supervisor accepts is %d", len(report), MAX_REPORT_LENGTH)
+            return
+
+        self.protocol.sendLine(report)
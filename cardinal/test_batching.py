@@ -0,0 +1,89 @@
+from mock import Mock, patch
+
+from twisted.internet import task
+
+from batching import Batch
+
+
+class TestBatch(object):
+    def setup_method(self, method):
+        self.clock = task.Clock()
+        self.deliver = Mock()
+
+        patcher = patch('twisted.python.threadable.isInIOThread',
+                        return_value=True)
+        patcher.start()
+        self.patcher = patcher
+
+    def teardown_method(self, method):
+        self.patcher.stop()
+
+    def test_defaults(self):
+        batch = Batch(self.deliver, clock=self.clock)
+        assert batch.size == Batch.size
+        assert batch.interval == Batch.interval
+
+    def test_delivered_next_iteration(self):
+        batch = Batch(self.deliver, clock=self.clock)
+        batch.add(1)
+        batch.add(2)
+        assert not self.deliver.called
+
+        self.clock.advance(0)
+        self.deliver.assert_called_once_with([1, 2])
+        assert batch.items == []
+
+    def test_delivered_after_interval(self):
+        batch = Batch(self.deliver, interval=100, clock=self.clock)
+        batch.add(1)
+
+        self.clock.advance(0.05)
+        batch.add(2)
+        assert not self.deliver.called
+
+        # The interval starts with the first item
+        self.clock.advance(0.05)
+        self.deliver.assert_called_once_with([1, 2])
+
+    def test_delivered_when_full(self):
+        batch = Batch(self.deliver, size=2, interval=100, clock=self.clock)
+        batch.add(1)
+        batch.add(2)
+        self.deliver.assert_called_once_with([1, 2])
+
+        # The pending delivery was cancelled
+        assert self.clock.getDelayedCalls() == []
+
+        batch.add(3)
+        self.clock.advance(0.1)
+        self.deliver.assert_called_with([3])
+
+    def test_flush_empty(self):
+        batch = Batch(self.deliver, clock=self.clock)
+        batch.flush()
+        assert not self.deliver.called
+
+    def test_cancel(self):
+        batch = Batch(self.deliver, clock=self.clock)
+        batch.add(1)
+        batch.cancel()
+
+        self.clock.advance(1)
+        assert not self.deliver.called
+        assert batch.items == [1]
+
+    @patch('twisted.internet.reactor.callFromThread')
+    def test_add_from_thread(self, callFromThread):
+        self.patcher.stop()
+        patcher = patch('twisted.python.threadable.isInIOThread',
+                        return_value=False)
+        patcher.start()
+        self.patcher = patcher
+
+        batch = Batch(self.deliver, size=2, clock=self.clock)
+        batch.add(1)
+        callFromThread.assert_called_once_with(batch._schedule)
+
+        batch.add(2)
+        callFromThread.assert_called_with(batch.flush)
+        assert not self.deliver.called
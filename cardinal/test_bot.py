@@ -0,0 +1,400 @@
+from mock import Mock, patch
+
+from twisted.internet import error, task
+from twisted.python.failure import Failure
+from twisted.test.proto_helpers import StringTransport
+
+import bot
+from bot import CardinalBot, CardinalBotFactory
+from exceptions import WhoTimeoutError
+from sendqueue import SendQueue
+
+
+def make_bot():
+    factory = Mock()
+    factory.nickname = 'Cardinal'
+    factory.timeouts = {}
+    factory.send_queue = None
+
+    cardinal = CardinalBot()
+    cardinal.factory = factory
+    cardinal.performLogin = False
+    cardinal.makeConnection(StringTransport())
+
+    # Lines go straight to the transport, rather than being paced
+    cardinal.send_queue = None
+
+    return cardinal
+
+
+def sent_lines(cardinal):
+    lines = cardinal.transport.value().splitlines()
+    cardinal.transport.clear()
+    return lines
+
+
+def results(d):
+    collected = []
+    d.addBoth(collected.append)
+    return collected
+
+
+class TestWho(object):
+    def setup_method(self, method):
+        self.clock = task.Clock()
+        self.patcher = patch.object(bot, 'reactor', self.clock)
+        self.patcher.start()
+
+        self.cardinal = make_bot()
+
+    def teardown_method(self, method):
+        self.patcher.stop()
+
+    def who(self, *channels):
+        deferreds = [self.cardinal.who(channel) for channel in channels]
+        self.cardinal.who_batch.flush()
+        return deferreds
+
+    def reply(self, channel, nick):
+        self.cardinal.lineReceived(
+            ':server 352 Cardinal %s %s host.%s server %s H :0 Real Name' %
+            (channel, nick, nick, nick))
+
+    def end(self, channels):
+        self.cardinal.lineReceived(
+            ':server 315 Cardinal %s :End of /WHO list.' % channels)
+
+    def test_coalesces_requests(self):
+        first, second = self.who('#channel', '#CHANNEL')
+        assert sent_lines(self.cardinal) == ['WHO #channel']
+
+        first, second = results(first), results(second)
+        self.reply('#channel', 'nick')
+        self.end('#channel')
+
+        assert first == second == [[('nick', 'nick', 'host.nick')]]
+        assert self.cardinal.who_lock == {}
+        assert self.clock.getDelayedCalls() == []
+
+    def test_rfc1459_casemapping(self):
+        d, = self.who('#foo[')
+        d = results(d)
+        assert sent_lines(self.cardinal) == ['WHO #foo[']
+
+        # The server answers with its own spelling of the channel
+        self.reply('#Foo{', 'nick')
+        self.end('#Foo{')
+
+        assert d == [[('nick', 'nick', 'host.nick')]]
+        assert self.cardinal.who_lock == {}
+        assert '#foo{' in self.cardinal.who_cache
+
+        self.cardinal.lineReceived(':Cardinal!card@bot.host PART #FOO[')
+        assert self.cardinal.who_cache == {}
+
+    def test_cache_expires(self):
+        self.who('#channel')
+        self.end('#channel')
+        sent_lines(self.cardinal)
+
+        self.clock.advance(self.cardinal.who_ttl - 1)
+        d, = self.who('#channel')
+        assert results(d) == [[]]
+        assert sent_lines(self.cardinal) == []
+
+        self.clock.advance(1)
+        self.who('#channel')
+        assert sent_lines(self.cardinal) == ['WHO #channel']
+
+    def test_timeout_releases_lock(self):
+        d, = self.who('#channel')
+        d = results(d)
+        sent_lines(self.cardinal)
+
+        self.clock.advance(self.cardinal.who_timeout)
+        assert d[0].check(WhoTimeoutError)
+        assert self.cardinal.who_lock == {}
+        assert self.cardinal.who_callbacks == {}
+
+        # A late reply is ignored, and the next request asks again
+        self.end('#channel')
+        assert '#channel' not in self.cardinal.who_cache
+
+        self.who('#channel')
+        assert sent_lines(self.cardinal) == ['WHO #channel']
+
+    def test_batches_by_targmax(self):
+        self.cardinal.supported.parse(['TARGMAX=WHO:2'])
+
+        a, b, c = [results(d) for d in self.who('#a', '#b', '#c')]
+        assert sent_lines(self.cardinal) == ['WHO #a,#b', 'WHO #c']
+
+        self.reply('#a', 'foo')
+        self.reply('#b', 'bar')
+        self.end('#a,#b')
+
+        assert a == [[('foo', 'foo', 'host.foo')]]
+        assert b == [[('bar', 'bar', 'host.bar')]]
+        assert c == []
+
+    def test_no_targmax(self):
+        self.who('#a', '#b')
+        assert sent_lines(self.cardinal) == ['WHO #a', 'WHO #b']
+
+    def test_whox(self):
+        self.cardinal.supported.parse(['WHOX'])
+
+        d, = self.who('#channel')
+        d = results(d)
+        assert sent_lines(self.cardinal) == ['WHO #channel %tcuhn,372']
+
+        self.cardinal.lineReceived(
+            ':server 354 Cardinal 372 #channel ident host nick')
+        # Replies to queries we didn't make are ignored
+        self.cardinal.lineReceived(
+            ':server 354 Cardinal 123 #channel other host other')
+        self.end('#channel')
+
+        assert d == [[('nick', 'ident', 'host')]]
+
+    def test_rejoin_fetches_hosts_again(self):
+        cardinal = self.cardinal
+        cardinal.lineReceived(':Cardinal!card@bot.host JOIN #channel')
+        cardinal.lineReceived(':server 353 Cardinal = #channel :Cardinal nick')
+        cardinal.lineReceived(':server 366 Cardinal #channel :End of /NAMES')
+        cardinal.who_batch.flush()
+        assert sent_lines(cardinal) == ['WHO #channel']
+
+        self.reply('#channel', 'Cardinal')
+        self.reply('#channel', 'nick')
+        self.end('#channel')
+        assert cardinal.state.is_complete('#channel')
+
+        cardinal.lineReceived(':op!op@op.host KICK #channel Cardinal :bye')
+        cardinal.lineReceived(':Cardinal!card@bot.host JOIN #channel')
+        cardinal.lineReceived(':server 353 Cardinal = #channel :Cardinal nick')
+        cardinal.lineReceived(':server 366 Cardinal #channel :End of /NAMES')
+        cardinal.who_batch.flush()
+        assert sent_lines(cardinal) == ['WHO #channel']
+
+        self.reply('#channel', 'Cardinal')
+        self.reply('#channel', 'nick')
+        self.end('#channel')
+        assert cardinal.state.is_complete('#channel')
+
+    def test_connection_lost_fails_pending(self):
+        d, = self.who('#channel')
+        d = results(d)
+
+        self.cardinal.connectionLost(Failure(error.ConnectionLost()))
+
+        assert d[0].check(error.ConnectionLost)
+        assert self.cardinal.who_lock == {}
+        assert self.clock.getDelayedCalls() == []
+
+
+class TestCapabilities(object):
+    def setup_method(self, method):
+        self.cardinal = make_bot()
+        self.cardinal.register('Cardinal')
+
+        assert sent_lines(self.cardinal)[0] == 'CAP LS 302'
+
+    def test_multiline_ls(self):
+        self.cardinal.lineReceived(
+            ':server CAP * LS * :multi-prefix sasl=PLAIN')
+        assert sent_lines(self.cardinal) == []
+
+        self.cardinal.lineReceived(':server CAP * LS :batch away-notify')
+        assert sent_lines(self.cardinal) == \
+            ['CAP REQ :multi-prefix away-notify batch']
+
+    def test_ack_ends_negotiation_once(self):
+        self.cardinal.lineReceived(':server CAP * LS :multi-prefix batch')
+        sent_lines(self.cardinal)
+
+        self.cardinal.lineReceived(
+            ':server CAP Cardinal ACK :multi-prefix batch')
+        assert sent_lines(self.cardinal) == ['CAP END']
+        assert self.cardinal.capabilities == set(['multi-prefix', 'batch'])
+
+        self.cardinal.lineReceived(':server CAP Cardinal ACK :-batch')
+        assert sent_lines(self.cardinal) == []
+        assert self.cardinal.capabilities == set(['multi-prefix'])
+
+    def test_nak_ends_negotiation(self):
+        self.cardinal.lineReceived(':server CAP * LS :multi-prefix')
+        sent_lines(self.cardinal)
+
+        self.cardinal.lineReceived(':server CAP Cardinal NAK :multi-prefix')
+        assert sent_lines(self.cardinal) == ['CAP END']
+        assert self.cardinal.capabilities == set()
+
+    def test_nothing_wanted(self):
+        self.cardinal.lineReceived(':server CAP * LS :sasl tls')
+        assert sent_lines(self.cardinal) == ['CAP END']
+
+    def test_new_and_del_after_registration(self):
+        self.cardinal.lineReceived(':server CAP * LS :')
+        assert sent_lines(self.cardinal) == ['CAP END']
+
+        self.cardinal.lineReceived(
+            ':server CAP Cardinal NEW :extended-join sasl')
+        assert sent_lines(self.cardinal) == ['CAP REQ :extended-join']
+
+        self.cardinal.lineReceived(':server CAP Cardinal ACK :extended-join')
+        assert sent_lines(self.cardinal) == []
+        assert 'extended-join' in self.cardinal.capabilities
+
+        self.cardinal.lineReceived(':server CAP Cardinal DEL :extended-join')
+        assert self.cardinal.capabilities == set()
+
+
+class TestBatches(object):
+    def setup_method(self, method):
+        self.cardinal = make_bot()
+        self.cardinal.event_manager = Mock()
+        self.cardinal.plugin_manager = Mock()
+
+    def test_batch(self):
+        cardinal = self.cardinal
+        cardinal.lineReceived(':server BATCH +ref netjoin irc.a irc.b')
+        cardinal.lineReceived('@batch=ref :nick!ident@host PRIVMSG #a :hi')
+        cardinal.lineReceived(':other!ident@host PRIVMSG #a :not in it')
+        cardinal.lineReceived(':server BATCH -ref')
+
+        name, batch_type, params, messages = \
+            cardinal.event_manager.fire.call_args[0]
+        assert (name, batch_type, params) == \
+            ('irc.batch', 'netjoin', ['irc.a', 'irc.b'])
+        assert [message.params for message in messages] == [['#a', 'hi']]
+        assert cardinal.batches == {}
+
+    def test_open_batches_are_limited(self):
+        cardinal = self.cardinal
+        cardinal.max_batches = 2
+        cardinal.max_batch_messages = 1
+
+        for reference in ('a', 'b', 'c'):
+            cardinal.lineReceived(':server BATCH +%s chathistory #a' %
+                                  reference)
+        assert sorted(cardinal.batches) == ['a', 'b']
+
+        for _ in range(2):
+            cardinal.lineReceived('@batch=a :nick!ident@host PRIVMSG #a :hi')
+        assert len(cardinal.batches['a']['messages']) == 1
+
+    def test_connection_lost_discards_batches(self):
+        self.cardinal.lineReceived(':server BATCH +ref chathistory #a')
+        self.cardinal.connectionLost(Failure(error.ConnectionLost()))
+
+        assert self.cardinal.batches == {}
+
+
+class TestSendMsg(object):
+    def test_long_reply_sent_in_full(self):
+        clock = task.Clock()
+        cardinal = make_bot()
+        cardinal.send_queue = SendQueue(cardinal._reallySendLine, clock=clock)
+
+        # One word fits on each line, so the reply is split into 20 lines
+        words = ['line%02d' % i for i in range(20)]
+        fmt = 'PRIVMSG #channel :'
+        with patch('twisted.python.threadable.isInIOThread',
+                   return_value=True):
+            cardinal.sendMsg('#channel', ' '.join(words),
+                             length=len(fmt) + len(words[0]) + 2)
+
+        clock.pump([1] * 60)
+        assert sent_lines(cardinal) == [fmt + word for word in words]
+        assert cardinal.send_queue.dropped == 0
+
+
+class TestReconnection(object):
+    def setup_method(self, method):
+        self.clock = task.Clock()
+        self.patchers = [
+            patch.object(bot, 'reactor', self.clock),
+            patch.object(bot, 'signal'),
+            patch('random.uniform', return_value=0),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+        self.factory = CardinalBotFactory('irc.example.com')
+        self.factory.networks = Mock()
+        self.connector = Mock()
+
+    def teardown_method(self, method):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def lose_connection(self):
+        self.factory.clientConnectionLost(
+            self.connector, Failure(error.ConnectionLost()))
+
+    def next_wait(self):
+        """Loses the connection and returns how long the reconnect waits"""
+        self.lose_connection()
+        wait = self.factory.reconnect_call.getTime() - self.clock.seconds()
+
+        self.clock.advance(wait)
+        assert self.factory.reconnect_call is None
+
+        return wait
+
+    def test_wait_doubles_up_to_maximum(self):
+        waits = [self.next_wait() for _ in range(7)]
+
+        assert waits == [10, 20, 40, 80, 160, 300, 300]
+        assert self.connector.connect.call_count == 7
+
+    def test_failed_connections_back_off(self):
+        self.factory.clientConnectionFailed(self.connector, Mock())
+        self.clock.advance(10)
+        self.factory.clientConnectionFailed(self.connector, Mock())
+
+        assert self.factory.last_reconnection_wait == 20
+
+    def test_wait_is_jittered(self):
+        with patch('random.uniform', return_value=1.5) as uniform:
+            assert self.next_wait() == 11.5
+
+        uniform.assert_called_once_with(-2, 2)
+
+    def test_stable_connection_resets_wait(self):
+        self.next_wait()
+        self.next_wait()
+
+        # A connection which drops quickly keeps backing off
+        self.factory.signed_on = self.clock.seconds()
+        self.clock.advance(self.factory.stable_connection_time - 1)
+        assert self.next_wait() == 40
+
+        self.factory.signed_on = self.clock.seconds()
+        self.clock.advance(self.factory.stable_connection_time)
+        assert self.next_wait() == 10
+        assert self.factory.signed_on is None
+
+    def test_shutdown_cancels_pending_reconnect(self):
+        self.lose_connection()
+        assert self.clock.getDelayedCalls() != []
+
+        self.factory.shutdown('Bye')
+
+        assert self.factory.reconnect_call is None
+        assert self.clock.getDelayedCalls() == []
+        self.factory.networks.stopped.assert_called_once_with(self.factory)
+        assert not self.connector.connect.called
+
+    def test_shutdown_quits_when_connected(self):
+        self.factory.cardinal = Mock()
+        self.factory.shutdown('Bye')
+
+        self.factory.cardinal.quit.assert_called_once_with('Bye')
+        assert not self.factory.networks.stopped.called
+
+        # Once the connection closes, we don't reconnect
+        self.lose_connection()
+        assert self.clock.getDelayedCalls() == []
+        self.factory.networks.stopped.assert_called_once_with(self.factory)
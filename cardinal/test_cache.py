@@ -0,0 +1,146 @@
+from cache import (
+    LRUCache,
+    flush,
+    get_caches,
+    get_keys,
+    get_stats,
+    register_cache,
+)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(object):
+    def setup_method(self, method):
+        self.clock = FakeClock()
+        self.cache = LRUCache(max_size=2, ttl=10, clock=self.clock)
+
+    def test_defaults(self):
+        cache = LRUCache()
+        assert cache.max_size == LRUCache.max_size
+        assert cache.ttl is None
+
+    def test_get_set(self):
+        assert self.cache.get('foo') is None
+        assert self.cache.get('foo', 'default') == 'default'
+
+        self.cache.set('foo', 'bar')
+        assert self.cache.get('foo') == 'bar'
+        assert len(self.cache) == 1
+
+        assert self.cache.hits == 1
+        assert self.cache.misses == 2
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set('foo', 1)
+        self.cache.set('bar', 2)
+
+        # Using foo makes bar the least recently used entry
+        self.cache.get('foo')
+        self.cache.set('baz', 3)
+
+        assert len(self.cache) == 2
+        assert self.cache.get('bar') is None
+        assert self.cache.get('foo') == 1
+        assert self.cache.get('baz') == 3
+
+    def test_set_existing_key(self):
+        self.cache.set('foo', 1)
+        self.cache.set('foo', 2)
+
+        assert len(self.cache) == 1
+        assert self.cache.get('foo') == 2
+
+    def test_ttl(self):
+        self.cache.set('foo', 'bar')
+
+        self.clock.now = 9
+        assert self.cache.get('foo') == 'bar'
+        assert self.cache.keys() == ['foo']
+
+        self.clock.now = 10
+        assert self.cache.get('foo') is None
+        assert self.cache.misses == 1
+        assert len(self.cache) == 0
+
+    def test_keys_skips_expired(self):
+        self.cache.set('foo', 1)
+        self.clock.now = 5
+        self.cache.set('bar', 2)
+
+        self.clock.now = 12
+        assert self.cache.keys() == ['bar']
+
+    def test_no_ttl(self):
+        cache = LRUCache(clock=self.clock)
+        cache.set('foo', 'bar')
+
+        self.clock.now = 1000000
+        assert cache.get('foo') == 'bar'
+
+    def test_clear(self):
+        self.cache.set('foo', 1)
+        self.cache.clear()
+
+        assert len(self.cache) == 0
+        assert self.cache.get('foo') is None
+
+
+def test_registry():
+    foo = LRUCache()
+    bar = LRUCache()
+    register_cache('test_registry', 'foo', foo)
+    register_cache('test_registry', 'bar', bar)
+
+    foo.set('key', 'value')
+    foo.get('key')
+    bar.get('key')
+
+    assert get_caches('test_registry') == {
+        'test_registry': {'foo': foo, 'bar': bar},
+    }
+    assert get_caches('unknown') == {}
+    assert 'test_registry' in get_caches()
+
+    assert get_stats('test_registry') == {
+        'test_registry': {'entries': 1, 'hits': 1, 'misses': 1},
+    }
+
+    assert get_keys('test_registry') == {'foo': ['key'], 'bar': []}
+    assert get_keys('unknown') == {}
+
+    assert flush('test_registry') == 1
+    assert len(foo) == 0
+    assert flush('test_registry') == 0
+
+
+def test_register_replaces():
+    old = LRUCache()
+    new = LRUCache(ttl=60)
+    assert register_cache('test_register_replaces', 'foo', old) is old
+    assert register_cache('test_register_replaces', 'foo', new) is new
+
+    assert get_caches('test_register_replaces') == {
+        'test_register_replaces': {'foo': new},
+    }
+
+
+def test_register_reuses():
+    old = LRUCache(ttl=60)
+    old.set('key', 'value')
+
+    # A reloaded plugin registers an identical cache, and gets the old one
+    assert register_cache('test_register_reuses', 'foo', old) is old
+    assert register_cache('test_register_reuses', 'foo',
+                          LRUCache(ttl=60)) is old
+    assert old.get('key') == 'value'
+
+    assert get_caches('test_register_reuses') == {
+        'test_register_reuses': {'foo': old},
+    }
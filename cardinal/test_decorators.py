@@ -202,3 +202,240 @@ def test_event_exceptions(value):
         @decorators.event(value)
         def foo():
             pass
+
+
+@pytest.mark.parametrize("decorator,argument", [
+    (decorators.command, 'foo'),
+    (decorators.regex, 'foo'),
+    (decorators.event, 'irc.privmsg'),
+])
+def test_blocking(decorator, argument):
+    @decorator(argument, blocking=True)
+    def foo():
+        pass
+
+    assert foo.blocking is True
+
+    @decorator(argument)
+    def bar():
+        pass
+
+    assert not hasattr(bar, 'blocking')
+
+
+def test_blocking_survives_stacking():
+    @decorators.command('foo')
+    @decorators.regex('foo', blocking=True)
+    def foo():
+        pass
+
+    assert foo.blocking is True
+
+
+@pytest.mark.parametrize("decorator,argument", [
+    (decorators.command, 'foo'),
+    (decorators.regex, 'foo'),
+    (decorators.event, 'irc.privmsg'),
+])
+def test_timeout(decorator, argument):
+    @decorator(argument, timeout=5)
+    def foo():
+        pass
+
+    assert foo.timeout == 5
+
+    @decorator(argument)
+    def bar():
+        pass
+
+    assert not hasattr(bar, 'timeout')
+
+
+def test_cached():
+    calls = []
+
+    @decorators.cached()
+    def upper(bar):
+        calls.append(bar)
+        return bar.upper()
+
+    assert upper('bar') == 'BAR'
+    assert upper('bar') == 'BAR'
+    assert calls == ['bar']
+    assert upper.cache.hits == 1
+    assert upper.cache.misses == 1
+
+
+def test_cached_normalizes_strings():
+    calls = []
+
+    @decorators.cached()
+    def normalized(bar):
+        calls.append(bar)
+        return bar
+
+    assert normalized('Foo  Bar') == 'Foo  Bar'
+    assert normalized(' foo bar') == 'Foo  Bar'
+    assert calls == ['Foo  Bar']
+
+
+def test_cached_method():
+    calls = []
+
+    class Plugin(object):
+        @decorators.cached()
+        def lookup(self, bar):
+            calls.append(bar)
+            return bar
+
+    assert Plugin().lookup('Bar') == 'Bar'
+    # A reloaded plugin's new instance shares the entry
+    assert Plugin().lookup('bar') == 'Bar'
+    assert calls == ['Bar']
+
+    # .cache keys lists the arguments, not the instance
+    assert [repr(key) for key in Plugin.lookup.cache.keys()] == \
+        ["(('bar',), ())"]
+
+
+def test_cached_survives_reload():
+    calls = []
+
+    def load():
+        class Plugin(object):
+            @decorators.cached()
+            def reloaded(self, bar):
+                calls.append(bar)
+                return bar
+
+        return Plugin()
+
+    assert load().reloaded('bar') == 'bar'
+    # Reloading decorates the method again, which picks up the same cache
+    assert load().reloaded('bar') == 'bar'
+    assert calls == ['bar']
+
+
+def test_cached_key():
+    calls = []
+
+    @decorators.cached(key=lambda bar: bar)
+    def keyed(bar):
+        calls.append(bar)
+        return bar
+
+    assert keyed('Foo') == 'Foo'
+    assert keyed('foo') == 'foo'
+    assert keyed('Foo') == 'Foo'
+    assert calls == ['Foo', 'foo']
+
+
+def test_cached_exceptions_not_cached():
+    calls = []
+
+    @decorators.cached()
+    def failing(bar):
+        calls.append(bar)
+        raise IOError()
+
+    for _ in range(2):
+        with pytest.raises(IOError):
+            failing('bar')
+
+    assert calls == ['bar', 'bar']
+    assert len(failing.cache) == 0
+
+
+def test_cached_unhashable_arguments():
+    calls = []
+
+    @decorators.cached(key=lambda bar: bar)
+    def length(bar):
+        calls.append(bar)
+        return len(bar)
+
+    assert length(['bar']) == 1
+    assert length(['bar']) == 1
+    assert calls == [['bar'], ['bar']]
+
+
+@pytest.mark.parametrize("ttl,key", [
+    ('foo', None),
+    (300, 'foo'),
+    ([], None),
+])
+def test_cached_exceptions(ttl, key):
+    with pytest.raises(TypeError):
+        @decorators.cached(ttl=ttl, key=key)
+        def foo():
+            pass
+
+
+def test_event_priority():
+    @decorators.event('irc.privmsg', priority=10)
+    def foo():
+        pass
+
+    assert foo.priority == 10
+
+    @decorators.event('irc.privmsg')
+    def bar():
+        pass
+
+    assert not hasattr(bar, 'priority')
+
+
+def test_event_filters():
+    @decorators.event('irc.privmsg', channels='#foo', commands=['PRIVMSG'],
+                      prefix='!')
+    def foo():
+        pass
+
+    assert foo.filters == {
+        'channels': ['#foo'],
+        'commands': ['PRIVMSG'],
+        'prefix': '!',
+    }
+
+    @decorators.event('irc.privmsg')
+    def bar():
+        pass
+
+    assert not hasattr(bar, 'filters')
+
+
+@pytest.mark.parametrize("kwargs", [
+    {'channels': 5},
+    {'channels': ('#foo',)},
+    {'commands': {'PRIVMSG': True}},
+    {'prefix': ['!']},
+])
+def test_event_filter_exceptions(kwargs):
+    with pytest.raises(TypeError):
+        @decorators.event('irc.privmsg', **kwargs)
+        def foo():
+            pass
+
+
+@pytest.mark.parametrize("batch", [
+    True,
+    {'size': 10, 'interval': 50},
+])
+def test_event_batch(batch):
+    @decorators.event('irc.raw', batch=batch)
+    def foo():
+        pass
+
+    assert foo.batch == batch
+
+
+@pytest.mark.parametrize("batch", [
+    False,
+    5,
+    ['size'],
+])
+def test_event_batch_exceptions(batch):
+    with pytest.raises(TypeError):
+        @decorators.event('irc.raw', batch=batch)
+        def foo():
+            pass
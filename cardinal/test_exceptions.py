@@ -34,3 +34,9 @@ def test_exceptions():
 
     with pytest.raises(exceptions.CardinalException):
         raise exceptions.EventRejectedMessage
+
+    with pytest.raises(exceptions.CardinalException):
+        raise exceptions.ThreadPoolFullError
+
+    with pytest.raises(exceptions.CardinalException):
+        raise exceptions.WhoTimeoutError
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from formatting import (
+    MAX_LINE_LENGTH,
+    pack_messages,
+    payload_length,
+    split_message,
+)
+
+
+def test_payload_length():
+    prefix = 'Cardinal!cardinal@bot.example.com'
+    length = payload_length(prefix, 'PRIVMSG', '#channel')
+
+    line = ':%s PRIVMSG #channel :%s\r\n' % (prefix, 'a' * length)
+    assert len(line) == MAX_LINE_LENGTH
+
+
+class TestSplitMessage(object):
+    def test_short(self):
+        assert split_message('hello world', 20) == ['hello world']
+
+    def test_splits_on_spaces(self):
+        assert split_message('the quick brown fox jumps', 10) == \
+            ['the quick', 'brown fox', 'jumps']
+
+    def test_splits_on_newlines(self):
+        assert split_message('one\r\ntwo\n\nthree', 10) == \
+            ['one', 'two', 'three']
+
+    def test_long_word(self):
+        assert split_message('abcdefghij klm', 4) == \
+            ['abcd', 'efgh', 'ij', 'klm']
+
+    def test_never_splits_utf8_characters(self):
+        message = u'\xe9\xe9\xe9\xe9\xe9'.encode('utf-8')
+
+        lines = split_message(message, 5)
+        assert [len(line) for line in lines] == [4, 4, 2]
+        for line in lines:
+            line.decode('utf-8')
+
+    def test_unicode(self):
+        assert split_message(u'caf\xe9 caf\xe9', 6) == \
+            ['caf\xc3\xa9', 'caf\xc3\xa9']
+
+    def test_lines_fit(self):
+        message = ' '.join(['word'] * 200)
+        for line in split_message(message, 100):
+            assert len(line) <= 100
+
+    def test_invalid_length(self):
+        with pytest.raises(ValueError):
+            split_message('message', 0)
+
+
+class TestPackMessages(object):
+    def test_packs_replies(self):
+        assert pack_messages(['one', 'two', 'three', 'four'], 15) == \
+            ['one | two', 'three | four']
+
+    def test_separator(self):
+        assert pack_messages(['one', 'two'], 20, separator=', ') == \
+            ['one, two']
+
+    def test_splits_long_replies(self):
+        assert pack_messages(['one', 'a long reply here', 'two'], 12) == \
+            ['one', 'a long reply', 'here | two']
+
+    def test_empty(self):
+        assert pack_messages([], 10) == []
+        assert pack_messages([''], 10) == []
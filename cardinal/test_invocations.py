@@ -0,0 +1,90 @@
+from mock import Mock
+
+from twisted.internet import defer, task
+
+from invocations import InvocationTracker
+
+
+class TestInvocationTracker(object):
+    def setup_method(self, method):
+        self.clock = task.Clock()
+        self.tracker = InvocationTracker(timeout=10, slow_threshold=5,
+                                         clock=self.clock)
+
+    def test_defaults(self):
+        tracker = InvocationTracker(clock=self.clock)
+        assert tracker.timeout == InvocationTracker.timeout
+        assert tracker.slow_threshold == InvocationTracker.slow_threshold
+
+    def test_track_completes(self):
+        d = defer.Deferred()
+        results = []
+
+        assert self.tracker.track('foo', d) is d
+        d.addCallback(results.append)
+        assert self.tracker.count() == 1
+        assert self.tracker.count('foo') == 1
+        assert self.tracker.count('bar') == 0
+
+        d.callback('result')
+
+        assert results == ['result']
+        assert self.tracker.count() == 0
+        assert self.clock.getDelayedCalls() == []
+
+    def test_track_times_out(self):
+        d = defer.Deferred()
+        failures = []
+
+        self.tracker.track('foo', d)
+        d.addErrback(failures.append)
+
+        self.clock.advance(9)
+        assert failures == []
+
+        self.clock.advance(1)
+        assert len(failures) == 1
+        assert InvocationTracker.is_timeout(failures[0])
+        assert self.tracker.count() == 0
+
+    def test_track_custom_timeout(self):
+        d = defer.Deferred()
+        failures = []
+
+        self.tracker.track('foo', d, timeout=2)
+        d.addErrback(failures.append)
+
+        self.clock.advance(2)
+        assert len(failures) == 1
+
+    def test_track_no_timeout(self):
+        d = defer.Deferred()
+
+        self.tracker.track('foo', d, timeout=0)
+
+        assert self.clock.getDelayedCalls() == []
+        assert self.tracker.count() == 1
+
+    def test_track_logs_slow(self):
+        logger = self.tracker.logger = Mock()
+        fast = defer.Deferred()
+        slow = defer.Deferred()
+
+        self.tracker.track('fast', fast)
+        self.tracker.track('slow', slow)
+
+        self.clock.advance(1)
+        fast.callback(None)
+        assert not logger.warning.called
+
+        self.clock.advance(5)
+        slow.callback(None)
+        assert logger.warning.call_count == 1
+        assert logger.warning.call_args[0][1] == 'slow'
+
+    def test_is_timeout(self):
+        failures = []
+        d = defer.fail(ValueError())
+        d.addErrback(failures.append)
+
+        assert not InvocationTracker.is_timeout(failures[0])
@@ -0,0 +1,138 @@
+import gzip
+import logging
+import os
+import sys
+import threading
+
+from log import AsyncRotatingFileHandler, CompressingRotatingFileHandler
+
+
+def make_record(message, *args):
+    return logging.LogRecord('cardinal.test', logging.INFO, __file__, 1,
+                             message, args, None)
+
+
+class TestCompressingRotatingFileHandler(object):
+    def test_creates_directory(self, tmpdir):
+        path = str(tmpdir.join('logs', 'cardinal.log'))
+
+        handler = CompressingRotatingFileHandler(path)
+        handler.close()
+
+        assert os.path.isdir(str(tmpdir.join('logs')))
+
+    def test_compresses_rotated_files(self, tmpdir):
+        path = str(tmpdir.join('cardinal.log'))
+
+        handler = CompressingRotatingFileHandler(path, maxBytes=10,
+                                                 backupCount=2)
+        for message in ('first', 'second', 'third', 'fourth'):
+            handler.emit(make_record(message))
+        handler.close()
+
+        assert open(path).read() == 'fourth\n'
+        assert gzip.open(path + '.1.gz').read() == 'third\n'
+        assert gzip.open(path + '.2.gz').read() == 'second\n'
+        assert not os.path.exists(path + '.3.gz')
+        assert not os.path.exists(path + '.1')
+
+    def test_uncompressed(self, tmpdir):
+        path = str(tmpdir.join('cardinal.log'))
+
+        handler = CompressingRotatingFileHandler(path, maxBytes=10,
+                                                 backupCount=1,
+                                                 compress=False)
+        handler.emit(make_record('first'))
+        handler.emit(make_record('second'))
+        handler.close()
+
+        assert open(path + '.1').read() == 'first\n'
+
+
+class TestAsyncRotatingFileHandler(object):
+    def test_writes_records(self, tmpdir):
+        path = str(tmpdir.join('cardinal.log'))
+
+        handler = AsyncRotatingFileHandler(path)
+        handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        for index in range(1000):
+            handler.handle(make_record('line %d', index))
+        handler.close()
+
+        lines = open(path).read().splitlines()
+        assert len(lines) == 1000
+        assert lines[0] == 'INFO line 0'
+        assert lines[-1] == 'INFO line 999'
+
+    def test_appends(self, tmpdir):
+        path = str(tmpdir.join('cardinal.log'))
+        tmpdir.join('cardinal.log').write('existing\n')
+
+        handler = AsyncRotatingFileHandler(path, maxBytes=100)
+        handler.handle(make_record('new'))
+        handler.close()
+
+        assert open(path).read() == 'existing\nnew\n'
+
+    def test_rotates(self, tmpdir):
+        path = str(tmpdir.join('cardinal.log'))
+
+        handler = AsyncRotatingFileHandler(path, maxBytes=10, backupCount=1)
+        handler.handle(make_record('first'))
+        handler.handle(make_record('second'))
+        handler.close()
+
+        assert open(path).read() == 'second\n'
+        assert gzip.open(path + '.1.gz').read() == 'first\n'
+
+    def test_unicode(self, tmpdir):
+        path = str(tmpdir.join('cardinal.log'))
+
+        handler = AsyncRotatingFileHandler(path, encoding='utf8')
+        handler.handle(make_record(u'caf\xe9'))
+        handler.handle(make_record('caf\xc3\xa9'))
+        handler.close()
+
+        assert open(path).read() == 'caf\xc3\xa9\ncaf\xc3\xa9\n'
+
+    def test_formats_exceptions_immediately(self, tmpdir):
+        path = str(tmpdir.join('cardinal.log'))
+
+        handler = AsyncRotatingFileHandler(path)
+        try:
+            raise ValueError("broken")
+        except ValueError:
+            record = logging.LogRecord('cardinal.test', logging.ERROR,
+                                       __file__, 1, 'failed', (),
+                                       sys.exc_info())
+        handler.handle(record)
+        assert record.exc_info is None
+        handler.close()
+
+        assert 'ValueError: broken' in open(path).read()
+
+    def test_drops_records_when_full(self, tmpdir):
+        path = str(tmpdir.join('cardinal.log'))
+        started = threading.Event()
+        release = threading.Event()
+
+        class BlockingFormatter(logging.Formatter):
+            def format(self, record):
+                started.set()
+                release.wait()
+                return logging.Formatter.format(self, record)
+
+        handler = AsyncRotatingFileHandler(path, queue_size=1)
+        handler.setFormatter(BlockingFormatter())
+
+        # Hold the writer up on the first record so the queue fills
+        handler.handle(make_record('first'))
+        assert started.wait(5)
+        handler.handle(make_record('second'))
+        handler.handle(make_record('dropped'))
+        assert handler.dropped == 1
+
+        release.set()
+        handler.close()
+
+        assert open(path).read() == 'first\nsecond\n'
@@ -0,0 +1,80 @@
+import pytest
+from twisted.words.protocols.irc import IRCBadMessage, parsemsg
+
+from message import Message, parse_tags
+
+
+@pytest.mark.parametrize("line", [
+    ":nick!ident@host PRIVMSG #channel :hello there",
+    ":nick!ident@host PRIVMSG #channel hello",
+    ":irc.example.org 353 Cardinal = #channel :Cardinal @op +voice",
+    ":nick!ident@host KICK #channel victim :a reason with :colons",
+    ":nick!ident@host PART #channel",
+    "PING :irc.example.org",
+    "PING irc.example.org",
+    ":irc.example.org 001 Cardinal :Welcome",
+    ":nick!ident@host PRIVMSG #channel :",
+])
+def test_matches_twisted(line):
+    message = Message(line)
+    prefix, command, params = parsemsg(line)
+
+    assert message.prefix == prefix
+    assert message.command == command
+    assert message.params == params
+    assert message.tags == {}
+    assert message.line == line
+
+
+def test_empty_line():
+    with pytest.raises(IRCBadMessage):
+        Message('')
+
+    with pytest.raises(IRCBadMessage):
+        Message(':prefix')
+
+
+def test_user():
+    message = Message(":nick!ident@host PRIVMSG #channel :hi")
+
+    user = message.user
+    assert user.group(1) == 'nick'
+    assert user.group(2) == 'ident'
+    assert user.group(3) == 'host'
+
+    # Only parsed once
+    assert message.user is user
+
+
+def test_user_from_server():
+    assert Message(":irc.example.org MODE #channel +n").user is None
+    assert Message("PING :irc.example.org").user is None
+
+
+def test_tags():
+    message = Message("@time=2016-01-01T00:00:00Z;account=nick;flag "
+                      ":nick!ident@host PRIVMSG #channel :hi")
+
+    assert message.tags == {
+        'time': '2016-01-01T00:00:00Z',
+        'account': 'nick',
+        'flag': None,
+    }
+    assert message.prefix == 'nick!ident@host'
+    assert message.command == 'PRIVMSG'
+    assert message.params == ['#channel', 'hi']
+
+
+def test_parse_tags_unescapes_values():
+    assert parse_tags(r'a=one\stwo\:three\\four\rfive\nsix;b=x\y;c=z\;d=') == {
+        'a': 'one two;three\\four\rfive\nsix',
+        'b': 'xy',
+        'c': 'z',
+        'd': None,
+    }
+
+
+def test_slots():
+    message = Message("PING :irc.example.org")
+    with pytest.raises(AttributeError):
+        message.foo = 'bar'
@@ -0,0 +1,123 @@
+import json
+import os
+
+from twisted.internet import defer
+
+from exceptions import EventRejectedMessage
+from metrics import Histogram, Metrics
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestHistogram(object):
+    def test_record(self):
+        histogram = Histogram()
+        histogram.record(0.002)
+        histogram.record(0.5)
+        histogram.record(60, error=True)
+
+        assert histogram.count == 3
+        assert histogram.errors == 1
+        assert histogram.total == 60.502
+        assert histogram.max == 60
+
+        buckets = dict((bound, count)
+                       for bound, count in histogram.to_dict()['buckets'])
+        assert buckets[0.005] == 1
+        assert buckets[0.5] == 1
+        assert buckets['+Inf'] == 1
+        assert sum(buckets.values()) == 3
+
+    def test_percentile(self):
+        histogram = Histogram()
+        assert histogram.percentile(95) == 0
+
+        for _ in range(95):
+            histogram.record(0.003)
+        for _ in range(5):
+            histogram.record(2)
+
+        assert histogram.percentile(50) == 0.005
+        assert histogram.percentile(95) == 0.005
+        assert histogram.percentile(99) == 2
+
+    def test_percentile_overflow(self):
+        histogram = Histogram()
+        histogram.record(45)
+
+        assert histogram.percentile(95) == 45
+
+
+class TestMetrics(object):
+    def setup_method(self, method):
+        self.clock = FakeClock()
+        self.metrics = Metrics(clock=self.clock)
+
+    def test_record(self):
+        self.metrics.record('foo', 'foo.bar', 0)
+        self.clock.now = 2
+        self.metrics.record('foo', 'foo.bar', 0, error=True)
+        self.metrics.record('baz', 'baz.qux', 1)
+
+        assert self.metrics.stats('foo') == {
+            'foo': {
+                'foo.bar': {
+                    'count': 2,
+                    'errors': 1,
+                    'total': 2,
+                    'mean': 1.0,
+                    'p95': 2,
+                    'max': 2,
+                },
+            },
+        }
+        assert sorted(self.metrics.stats().keys()) == ['baz', 'foo']
+        assert self.metrics.stats('unknown') == {}
+
+    def test_track(self):
+        d = defer.Deferred()
+        assert self.metrics.track('foo', 'foo.bar', 0, d) is d
+        assert self.metrics.stats() == {}
+
+        self.clock.now = 1
+        d.callback('result')
+
+        results = []
+        d.addCallback(results.append)
+        assert results == ['result']
+
+        stats = self.metrics.stats('foo')['foo']['foo.bar']
+        assert stats['count'] == 1
+        assert stats['errors'] == 0
+        assert stats['max'] == 1
+
+    def test_track_failure(self):
+        for exception in (Exception(), EventRejectedMessage()):
+            d = defer.Deferred()
+            self.metrics.track('foo', exception.__class__.__name__, 0, d)
+            d.errback(exception)
+            d.addErrback(lambda failure: None)
+
+        stats = self.metrics.stats('foo')['foo']
+        assert stats['Exception']['errors'] == 1
+        assert stats['EventRejectedMessage']['errors'] == 0
+
+    def test_dump(self, tmpdir):
+        path = str(tmpdir.join('metrics.json'))
+
+        self.clock.now = 1
+        self.metrics.record('foo', 'foo.bar', 0)
+        self.metrics.dump(path)
+
+        with open(path) as f:
+            data = json.load(f)
+
+        assert data['generated'] == 1
+        assert data['plugins']['foo']['foo.bar']['count'] == 1
+        assert not os.path.exists(path + '.tmp')
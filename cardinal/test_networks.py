@@ -0,0 +1,121 @@
+from mock import Mock, patch
+import pytest
+
+import networks
+from networks import NetworkManager, network_configs
+
+CONFIG = {
+    'network': 'irc.darkscience.net',
+    'port': 6697,
+    'ssl': True,
+    'server_password': None,
+    'nickname': 'Cardinal',
+    'password': None,
+    'channels': ['#bots'],
+    'plugins': ['help', 'ping'],
+    'send_queue': None,
+    'networks': None,
+}
+
+
+def make_factory(name):
+    factory = Mock()
+    factory.name = name
+    factory.network = name
+    return factory
+
+
+class TestNetworkConfigs(object):
+    def test_single_network(self):
+        configs = network_configs(CONFIG)
+
+        assert len(configs) == 1
+        assert configs[0]['name'] == 'irc.darkscience.net'
+        assert configs[0]['network'] == 'irc.darkscience.net'
+        assert configs[0]['channels'] == ['#bots']
+
+    def test_networks_fall_back_to_top_level(self):
+        config = dict(CONFIG, networks=[
+            {'name': 'DarkScience'},
+            {'name': 'freenode', 'network': 'chat.freenode.net',
+             'nickname': 'Cardinal2', 'channels': ['#cardinal'],
+             'ssl': False, 'port': 6667},
+        ])
+
+        darkscience, freenode = network_configs(config)
+
+        assert darkscience['name'] == 'darkscience'
+        assert darkscience['network'] == 'irc.darkscience.net'
+        assert darkscience['nickname'] == 'Cardinal'
+        assert darkscience['port'] == 6697
+
+        assert freenode['name'] == 'freenode'
+        assert freenode['network'] == 'chat.freenode.net'
+        assert freenode['nickname'] == 'Cardinal2'
+        assert freenode['channels'] == ['#cardinal']
+        assert freenode['plugins'] == ['help', 'ping']
+        assert freenode['ssl'] is False
+
+    @pytest.mark.parametrize("networks", [
+        [{}, {}],
+        [{'name': 'same'}, {'name': 'SAME', 'network': 'other.net'}],
+        [{'channel': '#typo'}],
+        ['irc.darkscience.net'],
+    ])
+    def test_invalid(self, networks):
+        with pytest.raises(ValueError):
+            network_configs(dict(CONFIG, networks=networks))
+
+    def test_no_server(self):
+        with pytest.raises(ValueError):
+            network_configs(dict(CONFIG, network=None))
+
+
+class TestNetworkManager(object):
+    def test_add(self):
+        manager = NetworkManager(['ping'])
+        factory = make_factory('darkscience')
+
+        manager.add(factory)
+        assert factory.networks is manager
+        assert manager.get('darkscience') is factory
+        assert manager.get('freenode') is None
+        assert 'ping' in manager.shared_plugins
+
+        with pytest.raises(ValueError):
+            manager.add(make_factory('darkscience'))
+
+    @patch.object(networks, 'reactor')
+    def test_connect(self, reactor):
+        manager = NetworkManager()
+        factory = make_factory('darkscience')
+
+        manager.connect(factory, 6667)
+        reactor.connectTCP.assert_called_once_with(
+            'darkscience', 6667, factory)
+        assert manager.get('darkscience') is factory
+
+    @patch.object(networks, 'reactor')
+    def test_stops_after_last_network(self, reactor):
+        manager = NetworkManager()
+        darkscience = make_factory('darkscience')
+        freenode = make_factory('freenode')
+        manager.connect(darkscience, 6667)
+        manager.connect(freenode, 6667)
+
+        manager.stopped(darkscience)
+        assert not reactor.stop.called
+
+        manager.stopped(freenode)
+        reactor.stop.assert_called_once_with()
+
+    def test_sigint_shuts_down_every_network(self):
+        manager = NetworkManager()
+        factories = [make_factory('darkscience'), make_factory('freenode')]
+        for factory in factories:
+            manager.add(factory)
+
+        manager._sigint(None, None)
+
+        for factory in factories:
+            factory.shutdown.assert_called_once_with('Received SIGINT.')
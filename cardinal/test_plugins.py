@@ -1,13 +1,31 @@
 import inspect
 import os
+import re
 import sys
 
 from mock import Mock, patch
 import pytest
 
+from twisted.internet import defer
+
 from bot import CardinalBot
-from exceptions import AmbiguousConfigError
-from plugins import PluginManager
+from exceptions import (
+    AmbiguousConfigError,
+    EventCallbackError,
+    EventDoesNotExistError,
+    EventRejectedMessage,
+)
+from metrics import Metrics
+import plugins
+from plugins import (
+    EventManager,
+    LiteralMatcher,
+    PluginManager,
+    RegexDispatcher,
+    SharedPlugins,
+)
+from ratelimit import RateLimiter
+from users import User
 
 DIR_PATH = os.path.dirname(os.path.realpath(__file__))
 FIXTURE_PATH = os.path.join(DIR_PATH, 'fixtures')
@@ -99,7 +117,7 @@ class TestPluginManager(object):
         assert manager.plugins[name]['callbacks'] == []
         assert manager.plugins[name]['callback_ids'] == {}
         assert manager.plugins[name]['config'] is None
-        assert manager.plugins[name]['blacklist'] == []
+        assert manager.plugins[name]['blacklist'] == set()
 
     def test_load_valid_string(self):
         name = 'valid'
@@ -120,7 +138,7 @@ class TestPluginManager(object):
         assert manager.plugins[name]['callbacks'] == []
         assert manager.plugins[name]['callback_ids'] == {}
         assert manager.plugins[name]['config'] is None
-        assert manager.plugins[name]['blacklist'] == []
+        assert manager.plugins[name]['blacklist'] == set()
 
     @patch.object(PluginManager, '_load_plugin_config')
     def test_load_ambiguous_config_fails(self, mock):
@@ -281,3 +299,691 @@ class TestPluginManager(object):
         assert manager.plugins.keys() == []
 
         mock.assert_called_with(name)
+
+    def test_load_builds_command_index(self):
+        name = 'commands'
+
+        manager = PluginManager(Mock(),
+                                _plugin_module_import_prefix='fake_plugins')
+        manager.load(name)
+
+        instance = manager.plugins[name]['instance']
+        view = manager.dispatch_view()
+        assert view.plugins == (name,)
+        assert sorted(view.command_index.keys()) == \
+            ['bar', 'blocking', 'deferred', 'foo', 'ping']
+        assert view.command_index['foo'] == ((name, instance.foo),)
+        assert view.command_index['bar'] == ((name, instance.foo),)
+        assert [command.__name__
+                for _, command in view.regex_dispatcher.commands] == \
+            ['baz', 'ping']
+
+    def test_unload_clears_command_index(self):
+        name = 'commands'
+
+        manager = PluginManager(Mock(),
+                                _plugin_module_import_prefix='fake_plugins')
+        manager.load(name)
+        manager.unload(name)
+
+        view = manager.dispatch_view()
+        assert view.plugins == ()
+        assert view.command_index == {}
+        assert view.regex_dispatcher.commands == ()
+
+    def test_reload_rebuilds_command_index(self):
+        name = 'commands'
+
+        cardinal = Mock(CardinalBot)
+        cardinal.reloads = 0
+
+        manager = PluginManager(cardinal,
+                                _plugin_module_import_prefix='fake_plugins')
+        manager.load(name)
+        manager.load(name)
+
+        instance = manager.plugins[name]['instance']
+        assert manager.dispatch_view().command_index['foo'] == \
+            ((name, instance.foo),)
+
+    @pytest.mark.parametrize("message,expected", [
+        ('.foo', [('foo', '.foo')]),
+        ('.bar baz', [('foo', '.bar baz')]),
+        ('Cardinal: foo', [('foo', 'Cardinal: foo')]),
+        ('baz qux', [('baz', 'baz qux')]),
+        ('ping', [('ping', 'ping')]),
+        ('.ping', [('ping', '.ping')]),
+        ('hello', []),
+    ])
+    def test_call_command(self, message, expected):
+        name = 'commands'
+
+        cardinal = Mock(CardinalBot)
+        cardinal.nickname = 'Cardinal'
+
+        manager = PluginManager(cardinal,
+                                _plugin_module_import_prefix='fake_plugins')
+        manager.load(name)
+
+        called = manager.call_command(Mock(), '#channel', message)
+
+        assert manager.plugins[name]['instance'].calls == expected
+        assert called == (len(expected) > 0)
+
+    def test_call_command_unknown_trigger(self):
+        name = 'commands'
+
+        cardinal = Mock(CardinalBot)
+        cardinal.nickname = 'Cardinal'
+
+        manager = PluginManager(cardinal,
+                                _plugin_module_import_prefix='fake_plugins')
+        manager.load(name)
+
+        assert manager.call_command(Mock(), '#channel', '.unknown') is False
+        assert manager.plugins[name]['instance'].calls == []
+
+    def test_call_command_blacklisted(self):
+        name = 'commands'
+
+        cardinal = Mock(CardinalBot)
+        cardinal.nickname = 'Cardinal'
+
+        manager = PluginManager(cardinal,
+                                _plugin_module_import_prefix='fake_plugins')
+        manager.load(name)
+        manager.blacklist(name, '#channel')
+
+        assert manager.call_command(Mock(), '#channel', '.foo') is False
+        assert manager.call_command(Mock(), '#other', '.foo') is True
+        assert manager.plugins[name]['instance'].calls == [('foo', '.foo')]
+
+    def test_call_command_rate_limited(self):
+        name = 'commands'
+
+        cardinal = Mock(CardinalBot)
+        cardinal.nickname = 'Cardinal'
+        rate_limiter = Mock()
+        rate_limiter.allow.return_value = False
+
+        manager = PluginManager(cardinal, rate_limiter=rate_limiter,
+                                _plugin_module_import_prefix='fake_plugins')
+        manager.load(name)
+
+        user = User('nick', 'ident', 'host')
+        assert manager.call_command(user, '#channel', '.foo') is True
+        rate_limiter.allow.assert_called_once_with(
+            'ident@host', '#channel', 'commands.foo')
+        assert manager.plugins[name]['instance'].calls == []
+
+    def test_call_command_regex_not_rate_limited(self):
+        name = 'commands'
+
+        cardinal = Mock(CardinalBot)
+        cardinal.nickname = 'Cardinal'
+        rate_limiter = RateLimiter({'user': {'rate': 1, 'burst': 1}})
+
+        manager = PluginManager(cardinal, rate_limiter=rate_limiter,
+                                _plugin_module_import_prefix='fake_plugins')
+        manager.load(name)
+
+        user = User('nick', 'ident', 'host')
+        for _ in range(3):
+            manager.call_command(user, '#channel', 'baz')
+        manager.call_command(user, '#channel', '.foo')
+        manager.call_command(user, '#channel', '.foo')
+
+        assert manager.plugins[name]['instance'].calls == \
+            [('baz', 'baz')] * 3 + [('foo', '.foo')]
+
+        rate_limiter.limit_regex = True
+        manager.call_command(user, '#channel', 'baz')
+        assert len(manager.plugins[name]['instance'].calls) == 4
+
+    def test_call_command_blocking(self):
+        name = 'commands'
+
+        cardinal = Mock(CardinalBot)
+        cardinal.nickname = 'Cardinal'
+        thread_pools = Mock()
+
+        manager = PluginManager(cardinal, thread_pools=thread_pools,
+                                _plugin_module_import_prefix='fake_plugins')
+        manager.load(name)
+
+        instance = manager.plugins[name]['instance']
+        user = Mock()
+
+        assert manager.call_command(user, '#channel', '.blocking') is True
+        thread_pools.run.assert_called_once_with(
+            name, instance.blocking_command,
+            cardinal, user, '#channel', '.blocking')
+        assert instance.calls == []
+
+    def test_call_command_records_metrics(self):
+        name = 'commands'
+
+        cardinal = Mock(CardinalBot)
+        cardinal.nickname = 'Cardinal'
+
+        manager = PluginManager(cardinal,
+                                _plugin_module_import_prefix='fake_plugins')
+        manager.load(name)
+
+        manager.call_command(Mock(), '#channel', '.foo')
+        manager.call_command(Mock(), '#channel', '.deferred')
+
+        # Deferreds aren't recorded until they fire
+        stats = manager.metrics.stats(name)[name]
+        assert sorted(stats.keys()) == ['commands.foo']
+        assert stats['commands.foo']['count'] == 1
+
+        manager.plugins[name]['instance'].deferred.errback(Exception())
+
+        stats = manager.metrics.stats(name)[name]
+        assert stats['commands.deferred_command']['count'] == 1
+        assert stats['commands.deferred_command']['errors'] == 1
+
+    def test_dispatch_view_blacklist(self):
+        manager = PluginManager(Mock(),
+                                _plugin_module_import_prefix='fake_plugins')
+        manager.load(['commands', 'valid'])
+
+        default_view = manager.dispatch_view()
+        assert manager.dispatch_view('#channel') is default_view
+
+        assert manager.blacklist('commands', ['#channel', '#other'])
+        assert manager.plugins['commands']['blacklist'] == \
+            set(['#channel', '#other'])
+
+        view = manager.dispatch_view('#channel')
+        assert view.plugins == ('valid',)
+        assert view.command_index == {}
+        assert manager.dispatch_view('#other') is view
+        assert manager.dispatch_view('#unrestricted') is default_view
+        assert list(manager.itercommands('#channel')) == []
+
+        assert manager.unblacklist('commands', ['#channel', '#nope']) == \
+            ['#nope']
+        assert manager.plugins['commands']['blacklist'] == set(['#other'])
+        assert manager.dispatch_view('#channel') is default_view
+        assert manager.dispatch_view('#other').plugins == ('valid',)
+
+    def test_dispatch_view_cached_until_invalidated(self):
+        manager = PluginManager(Mock(),
+                                _plugin_module_import_prefix='fake_plugins')
+        manager.load('commands')
+        manager.blacklist('commands', '#channel')
+
+        view = manager.dispatch_view('#channel')
+        assert manager.dispatch_view('#channel') is view
+
+        manager.load('valid')
+        assert manager.dispatch_view('#channel') is not view
+        assert manager.dispatch_view('#channel').plugins == ('valid',)
+
+    def test_dispatch_view_only_cached_for_blacklisted_channels(self):
+        manager = PluginManager(Mock(),
+                                _plugin_module_import_prefix='fake_plugins')
+        manager.load('commands')
+        manager.blacklist('commands', '#channel')
+
+        # Private messages use the sender's nick as the channel
+        for nick in ('foo', 'bar', '#unrestricted'):
+            assert manager.dispatch_view(nick) is manager.dispatch_view()
+
+        assert sorted(manager.dispatch_views) == ['#channel']
+
+
+class TestLiteralMatcher(object):
+    @pytest.mark.parametrize("message,expected", [
+        ('ushers', ['he', 'hers', 'she']),
+        ('this', ['his']),
+        ('a.b', ['.']),
+        ('no match', []),
+        ('', []),
+    ])
+    def test_search(self, message, expected):
+        matcher = LiteralMatcher(['he', 'she', 'his', 'hers', '.'])
+        assert sorted(matcher.search(message)) == expected
+
+    def test_search_no_literals(self):
+        matcher = LiteralMatcher([])
+        assert matcher.search('anything') == set()
+
+
+class TestRegexDispatcher(object):
+    @pytest.mark.parametrize("pattern,expected", [
+        (r'(?i)^ping[.?!]?$', 'ping'),
+        (r'^!([^\s]+.*)', '!'),
+        (r'[a-z]+[.][a-z]{2,4}', '.'),
+        (r'(?:https?://)?example', 'example'),
+        (r'(abc)+def', 'abc'),
+        (r'x{0,3}yz', 'yz'),
+        (r'FOO', 'foo'),
+        (r'foo|bar', None),
+        (r'.*', None),
+    ])
+    def test_required_literal(self, pattern, expected):
+        assert RegexDispatcher._required_literal(
+            re.compile(pattern)) == expected
+
+    def _make_command(self, regex):
+        def command(*args):
+            pass
+        command.regex = regex
+
+        return command
+
+    def test_match(self):
+        ping = self._make_command(r'(?i)^ping[.?!]?$')
+        note = self._make_command(re.compile(r'^!([^\s]+.*)'))
+        anything = self._make_command(r'.*')
+        upper = self._make_command(r'FOO')
+
+        dispatcher = RegexDispatcher([
+            ('ping', ping),
+            ('notes', note),
+            ('anything', anything),
+            ('upper', upper),
+        ])
+
+        assert dispatcher.match('PING!') == [
+            ('ping', ping),
+            ('anything', anything),
+        ]
+        assert dispatcher.match('!note') == [
+            ('notes', note),
+            ('anything', anything),
+        ]
+        assert dispatcher.match('foo') == [('anything', anything)]
+        assert dispatcher.match('FOO') == [
+            ('anything', anything),
+            ('upper', upper),
+        ]
+
+    def test_match_no_commands(self):
+        dispatcher = RegexDispatcher()
+        assert dispatcher.match('ping') == []
+
+
+class TestEventManager(object):
+    def setup_method(self, method):
+        self.event_manager = EventManager(Mock(CardinalBot))
+        self.event_manager.register('test.event', 1)
+
+    def test_fire_records_metrics(self):
+        def accept(cardinal, param):
+            pass
+
+        def reject(cardinal, param):
+            raise EventRejectedMessage()
+
+        def error(cardinal, param):
+            raise Exception()
+
+        ids = dict(
+            (callback.__name__,
+             self.event_manager.register_callback('test.event', callback))
+            for callback in (accept, reject, error)
+        )
+
+        assert self.event_manager.fire('test.event', 'param') is True
+
+        stats = self.event_manager.metrics.stats()[__name__]
+        for callback, errors in (('accept', 0), ('reject', 0), ('error', 1)):
+            key = 'test.event:%s' % ids[callback]
+            assert stats[key]['count'] == 1
+            assert stats[key]['errors'] == errors
+
+    @patch('twisted.python.threadable.isInIOThread', return_value=True)
+    def test_fire_records_deferred_metrics(self, isInIOThread):
+        d = defer.Deferred()
+
+        def callback(cardinal, param):
+            return d
+
+        callback_id = self.event_manager.register_callback('test.event',
+                                                           callback)
+        self.event_manager.fire('test.event', 'param')
+        assert self.event_manager.metrics.stats() == {}
+
+        d.callback(None)
+
+        stats = self.event_manager.metrics.stats()[__name__]
+        assert stats['test.event:%s' % callback_id]['count'] == 1
+
+    @patch('twisted.python.threadable.isInIOThread', return_value=False)
+    def test_fire_tracks_deferred_on_reactor_thread(self, isInIOThread):
+        d = defer.Deferred()
+
+        def callback(cardinal, param):
+            return d
+
+        self.event_manager.register_callback('test.event', callback)
+        self.event_manager.invocations = Mock()
+
+        with patch.object(plugins, 'reactor') as reactor:
+            assert self.event_manager.fire('test.event', 'param') is True
+
+        # Fired from a thread pool, so tracking is handed to the reactor
+        assert not self.event_manager.invocations.track.called
+        assert reactor.callFromThread.call_count == 1
+        args = reactor.callFromThread.call_args[0]
+        assert args[0] == self.event_manager._track_callback
+        assert args[3] is d
+
+        isInIOThread.return_value = True
+        args[0](*args[1:])
+        assert self.event_manager.invocations.track.call_count == 1
+
+    def test_fire_no_callbacks(self):
+        assert self.event_manager.compiled_callbacks['test.event'] == ()
+        assert self.event_manager.fire('test.event', 'param') is False
+
+    def test_fire_priority_order(self):
+        calls = []
+
+        def make_callback(label):
+            def callback(cardinal, param):
+                calls.append(label)
+            return callback
+
+        self.event_manager.register_callback('test.event', make_callback('a'))
+        self.event_manager.register_callback('test.event', make_callback('b'),
+                                             priority=10)
+        self.event_manager.register_callback('test.event', make_callback('c'))
+
+        # Priority attributes set by the decorator are honored
+        callback = make_callback('d')
+        callback.priority = 5
+        self.event_manager.register_callback('test.event', callback)
+
+        self.event_manager.fire('test.event', 'param')
+        assert calls == ['b', 'd', 'a', 'c']
+
+    def test_fire_first_acceptor(self):
+        self.event_manager.register('test.first', 1, first_acceptor=True)
+        calls = []
+
+        def reject(cardinal, param):
+            calls.append('reject')
+            raise EventRejectedMessage()
+
+        def accept(cardinal, param):
+            calls.append('accept')
+
+        def never(cardinal, param):
+            calls.append('never')
+
+        for callback in (reject, accept, never):
+            self.event_manager.register_callback('test.first', callback)
+
+        assert self.event_manager.fire('test.first', 'param') is True
+        assert calls == ['reject', 'accept']
+
+        # Other events still call every callback
+        del calls[:]
+        for callback in (reject, accept, never):
+            self.event_manager.register_callback('test.event', callback)
+
+        assert self.event_manager.fire('test.event', 'param') is True
+        assert calls == ['reject', 'accept', 'never']
+
+    def test_callbacks_compiled_on_register(self):
+        calls = []
+
+        def callback(cardinal, param):
+            calls.append(param)
+
+        callback_id = self.event_manager.register_callback('test.later',
+                                                           callback)
+        assert 'test.later' not in self.event_manager.compiled_callbacks
+
+        self.event_manager.register('test.later', 1)
+        self.event_manager.fire('test.later', 'param')
+        assert calls == ['param']
+
+        self.event_manager.remove_callback('test.later', callback_id)
+        assert self.event_manager.compiled_callbacks['test.later'] == ()
+
+        self.event_manager.remove('test.later')
+        assert 'test.later' not in self.event_manager.compiled_callbacks
+        assert 'test.later' not in self.event_manager.callback_priorities
+
+    def test_register_params_mismatch(self):
+        with pytest.raises(TypeError):
+            self.event_manager.register('test.params', 2, params=('foo',))
+
+    def test_fire_filters(self):
+        self.event_manager.register('test.filtered', 3,
+                                    params=('command', 'channel', 'message'))
+        calls = []
+
+        def channels(cardinal, command, channel, message):
+            calls.append('channels')
+
+        def commands(cardinal, command, channel, message):
+            calls.append('commands')
+
+        def prefix(cardinal, command, channel, message):
+            calls.append('prefix')
+
+        self.event_manager.register_callback(
+            'test.filtered', channels, filters={'channels': ['#Foo', '#bar']})
+        self.event_manager.register_callback(
+            'test.filtered', commands, filters={'commands': ['privmsg', '001']})
+
+        # Filters set by the decorator are honored
+        prefix.filters = {'prefix': '!'}
+        self.event_manager.register_callback('test.filtered', prefix)
+
+        self.event_manager.fire('test.filtered', 'NOTICE', '#baz', 'hello')
+        assert calls == []
+
+        self.event_manager.fire('test.filtered', 'PRIVMSG', '#FOO', 'hello')
+        assert calls == ['channels', 'commands']
+
+        del calls[:]
+        self.event_manager.fire('test.filtered', '001', '#baz', '!hello')
+        assert calls == ['commands', 'prefix']
+
+    def test_register_callback_invalid_filters(self):
+        def callback(cardinal, param):
+            pass
+
+        with pytest.raises(EventCallbackError):
+            self.event_manager.register_callback(
+                'test.event', callback, filters={'unknown': ['foo']})
+
+        # test.event has no channel parameter to filter on
+        with pytest.raises(EventCallbackError):
+            self.event_manager.register_callback(
+                'test.event', callback, filters={'channels': ['#foo']})
+
+    def test_filters_compiled_on_register(self):
+        calls = []
+
+        def callback(cardinal, channel):
+            calls.append(channel)
+
+        def unfilterable(cardinal, channel):
+            calls.append('unfilterable')
+
+        self.event_manager.register_callback(
+            'test.later', callback, filters={'channels': '#foo'})
+        self.event_manager.register_callback(
+            'test.later', unfilterable, filters={'prefix': '!'})
+
+        self.event_manager.register('test.later', 1, params=('channel',))
+
+        # The callback whose filter can't apply is never called
+        assert len(self.event_manager.compiled_callbacks['test.later']) == 1
+
+        self.event_manager.fire('test.later', '#bar')
+        self.event_manager.fire('test.later', '#foo')
+        assert calls == ['#foo']
+
+    @patch('twisted.python.threadable.isInIOThread', return_value=True)
+    def test_fire_batched(self, isInIOThread):
+        self.event_manager.register('test.batched', 2,
+                                    params=('channel', 'message'))
+        batches = []
+
+        def batched(cardinal, items):
+            batches.append(items)
+
+        callback_id = self.event_manager.register_callback(
+            'test.batched', batched, batch={'size': 10, 'interval': 1000},
+            filters={'channels': ['#foo']})
+
+        # Batched callbacks can't accept the event synchronously
+        assert self.event_manager.fire('test.batched', '#foo', 'a') is False
+        self.event_manager.fire('test.batched', '#bar', 'b')
+        self.event_manager.fire('test.batched', '#foo', 'c')
+        assert batches == []
+
+        self.event_manager.callback_batches['test.batched'][callback_id] \
+            .flush()
+        assert batches == [[('#foo', 'a'), ('#foo', 'c')]]
+
+        stats = self.event_manager.metrics.stats()[__name__]
+        assert stats['test.batched:%s' % callback_id]['count'] == 1
+
+        self.event_manager.remove_callback('test.batched', callback_id)
+        assert self.event_manager.callback_batches['test.batched'] == {}
+
+    def test_register_callback_batched_arguments(self):
+        def batched(cardinal, items):
+            pass
+
+        def unbatched(cardinal, param):
+            pass
+
+        self.event_manager.register('test.batched', 3)
+        self.event_manager.register_callback('test.batched', batched,
+                                             batch=True)
+
+        with pytest.raises(EventCallbackError):
+            self.event_manager.register_callback('test.event', unbatched,
+                                                 batch='yes')
+
+    def test_fire_warns_slow_callbacks(self):
+        now = [0]
+        event_manager = EventManager(Mock(CardinalBot),
+                                     metrics=Metrics(clock=lambda: now[0]),
+                                     callback_budget=1)
+        event_manager.register('test.event', 1)
+        event_manager.logger = Mock()
+
+        def callback(cardinal, duration):
+            now[0] += duration
+
+        callback_id = event_manager.register_callback('test.event', callback)
+
+        event_manager.fire('test.event', 0.5)
+        assert not event_manager.logger.warning.called
+
+        event_manager.fire('test.event', 2)
+        assert event_manager.logger.warning.call_count == 1
+
+        # Further warnings are suppressed for a while
+        event_manager.fire('test.event', 2)
+        assert event_manager.logger.warning.call_count == 1
+
+        now[0] += event_manager.slow_warning_interval
+        event_manager.fire('test.event', 2)
+        assert event_manager.logger.warning.call_count == 2
+        assert event_manager.logger.warning.call_args[0][-1] == 1
+
+        stats = event_manager.metrics.stats()[__name__]
+        assert stats['test.event:%s' % callback_id]['total'] == 6.5
+
+    def test_fire_nonexistent_event(self):
+        with pytest.raises(EventDoesNotExistError):
+            self.event_manager.fire('test.unknown')
+
+
+class TestSharedPlugins(object):
+    def test_acquire_release(self):
+        shared = SharedPlugins(['plugin'])
+        create = Mock(side_effect=[object(), object()])
+
+        assert 'plugin' in shared
+        assert 'other' not in shared
+
+        instance = shared.acquire('plugin', create)
+        assert shared.acquire('plugin', create) is instance
+        assert create.call_count == 1
+
+        assert shared.release('plugin', instance) is False
+        assert shared.release('plugin', instance) is True
+        assert shared.instances == {}
+
+        assert shared.acquire('plugin', create) is not instance
+
+    def test_reload(self):
+        shared = SharedPlugins(['plugin'])
+        create = Mock(side_effect=[object(), object()])
+
+        old = shared.acquire('plugin', create)
+        shared.acquire('plugin', create)
+        new = shared.acquire('plugin', create, reload=True)
+        assert new is not old
+        assert shared.instances['plugin'] is new
+
+        # The old instance is only done with once both networks release it
+        assert shared.release('plugin', old) is False
+        assert shared.release('plugin', old) is True
+        assert shared.instances['plugin'] is new
+
+    def test_plugin_managers_share_instance(self):
+        name = 'shared'
+        shared = SharedPlugins([name])
+
+        first = PluginManager(Mock(), shared_plugins=shared,
+                              _plugin_module_import_prefix='fake_plugins')
+        second = PluginManager(Mock(), shared_plugins=shared,
+                               _plugin_module_import_prefix='fake_plugins')
+
+        assert first.load([name]) == []
+        assert second.load([name]) == []
+
+        instance = first.plugins[name]['instance']
+        assert second.plugins[name]['instance'] is instance
+
+        closed = type(instance).closed
+        del closed[:]
+
+        assert first.unload([name]) == []
+        assert closed == []
+
+        assert second.unload([name]) == []
+        assert closed == [instance]
+
+    def test_reload_shared_plugin(self):
+        name = 'shared'
+        shared = SharedPlugins([name])
+
+        cardinal = Mock(CardinalBot)
+        cardinal.reloads = 0
+
+        first = PluginManager(cardinal, shared_plugins=shared,
+                              _plugin_module_import_prefix='fake_plugins')
+        second = PluginManager(cardinal, shared_plugins=shared,
+                               _plugin_module_import_prefix='fake_plugins')
+        first.load([name])
+        second.load([name])
+
+        old = first.plugins[name]['instance']
+        closed = type(old).closed
+        del closed[:]
+
+        # Reloading only gives the reloading network a new instance
+        assert first.load([name]) == []
+        assert closed == []
+        assert first.plugins[name]['instance'] is not old
+        assert second.plugins[name]['instance'] is old
+
+        second.unload([name])
+        assert closed == [old]
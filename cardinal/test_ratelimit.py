@@ -0,0 +1,104 @@
+from twisted.internet import task
+
+from ratelimit import RateLimiter, TokenBucket
+
+
+class TestTokenBucket(object):
+    def test_refill(self):
+        bucket = TokenBucket(2, 4, 0)
+        assert bucket.tokens == 4
+
+        bucket.tokens = 0
+        assert bucket.refill(1) == 2
+        assert bucket.refill(1) == 2
+
+        # Never holds more than the burst size
+        assert bucket.refill(10) == 4
+
+    def test_is_full(self):
+        bucket = TokenBucket(1, 2, 0)
+        bucket.tokens = 1
+
+        assert not bucket.is_full(0.5)
+        assert bucket.is_full(1)
+
+
+class TestRateLimiter(object):
+    def setup_method(self, method):
+        self.clock = task.Clock()
+
+    def make_limiter(self, **config):
+        return RateLimiter(config, clock=self.clock)
+
+    def test_defaults(self):
+        limiter = RateLimiter(clock=self.clock)
+        assert limiter.budgets == RateLimiter.budgets
+        assert limiter.command_budgets == {}
+        assert limiter.limit_regex is False
+
+        # Rate limiting is opt-in
+        for _ in range(100):
+            assert limiter.allow('host', '#channel', 'foo.bar')
+        assert limiter.buckets == {}
+
+    def test_user_budget(self):
+        limiter = self.make_limiter(user={'rate': 1, 'burst': 2},
+                                    channel=None, command=None)
+
+        assert limiter.allow('host', '#channel', 'foo.bar')
+        assert limiter.allow('host', '#other', 'foo.baz')
+        assert not limiter.allow('host', '#channel', 'foo.bar')
+        assert limiter.dropped == 1
+
+        # Other users have their own budget
+        assert limiter.allow('other', '#channel', 'foo.bar')
+
+        self.clock.advance(1)
+        assert limiter.allow('host', '#channel', 'foo.bar')
+        assert not limiter.allow('host', '#channel', 'foo.bar')
+
+    def test_channel_budget(self):
+        limiter = self.make_limiter(user=None,
+                                    channel={'rate': 1, 'burst': 1},
+                                    command=None)
+
+        assert limiter.allow('host', '#channel', 'foo.bar')
+        assert not limiter.allow('other', '#channel', 'foo.bar')
+        assert limiter.allow('other', '#other', 'foo.bar')
+
+    def test_command_budget(self):
+        limiter = self.make_limiter(user=None, channel=None,
+                                    command={'rate': 1, 'burst': 1},
+                                    commands={'foo.bar': {'rate': 1,
+                                                          'burst': 2}})
+
+        assert limiter.allow('host', '#channel', 'foo.baz')
+        assert not limiter.allow('other', '#other', 'foo.baz')
+
+        assert limiter.allow('host', '#channel', 'foo.bar')
+        assert limiter.allow('other', '#other', 'foo.bar')
+        assert not limiter.allow('host', '#channel', 'foo.bar')
+
+    def test_refusal_consumes_nothing(self):
+        limiter = self.make_limiter(user={'rate': 1, 'burst': 1},
+                                    channel={'rate': 1, 'burst': 2},
+                                    command=None)
+
+        assert limiter.allow('host', '#channel', 'foo.bar')
+        assert not limiter.allow('host', '#channel', 'foo.bar')
+
+        # The channel's remaining token wasn't spent on the refused command
+        assert limiter.allow('other', '#channel', 'foo.bar')
+
+    def test_prune(self):
+        limiter = self.make_limiter(user={'rate': 1, 'burst': 1},
+                                    channel=None, command=None)
+        limiter.max_buckets = 2
+
+        limiter.allow('foo', '#channel', 'foo.bar')
+        limiter.allow('bar', '#channel', 'foo.bar')
+
+        self.clock.advance(1)
+        limiter.allow('baz', '#channel', 'foo.bar')
+
+        assert sorted(limiter.buckets) == [('user', 'baz')]
@@ -0,0 +1,196 @@
+from twisted.internet import task
+
+from sendqueue import (
+    SendQueue,
+    PRIORITY_HIGH,
+    PRIORITY_NORMAL,
+    PRIORITY_LOW,
+)
+
+
+class TestSendQueue(object):
+    def setup_method(self, method):
+        self.clock = task.Clock()
+        self.sent = []
+
+    def make_queue(self, **config):
+        return SendQueue(self.sent.append, config, clock=self.clock)
+
+    def test_defaults(self):
+        queue = SendQueue(self.sent.append, clock=self.clock)
+        assert queue.rate == SendQueue.rate
+        assert queue.burst == SendQueue.burst
+        assert queue.max_age == SendQueue.max_age
+
+    def test_sends_immediately_within_burst(self):
+        queue = self.make_queue(burst=2)
+
+        queue.enqueue('NICK Cardinal')
+        queue.enqueue('USER Cardinal')
+        assert self.sent == ['NICK Cardinal', 'USER Cardinal']
+        assert len(queue) == 0
+
+    def test_global_pacing(self):
+        queue = self.make_queue(rate=1, burst=1)
+
+        queue.enqueue('JOIN #a')
+        queue.enqueue('JOIN #b')
+        queue.enqueue('JOIN #c')
+        assert self.sent == ['JOIN #a']
+        assert len(queue) == 2
+
+        self.clock.advance(1)
+        assert self.sent == ['JOIN #a', 'JOIN #b']
+
+        self.clock.advance(1)
+        assert self.sent == ['JOIN #a', 'JOIN #b', 'JOIN #c']
+        assert len(queue) == 0
+        assert not self.clock.getDelayedCalls()
+
+    def test_targets_take_turns(self):
+        queue = self.make_queue(rate=10, burst=10,
+                                target_rate=1, target_burst=1)
+
+        queue.enqueue('PRIVMSG #a :1', '#a')
+        queue.enqueue('PRIVMSG #a :2', '#a')
+        queue.enqueue('PRIVMSG #a :3', '#a')
+        queue.enqueue('PRIVMSG #b :1', '#b')
+
+        # A busy channel doesn't hold up others
+        assert self.sent == ['PRIVMSG #a :1', 'PRIVMSG #b :1']
+
+        self.clock.advance(1)
+        assert self.sent[2:] == ['PRIVMSG #a :2']
+
+        self.clock.advance(1)
+        assert self.sent[3:] == ['PRIVMSG #a :3']
+
+    def test_targets_are_case_insensitive(self):
+        queue = self.make_queue(target_rate=1, target_burst=1)
+
+        queue.enqueue('PRIVMSG #Chan :1', '#Chan')
+        queue.enqueue('PRIVMSG #chan :2', '#chan')
+        assert self.sent == ['PRIVMSG #Chan :1']
+
+    def test_priority(self):
+        queue = self.make_queue(rate=1, burst=1)
+
+        queue.enqueue('PRIVMSG #a :first', '#a')
+        queue.enqueue('PRIVMSG #a :low', '#a', PRIORITY_LOW)
+        queue.enqueue('PRIVMSG #a :normal', '#a', PRIORITY_NORMAL)
+        queue.enqueue('PONG :server', priority=PRIORITY_HIGH)
+
+        self.clock.advance(1)
+        self.clock.advance(1)
+        self.clock.advance(1)
+        assert self.sent == ['PRIVMSG #a :first', 'PONG :server',
+                             'PRIVMSG #a :normal', 'PRIVMSG #a :low']
+
+    def test_high_priority_skips_target_pacing(self):
+        queue = self.make_queue(target_rate=1, target_burst=1)
+
+        queue.enqueue('PRIVMSG #a :1', '#a')
+        queue.enqueue('PRIVMSG #a :2', '#a')
+        queue.enqueue('PRIVMSG #a :admin', '#a', PRIORITY_HIGH)
+        assert self.sent == ['PRIVMSG #a :1', 'PRIVMSG #a :admin']
+
+    def test_merges_identical_lines(self):
+        queue = self.make_queue(rate=1, burst=1)
+
+        queue.enqueue('PRIVMSG #a :hi', '#a')
+        queue.enqueue('MODE #a +b *!*@spam')
+        queue.enqueue('MODE #a +b *!*@spam')
+        queue.enqueue('MODE #b +b *!*@spam')
+        assert queue.merged == 1
+        assert len(queue) == 2
+
+    def test_sends_identical_messages(self):
+        queue = self.make_queue(rate=1, burst=1)
+
+        queue.enqueue('PRIVMSG #a :hi', '#a')
+        queue.enqueue('PRIVMSG #a :+1', '#a')
+        queue.enqueue('PRIVMSG #a :+1', '#a')
+        assert queue.merged == 0
+
+        self.clock.pump([3] * 3)
+        assert self.sent == ['PRIVMSG #a :hi', 'PRIVMSG #a :+1',
+                             'PRIVMSG #a :+1']
+
+    def test_drops_stale_lines(self):
+        queue = self.make_queue(rate=1, burst=1, max_age=5)
+
+        queue.enqueue('PRIVMSG #a :1', '#a')
+        queue.enqueue('PRIVMSG #a :2', '#a')
+        queue.enqueue('PONG :server', priority=PRIORITY_HIGH)
+
+        # The PONG is sent first despite being queued longest, and by the time
+        # there's a token for the second message it has gone stale
+        self.clock.advance(10)
+        assert self.sent == ['PRIVMSG #a :1', 'PONG :server']
+
+        queue.enqueue('PRIVMSG #a :3', '#a')
+        self.clock.advance(1)
+        assert self.sent == ['PRIVMSG #a :1', 'PONG :server', 'PRIVMSG #a :3']
+        assert queue.dropped == 1
+
+    def test_sends_long_reply_in_full(self):
+        queue = self.make_queue()
+
+        lines = ['PRIVMSG #a :%d' % i for i in range(20)]
+        for index, line in enumerate(lines):
+            queue.enqueue(line, '#a', continuation=index > 0)
+
+        # Pacing to one target takes longer than max_age, but once the reply
+        # has begun none of it goes stale
+        self.clock.pump([1] * 60)
+        assert self.sent == lines
+        assert queue.dropped == 0
+        assert queue.last_lag > queue.max_age
+
+    def test_drops_stale_reply_with_its_continuations(self):
+        queue = self.make_queue(rate=1, burst=1, max_age=5)
+
+        queue.enqueue('JOIN #a')
+        queue.enqueue('PRIVMSG #a :1', '#a')
+        queue.enqueue('PRIVMSG #a :2', '#a', continuation=True)
+
+        self.clock.advance(10)
+        assert self.sent == ['JOIN #a']
+        assert queue.dropped == 2
+        assert len(queue) == 0
+
+        queue.enqueue('PRIVMSG #a :3', '#a')
+        assert self.sent == ['JOIN #a', 'PRIVMSG #a :3']
+
+    def test_stats(self):
+        queue = self.make_queue(rate=1, burst=1)
+
+        queue.enqueue('JOIN #a')
+        queue.enqueue('JOIN #b')
+
+        self.clock.advance(0.5)
+        stats = queue.stats()
+        assert stats['depth'] == 1
+        assert stats['lag'] == 0.5
+        assert stats['sent'] == 1
+
+        self.clock.advance(0.5)
+        stats = queue.stats()
+        assert stats['depth'] == 0
+        assert stats['lag'] == 0
+        assert stats['last_lag'] == 1
+        assert stats['sent'] == 2
+        assert stats['dropped'] == 0
+        assert stats['merged'] == 0
+
+    def test_clear(self):
+        queue = self.make_queue(rate=1, burst=1)
+
+        queue.enqueue('JOIN #a')
+        queue.enqueue('JOIN #b')
+        queue.clear()
+        assert len(queue) == 0
+        assert not self.clock.getDelayedCalls()
+
+        self.clock.advance(1)
+        assert self.sent == ['JOIN #a']
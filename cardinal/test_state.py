@@ -0,0 +1,198 @@
+from state import StateTracker, irc_lower
+
+
+def test_irc_lower():
+    assert irc_lower('Nick[a]\\~') == 'nick{a}|^'
+    assert irc_lower(u'#Chan[]') == u'#chan{}'
+
+
+class TestStateTracker(object):
+    def setup_method(self, method):
+        self.state = StateTracker('Cardinal')
+        self.state.joined('Cardinal', 'cardinal', 'bot.host', '#Chan')
+
+    def sync(self, *entries):
+        self.state.names('#chan', list(entries))
+        self.state.end_of_names('#chan')
+
+    def test_join(self):
+        channel = self.state.get_channel('#chan')
+        assert channel.name == '#Chan'
+        assert not channel.synced
+        assert self.state.is_on('cardinal', '#CHAN')
+
+        self.state.joined('Nick', 'ident', 'host', '#chan')
+        assert self.state.is_on('nick', '#chan')
+        user = self.state.get_user('NICK')
+        assert (user.nick, user.ident, user.host) == ('Nick', 'ident', 'host')
+
+    def test_join_unknown_channel(self):
+        self.state.joined('Nick', 'ident', 'host', '#other')
+        assert self.state.get_channel('#other') is None
+        assert self.state.get_user('nick') is None
+
+    def test_names(self):
+        self.sync(('Cardinal', set()), ('op', set(['o'])), ('voice', ['v']))
+
+        channel = self.state.get_channel('#chan')
+        assert channel.synced
+        assert set(channel.users) == set(['cardinal', 'op', 'voice'])
+        assert self.state.has_mode('OP', '#chan', 'o')
+        assert self.state.has_mode('voice', '#chan', 'v')
+        assert not self.state.has_mode('voice', '#chan', 'o')
+
+        # Our own host is known from our JOIN, but no one else's is yet
+        assert self.state.get_user('cardinal').host == 'bot.host'
+        assert not self.state.is_complete('#chan')
+
+    def test_names_with_hosts(self):
+        self.sync(('Cardinal', set(), None, None),
+                  ('op', set(['o', 'v']), 'ident', 'op.host'))
+
+        user = self.state.get_user('op')
+        assert (user.ident, user.host) == ('ident', 'op.host')
+        assert self.state.has_mode('op', '#chan', 'v')
+
+        # No WHO is needed when NAMES gives us everyone's host
+        assert self.state.is_complete('#chan')
+
+    def test_names_replaces_members(self):
+        self.state.joined('gone', 'gone', 'host', '#chan')
+        self.sync(('Cardinal', set()))
+
+        assert not self.state.is_on('gone', '#chan')
+        assert self.state.get_user('gone') is None
+
+    def test_who(self):
+        self.sync(('Cardinal', set()), ('nick', set()))
+        self.state.seen('nick', 'ident', 'host')
+
+        assert self.state.is_complete('#chan')
+        assert sorted(self.state.who('#chan')) == [
+            ('Cardinal', 'cardinal', 'bot.host'),
+            ('nick', 'ident', 'host'),
+        ]
+        assert self.state.who('#unknown') == []
+
+    def test_pending_hosts(self):
+        self.state.joined('Cardinal', 'cardinal', 'bot.host', '#other')
+        self.sync(('Cardinal', set()), ('a', set()), ('b', set()))
+        self.state.joined('a', 'a', None, '#other')
+        assert self.state.get_channel('#chan').pending == 2
+        assert self.state.get_channel('#other').pending == 1
+
+        # A host learned in one channel counts for every channel
+        self.state.seen('A', 'a', 'a.host')
+        assert self.state.get_channel('#other').pending == 0
+
+        self.state.nick_changed('b', 'c')
+        assert self.state.get_channel('#chan').pending == 1
+
+        self.state.quit('c')
+        assert self.state.get_channel('#chan').pending == 0
+        assert self.state.is_complete('#chan')
+
+    def test_rfc1459_casemapping(self):
+        self.state.joined('Nick[m]', 'ident', 'host', '#Chan')
+
+        assert self.state.is_on('nick{m}', '#chan')
+        self.state.parted('NICK{M}', '#chan')
+        assert self.state.get_user('nick[m]') is None
+
+    def test_seen_ignores_strangers(self):
+        self.state.seen('stranger', 'ident', 'host')
+        assert self.state.get_user('stranger') is None
+
+    def test_part(self):
+        self.state.joined('nick', 'ident', 'host', '#chan')
+        self.state.parted('NICK', '#chan')
+
+        assert not self.state.is_on('nick', '#chan')
+        assert self.state.get_user('nick') is None
+
+    def test_part_keeps_users_in_other_channels(self):
+        self.state.joined('Cardinal', 'cardinal', 'bot.host', '#other')
+        self.state.joined('nick', 'ident', 'host', '#chan')
+        self.state.joined('nick', 'ident', 'host', '#other')
+
+        self.state.parted('nick', '#chan')
+        assert self.state.get_user('nick').channels == set(['#other'])
+
+    def test_we_part(self):
+        self.state.joined('nick', 'ident', 'host', '#chan')
+        self.state.parted('Cardinal', '#chan')
+
+        assert self.state.get_channel('#chan') is None
+        assert self.state.users == {}
+
+    def test_quit(self):
+        self.state.joined('Cardinal', 'cardinal', 'bot.host', '#other')
+        self.state.joined('nick', 'ident', 'host', '#chan')
+        self.state.joined('nick', 'ident', 'host', '#other')
+
+        self.state.quit('nick')
+        assert self.state.get_user('nick') is None
+        assert not self.state.is_on('nick', '#chan')
+        assert not self.state.is_on('nick', '#other')
+
+    def test_nick_changed(self):
+        self.sync(('Cardinal', set()), ('nick', set(['o'])))
+        self.state.nick_changed('nick', 'Other')
+
+        assert self.state.get_user('nick') is None
+        assert self.state.get_user('other').nick == 'Other'
+        assert self.state.has_mode('other', '#chan', 'o')
+
+    def test_our_nick_changed(self):
+        self.state.nick_changed('Cardinal', 'Cardinal_')
+        assert self.state.is_me('cardinal_')
+
+        self.state.parted('Cardinal_', '#chan')
+        assert self.state.get_channel('#chan') is None
+
+    def test_topic(self):
+        self.state.topic_changed('#CHAN', 'A topic')
+        assert self.state.get_channel('#chan').topic == 'A topic'
+
+        self.state.topic_changed('#chan', '')
+        assert self.state.get_channel('#chan').topic is None
+
+    def test_modes(self):
+        self.sync(('Cardinal', set()), ('nick', set(['v'])))
+
+        self.state.mode_changed('#chan',
+                                [('o', 'nick'), ('k', 'key'), ('b', '*!*@*'),
+                                 ('n', None)],
+                                [('v', 'nick'), ('o', 'missing')],
+                                prefix_modes='ov', list_modes='b')
+
+        channel = self.state.get_channel('#chan')
+        assert channel.modes == {'k': 'key', 'n': None}
+        assert channel.users['nick'] == set(['o'])
+
+        self.state.mode_changed('#chan', [], [('k', None)],
+                                prefix_modes='ov', list_modes='b')
+        assert channel.modes == {'n': None}
+
+    def test_account(self):
+        self.state.joined('nick', 'ident', 'host', '#chan')
+        assert self.state.get_user('nick').account is None
+
+        self.state.account_changed('nick', 'acct')
+        assert self.state.get_user('nick').account == 'acct'
+
+        self.state.account_changed('NICK', None)
+        assert self.state.get_user('nick').account is None
+
+        self.state.account_changed('stranger', 'acct')
+        assert self.state.get_user('stranger') is None
+
+    def test_away(self):
+        self.state.joined('nick', 'ident', 'host', '#chan')
+        assert self.state.get_user('nick').away is None
+
+        self.state.away_changed('nick', 'Gone fishing')
+        assert self.state.get_user('nick').away == 'Gone fishing'
+
+        self.state.away_changed('nick', None)
+        assert self.state.get_user('nick').away is None
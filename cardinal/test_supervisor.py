@@ -0,0 +1,355 @@
+import json
+
+from mock import Mock, patch
+import pytest
+
+from twisted.internet import error, task
+from twisted.python.failure import Failure
+from twisted.test.proto_helpers import StringTransport
+
+import supervisor
+from supervisor import (
+    StatsProtocol,
+    StatsReporter,
+    StatsReportingProtocol,
+    Supervisor,
+    assign_networks,
+    merge_stats,
+    worker_logging_config,
+)
+
+
+def histogram(count, errors, total, p95, maximum):
+    return {
+        'count': count,
+        'errors': errors,
+        'total': total,
+        'mean': total / count,
+        'p95': p95,
+        'max': maximum,
+    }
+
+
+def crashed():
+    return Failure(error.ProcessTerminated(exitCode=1))
+
+
+def exited():
+    return Failure(error.ProcessDone(0))
+
+
+class TestAssignNetworks(object):
+    def test_deals_networks_out(self):
+        assert assign_networks(['a', 'b', 'c', 'd', 'e'], 2) == \
+            [['a', 'c', 'e'], ['b', 'd']]
+
+    def test_no_more_workers_than_networks(self):
+        assert assign_networks(['a', 'b'], 4) == [['a'], ['b']]
+
+    def test_no_workers(self):
+        with pytest.raises(ValueError):
+            assign_networks(['a'], 0)
+
+
+def test_worker_logging_config():
+    config = {
+        'version': 1,
+        'handlers': {
+            'console': {'class': 'logging.StreamHandler'},
+            'file': {
+                'class': 'cardinal.log.AsyncRotatingFileHandler',
+                'filename': 'storage/logs/cardinal.log',
+            },
+        },
+    }
+
+    worker_config = worker_logging_config(config, 2)
+
+    assert worker_config['handlers']['file']['filename'] == \
+        'storage/logs/cardinal-worker2.log'
+    assert 'filename' not in worker_config['handlers']['console']
+    assert config['handlers']['file']['filename'] == \
+        'storage/logs/cardinal.log'
+
+
+def test_merge_stats():
+    merged = merge_stats([
+        {'ping': {'ping': histogram(2, 0, 1.0, 0.6, 0.8)}},
+        {'ping': {'ping': histogram(2, 1, 3.0, 2.0, 2.5)},
+         'notes': {'note': histogram(1, 0, 0.5, 0.5, 0.5)}},
+    ])
+
+    assert merged['ping']['ping'] == histogram(4, 1, 4.0, 2.0, 2.5)
+    assert merged['notes']['note'] == histogram(1, 0, 0.5, 0.5, 0.5)
+
+
+class TestSupervisor(object):
+    def setup_method(self, method):
+        self.clock = task.Clock()
+        self.supervisor = Supervisor(['python', 'cardinal.py'],
+                                     [['a', 'c'], ['b']],
+                                     '/tmp/supervisor.sock',
+                                     {'EXTRA': 'yes'},
+                                     clock=self.clock)
+        self.supervisor.restart_jitter = 0
+
+        self.patcher = patch.object(Supervisor, '_spawn')
+        spawn = self.patcher.start()
+        spawn.side_effect = lambda worker: Mock(pid=1000 + worker.number)
+
+    def teardown_method(self, method):
+        self.patcher.stop()
+
+    def start_workers(self):
+        for worker in self.supervisor.workers:
+            self.supervisor._start_worker(worker)
+
+    def test_worker_args(self):
+        worker = self.supervisor.workers[0]
+
+        assert self.supervisor._worker_args(worker) == [
+            'python', 'cardinal.py',
+            '--worker', '0',
+            '--worker-networks', 'a,c',
+            '--stats-socket', '/tmp/supervisor.sock',
+        ]
+        assert self.supervisor.environment['EXTRA'] == 'yes'
+
+    def test_restarts_crashed_worker_with_backoff(self):
+        self.start_workers()
+        worker = self.supervisor.workers[0]
+
+        for wait in (1, 2, 4, 8):
+            self.supervisor.worker_ended(worker, crashed())
+            assert worker.process is None
+
+            self.clock.advance(wait - 0.1)
+            assert worker.process is None
+            self.clock.advance(0.1)
+            assert worker.process is not None
+
+        assert worker.restarts == 4
+
+        # A worker which ran for a while starts backing off from the minimum
+        self.clock.advance(self.supervisor.stable_run_time)
+        self.supervisor.worker_ended(worker, crashed())
+        self.clock.advance(1)
+        assert worker.process is not None
+
+    def test_backoff_is_capped(self):
+        self.start_workers()
+        worker = self.supervisor.workers[0]
+        worker.last_restart_wait = self.supervisor.maximum_restart_wait
+
+        self.supervisor.worker_ended(worker, crashed())
+        assert worker.last_restart_wait == \
+            self.supervisor.maximum_restart_wait
+
+    @patch.object(supervisor, 'reactor')
+    def test_clean_exit_not_restarted(self, reactor):
+        self.start_workers()
+        first, second = self.supervisor.workers
+
+        self.supervisor.worker_ended(first, exited())
+        self.clock.advance(100)
+        assert first.process is None
+        assert not reactor.stop.called
+
+        self.supervisor.worker_ended(second, exited())
+        assert reactor.stop.called
+
+    @patch.object(supervisor, 'reactor')
+    def test_stop(self, reactor):
+        self.start_workers()
+        first, second = self.supervisor.workers
+        process = second.process
+
+        self.supervisor.worker_ended(first, crashed())
+        self.supervisor.stop()
+
+        # The pending restart is cancelled, and running workers are told to
+        # disconnect
+        assert first.restart_call is None
+        assert self.clock.getDelayedCalls() == []
+        process.signalProcess.assert_called_once_with('INT')
+        assert not reactor.stop.called
+
+        self.supervisor.worker_ended(second, crashed())
+        assert second.restart_call is None
+        assert reactor.stop.called
+
+    def test_stats(self):
+        self.start_workers()
+        self.clock.advance(30)
+
+        self.supervisor.report(0, {
+            'a': {'connected': True,
+                  'metrics': {'ping': {'ping': histogram(1, 0, 1.0, 1, 1)}}},
+            'c': {'connected': False, 'metrics': {}},
+        })
+        self.supervisor.report(1, {
+            'b': {'connected': True,
+                  'metrics': {'ping': {'ping': histogram(1, 0, 3.0, 3, 3)}}},
+        })
+        self.clock.advance(5)
+
+        stats = self.supervisor.stats()
+
+        assert stats['workers'][0] == {
+            'worker': 0,
+            'pid': 1000,
+            'networks': ['a', 'c'],
+            'restarts': 0,
+            'uptime': 35,
+            'reported': 5,
+        }
+        assert sorted(stats['networks']) == ['a', 'b', 'c']
+        assert stats['plugins']['ping']['ping']['count'] == 2
+        assert stats['plugins']['ping']['ping']['mean'] == 2.0
+
+        with pytest.raises(KeyError):
+            self.supervisor.report(2, {})
+
+
+class TestStatsProtocol(object):
+    def make_protocol(self):
+        factory = Mock()
+        factory.supervisor = Mock()
+        factory.supervisor.stats.return_value = {'workers': []}
+
+        protocol = StatsProtocol()
+        protocol.factory = factory
+        protocol.makeConnection(StringTransport())
+
+        return protocol
+
+    def test_report(self):
+        protocol = self.make_protocol()
+        protocol.dataReceived(json.dumps({'worker': 1, 'stats': {}}) + '\n')
+
+        protocol.factory.supervisor.report.assert_called_once_with(1, {})
+
+    def test_invalid_report(self):
+        protocol = self.make_protocol()
+        protocol.dataReceived('not json\n{"stats": {}}\n')
+
+        assert not protocol.factory.supervisor.report.called
+
+    def test_oversized_report_skipped(self):
+        protocol = self.make_protocol()
+        protocol.MAX_LENGTH = 100
+
+        valid = json.dumps({'worker': 1, 'stats': {}}) + '\n'
+        oversized = json.dumps({'worker': 0, 'stats': {'a': 'x' * 200}})
+
+        # Whether the oversized report arrives whole or in pieces, the
+        # connection stays up and the next report is received
+        protocol.dataReceived(oversized + '\n' + valid)
+        protocol.dataReceived(oversized[:150])
+        protocol.dataReceived(oversized[150:] + '\n')
+        protocol.dataReceived(valid)
+
+        assert not protocol.transport.disconnecting
+        assert protocol.factory.supervisor.report.call_args_list == \
+            [((1, {}),), ((1, {}),)]
+
+    def test_query(self):
+        protocol = self.make_protocol()
+        protocol.dataReceived('STATS\n')
+
+        assert json.loads(protocol.transport.value()) == {'workers': []}
+        assert protocol.transport.disconnecting
+
+
+class TestStatsReporter(object):
+    def make_networks(self):
+        connected = Mock()
+        connected.name = 'a'
+        connected.signed_on = 10
+        connected.metrics.stats.return_value = {}
+        connected.thread_pools.stats.return_value = {
+            'urls': {'threads': 2, 'busy': 1, 'queued': 3}}
+        connected.cardinal.send_queue.stats.return_value = {'depth': 0}
+
+        disconnected = Mock()
+        disconnected.name = 'b'
+        disconnected.signed_on = None
+        disconnected.metrics.stats.return_value = {}
+        disconnected.thread_pools.stats.return_value = {}
+
+        return Mock(factories=[connected, disconnected])
+
+    def test_collect(self):
+        reporter = StatsReporter('/tmp/supervisor.sock', 1,
+                                 self.make_networks())
+
+        assert reporter.collect() == {
+            'a': {'connected': True, 'metrics': {},
+                  'thread_pools': {
+                      'urls': {'threads': 2, 'busy': 1, 'queued': 3}},
+                  'send_queue': {'depth': 0}},
+            'b': {'connected': False, 'metrics': {}, 'thread_pools': {},
+                  'send_queue': None},
+        }
+
+    def test_report(self):
+        reporter = StatsReporter('/tmp/supervisor.sock', 1,
+                                 self.make_networks())
+
+        # Nothing is sent until connected to the supervisor
+        reporter.report()
+
+        reporter.protocol = Mock()
+        reporter.report()
+
+        line = reporter.protocol.sendLine.call_args[0][0]
+        assert json.loads(line)['worker'] == 1
+        assert sorted(json.loads(line)['stats']) == ['a', 'b']
+
+
+def test_large_report_reaches_supervisor():
+    # Twelve plugins with six handlers each, on two networks
+    metrics = dict(
+        ('plugin%d' % plugin, dict(
+            ('plugin%d.command_with_a_long_name%d' % (plugin, handler),
+             histogram(2, 0, 1.0, 0.6, 0.8))
+            for handler in range(6)))
+        for plugin in range(12))
+
+    factories = []
+    for name in ('a', 'b'):
+        factory = Mock()
+        factory.name = name
+        factory.signed_on = 10
+        factory.metrics.stats.return_value = metrics
+        factory.thread_pools.stats.return_value = {}
+        factory.cardinal.send_queue.stats.return_value = {'depth': 0}
+        factories.append(factory)
+
+    reporter = StatsReporter('/tmp/supervisor.sock', 0,
+                             Mock(factories=factories))
+    sender = StatsReportingProtocol()
+    sender.factory = Mock(reporter=reporter)
+    sender.makeConnection(StringTransport())
+    reporter.report()
+
+    data = sender.transport.value()
+    assert len(data) > 16384
+
+    supervisor = Supervisor(['python', 'cardinal.py'], [['a', 'b']],
+                            '/tmp/supervisor.sock', clock=task.Clock())
+    receiver = StatsProtocol()
+    receiver.factory = Mock(supervisor=supervisor)
+    receiver.makeConnection(StringTransport())
+
+    # Delivered in pieces, as a socket would
+    for i in range(0, len(data), 4096):
+        receiver.dataReceived(data[i:i + 4096])
+
+    assert not receiver.transport.disconnecting
+
+    stats = supervisor.stats()
+    assert sorted(stats['networks']) == ['a', 'b']
+    assert len(stats['plugins']) == 12
+    assert stats['plugins']['plugin0'][
+        'plugin0.command_with_a_long_name0']['count'] == 4
@@ -0,0 +1,97 @@
+from mock import Mock, patch
+
+from exceptions import ThreadPoolFullError
+import threadpools
+from threadpools import ThreadPoolManager, plugin_name
+
+
+def test_plugin_name():
+    def foo():
+        pass
+
+    foo.__module__ = 'plugins.urls.plugin'
+    assert plugin_name(foo) == 'urls'
+
+    foo.__module__ = 'cardinal.bot'
+    assert plugin_name(foo) == 'cardinal.bot'
+
+
+class TestThreadPoolManager(object):
+    def setup_method(self, method):
+        self.manager = ThreadPoolManager({
+            'size': 3,
+            'queue_size': 1,
+            'plugins': {
+                'urls': {'size': 5, 'queue_size': 0},
+            },
+        })
+
+    def teardown_method(self, method):
+        self.manager.stop()
+
+    def test_config(self):
+        assert self.manager._get_pool('foo').max == 3
+        assert self.manager._get_pool('urls').max == 5
+
+    def test_defaults(self):
+        manager = ThreadPoolManager()
+        assert manager.size == ThreadPoolManager.size
+        assert manager.queue_size == ThreadPoolManager.queue_size
+
+    def test_pool_per_plugin(self):
+        pool = self.manager._get_pool('foo')
+        assert self.manager._get_pool('foo') is pool
+        assert self.manager._get_pool('bar') is not pool
+
+    def test_queue_depth_unknown_plugin(self):
+        assert self.manager.queue_depth('foo') == 0
+
+    def test_run_queue_full(self):
+        failures = []
+
+        d = self.manager.run('urls', Mock())
+        d.addErrback(failures.append)
+
+        assert len(failures) == 1
+        assert failures[0].check(ThreadPoolFullError)
+
+    def test_stats(self):
+        self.manager._get_pool('foo')
+        assert self.manager.stats() == {
+            'foo': {'threads': 3, 'busy': 0, 'queued': 0},
+        }
+
+    def test_stop(self):
+        pool = self.manager._get_pool('foo')
+        self.manager.stop()
+
+        assert pool.joined
+        assert self.manager.pools == {}
+
+    @patch.object(threadpools, 'reactor')
+    def test_shutdown_trigger(self, reactor):
+        manager = ThreadPoolManager()
+        assert not reactor.addSystemEventTrigger.called
+
+        manager._get_pool('foo')
+        manager._get_pool('bar')
+        reactor.addSystemEventTrigger.assert_called_once_with(
+            'during', 'shutdown', manager._shutdown)
+
+        # Stopping removes the trigger, so stopped managers aren't kept alive
+        manager.stop()
+        reactor.removeSystemEventTrigger.assert_called_once_with(
+            reactor.addSystemEventTrigger.return_value)
+
+        manager.stop()
+        assert reactor.removeSystemEventTrigger.call_count == 1
+
+    @patch.object(threadpools, 'reactor')
+    def test_shutdown(self, reactor):
+        manager = ThreadPoolManager()
+        pool = manager._get_pool('foo')
+
+        manager._shutdown()
+
+        assert pool.joined
+        assert not reactor.removeSystemEventTrigger.called
@@ -0,0 +1,91 @@
+import pytest
+
+from users import USER_REGEX, User, UserCache, parse_user
+
+
+class TestUser(object):
+    def test_attributes(self):
+        user = User('nick', 'ident', 'host')
+
+        assert user.nick == 'nick'
+        assert user.ident == 'ident'
+        assert user.host == 'host'
+        assert user.hostmask == 'nick!ident@host'
+
+    def test_compatible_with_regex_match(self):
+        prefix = 'nick!~ident@host.example.com'
+        user = UserCache._parse(prefix)
+        match = USER_REGEX.match(prefix)
+
+        for index in range(4):
+            assert user.group(index) == match.group(index)
+        assert user.group() == match.group()
+        assert user.groups() == match.groups()
+
+        with pytest.raises(IndexError):
+            user.group(4)
+
+    def test_immutable(self):
+        user = User('nick', 'ident', 'host')
+
+        with pytest.raises(AttributeError):
+            user.nick = 'other'
+
+        with pytest.raises(AttributeError):
+            user.foo = 'bar'
+
+    def test_equality(self):
+        assert User('nick', 'ident', 'host') == User('nick', 'ident', 'host')
+        assert User('nick', 'ident', 'host') != User('nick', 'ident', 'other')
+
+
+class TestUserCache(object):
+    @pytest.mark.parametrize("prefix", [
+        'irc.example.org',
+        'nick!ident',
+        'nick@host',
+        '',
+    ])
+    def test_not_a_user(self, prefix):
+        assert UserCache().get(prefix) is None
+        assert USER_REGEX.match(prefix) is None
+
+    def test_interned(self):
+        cache = UserCache()
+
+        user = cache.get('nick!ident@host')
+        assert user == ('nick', 'ident', 'host')
+        assert cache.get('nick!ident@host') is user
+        assert cache.hits == 1
+        assert cache.misses == 1
+
+    def test_bounded(self):
+        cache = UserCache(max_size=4)
+
+        first = cache.get('a!a@a')
+        cache.get('b!b@b')
+
+        # Filling the current generation moves it to the previous one, where
+        # entries are still found and promoted
+        cache.get('c!c@c')
+        assert cache.get('a!a@a') is first
+        assert cache.hits == 1
+
+        for prefix in ('d!d@d', 'e!e@e', 'f!f@f', 'g!g@g'):
+            cache.get(prefix)
+        assert len(cache) <= 4
+
+        # Least recently used entries have been discarded
+        assert cache.get('b!b@b') is not None
+        assert cache.hits == 1
+
+    def test_clear(self):
+        cache = UserCache()
+        cache.get('nick!ident@host')
+        cache.clear()
+        assert len(cache) == 0
+
+
+def test_parse_user():
+    assert parse_user('nick!ident@host') is parse_user('nick!ident@host')
+    assert parse_user('irc.example.org') is None
@@ -0,0 +1,178 @@
+import logging
+
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+from cardinal.exceptions import ThreadPoolFullError
+
+
+def plugin_name(f):
+    """Returns the name of the plugin a callable was defined in.
+
+    Plugins live in modules named `plugins.<name>.plugin`, so the name is the
+    second to last component of the module path. Callables defined elsewhere
+    are attributed to their full module name.
+
+    Keyword arguments:
+      f -- A function or method.
+
+    Returns:
+      string -- Name of the plugin.
+    """
+    module = getattr(f, '__module__', None) or 'unknown'
+    parts = module.split('.')
+    if len(parts) >= 2 and parts[-1] == 'plugin':
+        return parts[-2]
+
+    return module
+
+
+class ThreadPoolManager(object):
+    """Runs blocking plugin code outside of the reactor thread.
+
+    Each plugin gets its own bounded thread pool, so a plugin whose upstream
+    API hangs can only tie up its own threads. Work submitted to a pool whose
+    queue is full is rejected rather than allowed to pile up.
+    """
+
+    logger = None
+    """Logging object for ThreadPoolManager"""
+
+    size = 2
+    """Default number of threads in each plugin's pool"""
+
+    queue_size = 25
+    """Default number of calls allowed to wait for a thread in each pool"""
+
+    pools = None
+    """Maps plugin names to their ThreadPool"""
+
+    def __init__(self, config=None):
+        """Initializes the manager.
+
+        Keyword arguments:
+          config -- A dictionary which may contain `size` and `queue_size`
+            defaults, and a `plugins` dictionary mapping plugin names to
+            dictionaries overriding those defaults.
+        """
+        self.logger = logging.getLogger(__name__)
+
+        if config is None:
+            config = {}
+
+        self.size = config.get('size', self.size)
+        self.queue_size = config.get('queue_size', self.queue_size)
+        self.plugin_config = config.get('plugins', {})
+
+        self.pools = {}
+
+        # Pools are stopped when the reactor shuts down, but the trigger is
+        # only added once a pool exists, so managers which never run anything
+        # don't leave one behind
+        self._shutdown_trigger = None
+
+    def _get_pool(self, plugin):
+        """Returns the thread pool for a plugin, creating it if necessary.
+
+        Keyword arguments:
+          plugin -- Name of the plugin.
+
+        Returns:
+          ThreadPool -- The plugin's started thread pool.
+        """
+        try:
+            return self.pools[plugin]
+        except KeyError:
+            pass
+
+        size = self.plugin_config.get(plugin, {}).get('size', self.size)
+
+        self.logger.info(
+            "Creating thread pool for plugin %s (%d threads)", plugin, size)
+        pool = ThreadPool(0, size, name='cardinal-%s' % plugin)
+        pool.start()
+
+        self.pools[plugin] = pool
+
+        if self._shutdown_trigger is None:
+            self._shutdown_trigger = reactor.addSystemEventTrigger(
+                'during', 'shutdown', self._shutdown)
+
+        return pool
+
+    def _get_queue_size(self, plugin):
+        return self.plugin_config.get(plugin, {}).get('queue_size',
+                                                      self.queue_size)
+
+    def queue_depth(self, plugin):
+        """Returns the number of calls waiting for a thread in a plugin's pool.
+
+        Keyword arguments:
+          plugin -- Name of the plugin.
+
+        Returns:
+          int -- Number of queued calls.
+        """
+        if plugin not in self.pools:
+            return 0
+
+        return self.pools[plugin].q.qsize()
+
+    def stats(self):
+        """Returns the state of every plugin's thread pool.
+
+        Returns:
+          dict -- Maps plugin names to dictionaries containing the maximum
+            number of `threads`, the number of `busy` threads, and the number
+            of `queued` calls.
+        """
+        return dict(
+            (plugin, {
+                'threads': pool.max,
+                'busy': len(pool.working),
+                'queued': pool.q.qsize(),
+            })
+            for plugin, pool in self.pools.iteritems()
+        )
+
+    def run(self, plugin, f, *args, **kwargs):
+        """Calls a function in a plugin's thread pool.
+
+        Keyword arguments:
+          plugin -- Name of the plugin the function belongs to.
+          f -- The function to call.
+          args -- Positional arguments to pass to the function.
+          kwargs -- Keyword arguments to pass to the function.
+
+        Returns:
+          Deferred -- Fires in the reactor thread with the function's result,
+            or fails with ThreadPoolFullError if the plugin's queue is full.
+        """
+        pool = self._get_pool(plugin)
+
+        queue_size = self._get_queue_size(plugin)
+        if pool.q.qsize() >= queue_size:
+            self.logger.warning(
+                "Thread pool queue for plugin %s is full (%d), dropping call",
+                plugin, queue_size)
+            return defer.fail(ThreadPoolFullError(
+                "Thread pool queue for plugin %s is full" % plugin))
+
+        return threads.deferToThreadPool(reactor, pool, f, *args, **kwargs)
+
+    def _shutdown(self):
+        # The trigger has fired, so there's nothing to remove
+        self._shutdown_trigger = None
+        self.stop()
+
+    def stop(self):
+        """Stops every thread pool, waiting for running calls to finish."""
+        if self._shutdown_trigger is not None:
+            reactor.removeSystemEventTrigger(self._shutdown_trigger)
+            self._shutdown_trigger = None
+
+        for plugin, pool in self.pools.items():
+            self.logger.info("Stopping thread pool for plugin %s", plugin)
+            pool.stop()
+
+        self.pools = {}
@@ -0,0 +1,153 @@
+import re
+import threading
+
+USER_REGEX = re.compile(r'^(.*?)!(.*?)@(.*?)$')
+"""Regex for identifying a user's nick, ident, and vhost"""
+
+
+class User(tuple):
+    """A user's nick, ident and host.
+
+    Users are immutable, and compatible with the match objects of USER_REGEX
+    plugins were previously given, so `user.group(1)` is still the nick,
+    `user.group(2)` the ident, and `user.group(3)` the host.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, nick, ident, host):
+        return tuple.__new__(cls, (nick, ident, host))
+
+    @property
+    def nick(self):
+        return self[0]
+
+    @property
+    def ident(self):
+        return self[1]
+
+    @property
+    def host(self):
+        return self[2]
+
+    @property
+    def hostmask(self):
+        return '%s!%s@%s' % self
+
+    def group(self, index=0):
+        """Returns the whole hostmask for 0, or the nick, ident or host for
+        1, 2 or 3, like a match object would."""
+        if index == 0:
+            return self.hostmask
+        if 1 <= index <= 3:
+            return self[index - 1]
+
+        raise IndexError("no such group")
+
+    def groups(self):
+        return tuple(self)
+
+    def __repr__(self):
+        return "<User %s>" % self.hostmask
+
+
+class UserCache(object):
+    """Parses prefixes into interned User objects, remembering recent ones.
+
+    The same prefixes repeat constantly, so each is only parsed once while
+    it's in use. This approximates an LRU cache with two generations of
+    entries: lookups hit the current generation, or promote an entry from
+    the previous one. Once the current generation is full it becomes the
+    previous one, and whatever was left in the previous one is discarded.
+    Unlike LRUCache this needs no lock or reordering on a hit, which would
+    cost more than parsing the prefix.
+    """
+
+    max_size = 4096
+    """Approximate maximum number of prefixes to remember"""
+
+    hits = 0
+    """Number of lookups that found a parsed prefix"""
+
+    misses = 0
+    """Number of lookups that had to parse the prefix"""
+
+    def __init__(self, max_size=None):
+        """Initializes an empty cache.
+
+        Keyword arguments:
+          max_size -- Approximate maximum number of prefixes to remember.
+        """
+        if max_size is not None:
+            self.max_size = max_size
+
+        self._current = {}
+        self._previous = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._current) + len(self._previous)
+
+    def get(self, prefix):
+        """Returns the User for a prefix.
+
+        Keyword arguments:
+          prefix -- A prefix such as `nick!ident@host`.
+
+        Returns:
+          User -- The user, or None if the prefix isn't a user's (e.g. a
+            server name).
+        """
+        try:
+            user = self._current[prefix]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            return user
+
+        user = self._previous.get(prefix, False)
+        if user is not False:
+            self.hits += 1
+        else:
+            self.misses += 1
+            user = self._parse(prefix)
+
+        # Only the generation swap needs to be protected from other threads
+        with self._lock:
+            if len(self._current) >= self.max_size // 2:
+                self._previous = self._current
+                self._current = {}
+            self._current[prefix] = user
+
+        return user
+
+    def clear(self):
+        with self._lock:
+            self._current = {}
+            self._previous = {}
+
+    @staticmethod
+    def _parse(prefix):
+        # Equivalent to USER_REGEX, without the regex
+        nick, sep, rest = prefix.partition('!')
+        if not sep:
+            return None
+
+        ident, sep, host = rest.partition('@')
+        if not sep:
+            return None
+
+        return User(nick, ident, host)
+
+
+_cache = UserCache()
+
+
+def parse_user(prefix):
+    """Returns the interned User for a prefix, or None if it isn't a user's.
+
+    Keyword arguments:
+      prefix -- A prefix such as `nick!ident@host`.
+    """
+    return _cache.get(prefix)
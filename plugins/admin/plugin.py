@@ -1,3 +1,24 @@
+import cProfile
+import logging
+import os
+import pstats
+import time
+
+from twisted.internet import reactor
+
+from cardinal import cache as cardinal_cache
+from cardinal.sendqueue import PRIORITY_HIGH
+
+# Longest a profile may run for, in seconds
+MAX_PROFILE_DURATION = 300
+
+# Number of functions to include in a profile summary
+PROFILE_SUMMARY_SIZE = 5
+
+# Number of keys to list for each cached function
+CACHE_KEYS_SHOWN = 10
+
+
 class AdminPlugin(object):
     # A dictionary which will contain the owner nicks and vhosts
     owners = None
@@ -5,7 +26,14 @@ class AdminPlugin(object):
     # A list of trusted vhosts
     trusted_vhosts = None
 
+    # The running profiler and the delayed call which will stop it, if any
+    profiler = None
+    profile_call = None
+
     def __init__(self, cardinal, config):
+        # Initialize logger
+        self.logger = logging.getLogger(__name__)
+
         self.owners = {}
         self.trusted_vhosts = []
 
@@ -28,16 +56,21 @@ class AdminPlugin(object):
 
         return False
 
+    # Admin replies are sent ahead of queued messages, so the owner can still
+    # get a response while the bot is busy
+    def reply(self, cardinal, channel, message):
+        cardinal.sendMsg(channel, message, priority=PRIORITY_HIGH)
+
     def eval(self, cardinal, user, channel, msg):
         if self.is_owner(user):
             command = ' '.join(msg.split()[1:])
             if len(command) > 0:
                 try:
                     output = str(eval(command))
-                    cardinal.sendMsg(channel, output)
+                    self.reply(cardinal, channel, output)
                 except Exception, e:
-                    cardinal.sendMsg(channel, 'Exception %s: %s' %
-                                              (e.__class__, e))
+                    self.reply(cardinal, channel, 'Exception %s: %s' %
+                                                  (e.__class__, e))
                     raise
 
     eval.commands = ['eval']
@@ -52,10 +85,10 @@ class AdminPlugin(object):
             if len(command) > 0:
                 try:
                     exec(command)
-                    cardinal.sendMsg(channel, "Ran exec() on input.")
+                    self.reply(cardinal, channel, "Ran exec() on input.")
                 except Exception, e:
-                    cardinal.sendMsg(channel, 'Exception %s: %s' %
-                                              (e.__class__, e))
+                    self.reply(cardinal, channel, 'Exception %s: %s' %
+                                                  (e.__class__, e))
                     raise
 
     execute.commands = ['exec']
@@ -66,7 +99,8 @@ class AdminPlugin(object):
 
     def load_plugins(self, cardinal, user, channel, msg):
         if self.is_owner(user):
-            cardinal.sendMsg(channel, "%s: Loading plugins..." % user.group(1))
+            self.reply(cardinal, channel,
+                       "%s: Loading plugins..." % user.group(1))
 
             plugins = msg.split()
             plugins.pop(0)
@@ -83,12 +117,13 @@ class AdminPlugin(object):
             ]
 
             if len(successful) > 0:
-                cardinal.sendMsg(channel, "Plugins loaded succesfully: %s." %
-                                          ', '.join(sorted(successful)))
+                self.reply(cardinal, channel,
+                           "Plugins loaded succesfully: %s." %
+                           ', '.join(sorted(successful)))
 
             if len(failed) > 0:
-                cardinal.sendMsg(channel, "Plugins failed to load: %s." %
-                                          ', '.join(sorted(failed)))
+                self.reply(cardinal, channel, "Plugins failed to load: %s." %
+                                              ', '.join(sorted(failed)))
 
     load_plugins.commands = ['load', 'reload']
     load_plugins.help = ["If no plugins are given after the command, reload " +
@@ -105,10 +140,11 @@ class AdminPlugin(object):
             plugins.pop(0)
 
             if len(plugins) == 0:
-                cardinal.sendMsg(channel, "%s: No plugins to unload." % nick)
+                self.reply(cardinal, channel,
+                           "%s: No plugins to unload." % nick)
                 return
 
-            cardinal.sendMsg(channel, "%s: Unloading plugins..." % nick)
+            self.reply(cardinal, channel, "%s: Unloading plugins..." % nick)
 
             # Returns a list of plugins that weren't loaded to begin with
             unknown = cardinal.plugin_manager.unload(plugins)
@@ -117,12 +153,13 @@ class AdminPlugin(object):
             ]
 
             if len(successful) > 0:
-                cardinal.sendMsg(channel, "Plugins unloaded succesfully: %s." %
-                                          ', '.join(sorted(successful)))
+                self.reply(cardinal, channel,
+                           "Plugins unloaded succesfully: %s." %
+                           ', '.join(sorted(successful)))
 
             if len(unknown) > 0:
-                cardinal.sendMsg(channel, "Unknown plugins: %s." %
-                                          ', '.join(sorted(unknown)))
+                self.reply(cardinal, channel, "Unknown plugins: %s." %
+                                              ', '.join(sorted(unknown)))
 
     unload_plugins.commands = ['unload']
     unload_plugins.help = ["Unload selected plugins. (admin only)",
@@ -136,22 +173,23 @@ class AdminPlugin(object):
         channels.pop(0)
 
         if len(channels) < 2:
-            cardinal.sendMsg(channel,
-                             "Syntax: .disable <plugin> <channel [channel ...]>")
+            self.reply(cardinal, channel,
+                       "Syntax: .disable <plugin> <channel [channel ...]>")
             return
 
-        cardinal.sendMsg(channel, "%s: Disabling plugins..." % user.group(1))
+        self.reply(cardinal, channel,
+                   "%s: Disabling plugins..." % user.group(1))
 
         # First argument is plugin
         plugin = channels.pop(0)
 
         blacklisted = cardinal.plugin_manager.blacklist(plugin, channels)
         if not blacklisted:
-            cardinal.sendMsg(channel, "Plugin %s does not exist" % plugin)
+            self.reply(cardinal, channel, "Plugin %s does not exist" % plugin)
             return
 
-        cardinal.sendMsg(channel, "Added to blacklist: %s." %
-                                  ', '.join(sorted(channels)))
+        self.reply(cardinal, channel, "Added to blacklist: %s." %
+                                      ', '.join(sorted(channels)))
 
     disable_plugins.commands = ['disable']
     disable_plugins.help = ["Disable plugins in a channel. (admin only)",
@@ -165,35 +203,264 @@ class AdminPlugin(object):
         channels.pop(0)
 
         if len(channels) < 2:
-            cardinal.sendMsg(channel,
-                             "Syntax: .enable <plugin> <channel [channel ...]>")
+            self.reply(cardinal, channel,
+                       "Syntax: .enable <plugin> <channel [channel ...]>")
             return
 
-        cardinal.sendMsg(channel, "%s: Enabling plugins..." % user.group(1))
+        self.reply(cardinal, channel,
+                   "%s: Enabling plugins..." % user.group(1))
 
         # First argument is plugin
         plugin = channels.pop(0)
 
         not_blacklisted = cardinal.plugin_manager.unblacklist(plugin, channels)
         if not_blacklisted is False:
-            cardinal.sendMsg("Plugin %s does not exist" % plugin)
+            self.reply(cardinal, channel, "Plugin %s does not exist" % plugin)
+            return
 
         successful = [
             channel for channel in channels if channel not in not_blacklisted
         ]
 
         if len(successful) > 0:
-            cardinal.sendMsg(channel, "Removed from blacklist: %s." %
-                                      ', '.join(sorted(successful)))
+            self.reply(cardinal, channel, "Removed from blacklist: %s." %
+                                          ', '.join(sorted(successful)))
 
         if len(not_blacklisted) > 0:
-            cardinal.sendMsg(channel, "Wasn't in blacklist: %s." %
-                                      ', '.join(sorted(not_blacklisted)))
+            self.reply(cardinal, channel, "Wasn't in blacklist: %s." %
+                                          ', '.join(sorted(not_blacklisted)))
 
     enable_plugins.commands = ['enable']
     enable_plugins.help = ["Enable plugins in a channel. (admin only)",
                            "Syntax: .enable <plugin> <channel [channel ...]>"]
 
+    def cache(self, cardinal, user, channel, msg):
+        if not self.is_owner(user):
+            return
+
+        args = msg.split()
+        args.pop(0)
+
+        if len(args) > 0 and args[0] == 'flush':
+            plugin = args[1] if len(args) > 1 else None
+            flushed = cardinal_cache.flush(plugin)
+            self.reply(cardinal, channel,
+                       "Flushed %d cached entries." % flushed)
+            return
+
+        if len(args) > 0 and args[0] == 'keys':
+            if len(args) < 2:
+                self.reply(cardinal, channel, "Syntax: .cache keys <plugin>")
+                return
+
+            keys = cardinal_cache.get_keys(args[1])
+            if not keys:
+                self.reply(cardinal, channel, "No caches found.")
+                return
+
+            for name in sorted(keys):
+                # Most recently used first
+                recent = [repr(key) for key in
+                          reversed(keys[name][-CACHE_KEYS_SHOWN:])]
+                self.reply(cardinal, channel, "%s: %d keys%s%s" %
+                                              (name, len(keys[name]),
+                                               ': ' if recent else '',
+                                               ', '.join(recent)))
+            return
+
+        plugin = args[0] if len(args) > 0 else None
+        stats = cardinal_cache.get_stats(plugin)
+        if not stats:
+            self.reply(cardinal, channel, "No caches found.")
+            return
+
+        for name in sorted(stats):
+            self.reply(cardinal, channel,
+                       "%s: %d entries, %d hits, %d misses" %
+                       (name,
+                        stats[name]['entries'],
+                        stats[name]['hits'],
+                        stats[name]['misses']))
+
+    cache.commands = ['cache']
+    cache.help = ["Shows plugin response cache statistics, lists the keys " +
+                  "cached by a plugin, or flushes the caches. (admin only)",
+
+                  "Syntax: .cache [flush] [plugin] | .cache keys <plugin>"]
+
+    def stats(self, cardinal, user, channel, msg):
+        if not self.is_owner(user):
+            return
+
+        args = msg.split()
+        plugin = args[1] if len(args) > 1 else None
+
+        if plugin is None and cardinal.send_queue is not None:
+            queue = cardinal.send_queue.stats()
+            self.reply(cardinal, channel,
+                       "Send queue: %d queued, lag %.0fms, last lag %.0fms, "
+                       "%d sent, %d dropped, %d merged" %
+                       (queue['depth'], queue['lag'] * 1000,
+                        queue['last_lag'] * 1000, queue['sent'],
+                        queue['dropped'], queue['merged']))
+
+        pools = cardinal.plugin_manager.thread_pools.stats()
+        for name in sorted(pools):
+            if plugin is not None and name != plugin:
+                continue
+
+            self.reply(cardinal, channel,
+                       "Thread pool %s: %d/%d busy, %d queued" %
+                       (name, pools[name]['busy'], pools[name]['threads'],
+                        pools[name]['queued']))
+
+        stats = cardinal.plugin_manager.metrics.stats(plugin)
+        if not stats:
+            self.reply(cardinal, channel, "No stats recorded.")
+            return
+
+        if plugin is None:
+            # Summarize each plugin, most time consumed first
+            totals = []
+            for name, handlers in stats.items():
+                total = sum(h['total'] for h in handlers.values())
+                count = sum(h['count'] for h in handlers.values())
+                errors = sum(h['errors'] for h in handlers.values())
+                slowest = max(h['max'] for h in handlers.values())
+                totals.append((total, name, count, errors, slowest))
+
+            for total, name, count, errors, slowest in sorted(totals,
+                                                              reverse=True):
+                self.reply(cardinal, channel, "%s: %d calls, %d errors, "
+                                              "total %.0fms, max %.0fms" %
+                                              (name, count, errors,
+                                               total * 1000, slowest * 1000))
+            return
+
+        # Commands are keyed plugin.command and callbacks event:callback_id
+        handlers = stats[plugin]
+        for name in sorted(handlers, key=lambda h: -handlers[h]['total']):
+            h = handlers[name]
+            self.reply(cardinal, channel, "%s: %d calls, %d errors, "
+                                          "total %.0fms, mean %.0fms, "
+                                          "p95 %.0fms, max %.0fms" %
+                                          (name, h['count'], h['errors'],
+                                           h['total'] * 1000, h['mean'] * 1000,
+                                           h['p95'] * 1000, h['max'] * 1000))
+
+    stats.commands = ['stats']
+    stats.help = ["Shows command and event callback latency and thread " +
+                  "pool usage, either for every plugin along with the " +
+                  "send queue, or for the commands, callbacks and thread " +
+                  "pool of a single plugin. (admin only)",
+
+                  "Syntax: .stats [plugin]"]
+
+    def profile(self, cardinal, user, channel, msg):
+        if not self.is_owner(user):
+            return
+
+        nick = user.group(1)
+
+        try:
+            duration = int(msg.split()[1])
+        except (IndexError, ValueError):
+            self.reply(cardinal, channel, "Syntax: .profile <seconds>")
+            return
+
+        if duration < 1 or duration > MAX_PROFILE_DURATION:
+            self.reply(cardinal, channel,
+                       "Profile duration must be between 1 and %d seconds." %
+                       MAX_PROFILE_DURATION)
+            return
+
+        if self.profiler is not None:
+            self.reply(cardinal, channel, "A profile is already running.")
+            return
+
+        if cardinal.storage_path is None:
+            self.reply(cardinal, channel, "No storage path is set.")
+            return
+
+        # Commands run on the reactor thread, so this profiles every reactor
+        # iteration until the profiler is disabled
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+        self.profile_call = reactor.callLater(
+            duration, self._finish_profile, cardinal, nick)
+
+        self.reply(cardinal, channel, "%s: Profiling for %d seconds..." %
+                                      (nick, duration))
+
+    profile.commands = ['profile']
+    profile.help = ["Profiles the bot for a number of seconds, saving the " +
+                    "results to the logs directory and sending a summary " +
+                    "of the slowest functions. (admin only)",
+
+                    "Syntax: .profile <seconds>"]
+
+    def _stop_profile(self):
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.disable()
+
+        if self.profile_call is not None and self.profile_call.active():
+            self.profile_call.cancel()
+
+        self.profiler = None
+        self.profile_call = None
+
+        return profiler
+
+    def _finish_profile(self, cardinal, nick):
+        profiler = self._stop_profile()
+
+        # The connection may have been replaced since the profile started, so
+        # reply on whichever one is current
+        cardinal = cardinal.factory.cardinal or cardinal
+
+        path = os.path.join(
+            cardinal.storage_path, 'logs',
+            'profile-%s.pstats' % time.strftime('%Y%m%d-%H%M%S'))
+        stats = pstats.Stats(profiler)
+
+        # The summary is still worth sending if the profile can't be saved
+        try:
+            profiler.dump_stats(path)
+        except (IOError, OSError), e:
+            self.logger.exception("Unable to save profile to %s", path)
+            self.reply(cardinal, nick,
+                       "Unable to save profile to %s: %s (%d calls in "
+                       "%.3fs)" % (path, e.strerror or e,
+                                   stats.total_calls, stats.total_tt))
+        else:
+            self.reply(cardinal, nick,
+                       "Profile saved to %s (%d calls in %.3fs)" %
+                       (path, stats.total_calls, stats.total_tt))
+
+        # Functions which spent the most time in their own code, ignoring the
+        # time the reactor spent idle waiting for I/O
+        slowest = sorted([item for item in stats.stats.items()
+                          if not self._is_idle(item[0])],
+                         key=lambda item: item[1][2],
+                         reverse=True)[:PROFILE_SUMMARY_SIZE]
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in slowest:
+            if filename != '~':
+                name = '%s:%d(%s)' % (os.path.basename(filename), line, name)
+
+            self.reply(cardinal, nick, "%s: %d calls, %.3fs own, %.3fs total" %
+                                       (name, calls, tottime, cumtime))
+
+    @staticmethod
+    def _is_idle(func):
+        filename, _, name = func
+        return filename == '~' and ('poll' in name or 'select' in name)
+
+    def close(self, cardinal):
+        # Don't leave a profiler running, or a pending summary firing into an
+        # unloaded plugin, if we're unloaded mid-profile
+        self._stop_profile()
+
     def join(self, cardinal, user, channel, msg):
         if self.is_owner(user):
             channels = msg.split()
@@ -4,6 +4,8 @@ import urllib
 import urllib2
 import logging
 
+from cardinal.decorators import cached
+
 MATHJS_API = "http://math.leftforliving.com"
 
 class CalculatorPlugin(object):
@@ -23,15 +25,14 @@ class CalculatorPlugin(object):
             return
 
         try:
-            c_request = {'question': question}
-            uh = urllib2.urlopen(MATHJS_API + "/query?" + urllib.urlencode(c_request))
+            body = self._query(question)
         except Exception, e:
             cardinal.sendMsg(channel, "Unable to reach evaluation server.")
             self.logger.exception("Unable to connect to evaluation server")
             return
 
         try:
-            response = json.load(uh)
+            response = json.loads(body)
         except Exception:
             cardinal.sendMsg(channel, "Error parsing API data.")
 
@@ -47,7 +48,16 @@ class CalculatorPlugin(object):
         except IndexError:
             cardinal.sendMsg(channel, "An error occurred while processing the calculation.")
 
+    # Units are case-sensitive (e.g. MB and mb), so only collapse whitespace
+    @cached(ttl=3600, key=lambda self, question: ' '.join(question.split()))
+    def _query(self, question):
+        c_request = {'question': question}
+        uh = urllib2.urlopen(MATHJS_API + "/query?" + urllib.urlencode(c_request))
+
+        return uh.read()
+
     calculate.commands = ['calc', 'c', 'calculate']
+    calculate.blocking = True
     calculate.help = ["Calculate using math.js API.",
                       "Syntax: .calc <query>"]
 
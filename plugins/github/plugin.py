@@ -4,6 +4,7 @@ import urllib
 import urllib2
 import logging
 
+from cardinal.decorators import cached
 from cardinal.exceptions import EventRejectedMessage
 
 REPO_URL_REGEX  = re.compile(r'https://(?:www\.)?github\..{2,4}/([^/]+)/([^/]+)', flags=re.IGNORECASE)
@@ -71,6 +72,7 @@ class GithubPlugin(object):
             cardinal.sendMsg(channel, "Couldn't find %s#%d" % (repo, int(query)))
 
     search.commands = ['issue']
+    search.blocking = True
     search.help = ["Find a Github repo or issue (or combination thereof)",
                    "Syntax: .issue [username/repository] <id or search query>"]
 
@@ -124,6 +126,10 @@ class GithubPlugin(object):
         except urllib2.HTTPError:
             raise EventRejectedMessage
 
+    _get_repo_info.blocking = True
+
+    @cached(ttl=300, key=lambda self, endpoint, params={}:
+            (endpoint, tuple(sorted(params.items()))))
     def _form_request(self, endpoint, params={}):
         # Make request to specified endpoint and return JSON decoded result
         uh = urllib2.urlopen("https://api.github.com/" +
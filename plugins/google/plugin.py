@@ -6,7 +6,7 @@ MAX_RESULTS = 3
 
 
 class GoogleSearch(object):
-    @command(['google', 'lmgtfy', 'g'])
+    @command(['google', 'lmgtfy', 'g'], blocking=True)
     @help("Returns the URL of the top result for a given search query")
     @help("Syntax: .google <query>")
     def query(self, cardinal, user, channel, msg):
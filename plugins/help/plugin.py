@@ -92,10 +92,8 @@ class HelpPlugin(object):
         else:
             command = parameters[1]
             help = self._get_command_help(cardinal, command)
-            if isinstance(help, list):
-                for help_line in help:
-                    cardinal.sendMsg(channel, help_line)
-            elif isinstance(help, basestring):
+            # Lists of help lines are packed into as few messages as possible
+            if isinstance(help, (list, basestring)):
                 cardinal.sendMsg(channel, help)
             else:
                 cardinal.sendMsg(channel, "Unable to handle help string returned by module.")
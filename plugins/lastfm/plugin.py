@@ -1,6 +1,7 @@
 import os
 import sqlite3
 import json
+import threading
 import urllib2
 import logging
 
@@ -12,6 +13,9 @@ class LastfmPlugin(object):
     conn = None
     """Connection to SQLite database"""
 
+    db_lock = None
+    """Serializes use of the database connection between threads"""
+
     api_key = None
     """Last.fm API key"""
 
@@ -19,6 +23,10 @@ class LastfmPlugin(object):
         # Initialize logger
         self.logger = logging.getLogger(__name__)
 
+        # Last.fm lookups run in a thread pool while .setlastfm runs in the
+        # reactor thread, so the connection is shared and must be locked
+        self.db_lock = threading.Lock()
+
         # Connect to or create the database
         self._connect_or_create_db(cardinal)
 
@@ -31,8 +39,8 @@ class LastfmPlugin(object):
             self.conn = sqlite3.connect(os.path.join(
                 cardinal.storage_path,
                 'database',
-                'lastfm-%s.db' % cardinal.network
-            ))
+                'lastfm-%s.db' % cardinal.network_name
+            ), check_same_thread=False)
         except Exception:
             self.logger.exception("Unable to access local Last.fm database")
             return
@@ -71,23 +79,25 @@ class LastfmPlugin(object):
         vhost = user.group(3)
         username = message[1]
 
-        c = self.conn.cursor()
-        c.execute(
-            "SELECT username FROM users WHERE nick=? OR vhost=?",
-            (nick, vhost)
-        )
-        result = c.fetchone()
-        if result:
+        with self.db_lock:
+            c = self.conn.cursor()
             c.execute(
-                "UPDATE users SET username=? WHERE nick=? OR vhost=?",
-                (username, nick, vhost)
-            )
-        else:
-            c.execute(
-                "INSERT INTO users (nick, vhost, username) VALUES(?, ?, ?)",
-                (nick, vhost, username)
+                "SELECT username FROM users WHERE nick=? OR vhost=?",
+                (nick, vhost)
             )
-        self.conn.commit()
+            result = c.fetchone()
+            if result:
+                c.execute(
+                    "UPDATE users SET username=? WHERE nick=? OR vhost=?",
+                    (username, nick, vhost)
+                )
+            else:
+                c.execute(
+                    "INSERT INTO users (nick, vhost, username) "
+                    "VALUES(?, ?, ?)",
+                    (nick, vhost, username)
+                )
+            self.conn.commit()
 
         cardinal.sendMsg(
             channel,
@@ -120,27 +130,28 @@ class LastfmPlugin(object):
             )
             return
 
-        # Open the cursor for the query to find a saved Last.fm username
-        c = self.conn.cursor()
-
         message = msg.split()
 
         # If using natural syntax, remove Cardinal's name
         if message[0] != '.np' and message[0] != '.nowplaying':
             message.pop(0)
 
-        # If they supplied user parameter, use that for the query instead
-        if len(message) >= 2:
-            nick = message[1]
-            c.execute("SELECT username FROM users WHERE nick=?", (nick,))
-        else:
-            nick = user.group(1)
-            vhost = user.group(3)
-            c.execute(
-                "SELECT username FROM users WHERE nick=? OR vhost=?",
-                (nick, vhost)
-            )
-        result = c.fetchone()
+        with self.db_lock:
+            # Open the cursor for the query to find a saved Last.fm username
+            c = self.conn.cursor()
+
+            # If they supplied user parameter, use that for the query instead
+            if len(message) >= 2:
+                nick = message[1]
+                c.execute("SELECT username FROM users WHERE nick=?", (nick,))
+            else:
+                nick = user.group(1)
+                vhost = user.group(3)
+                c.execute(
+                    "SELECT username FROM users WHERE nick=? OR vhost=?",
+                    (nick, vhost)
+                )
+            result = c.fetchone()
 
         # Use the returned username, or the entered/user's nick otherwise
         if not result:
@@ -197,6 +208,7 @@ class LastfmPlugin(object):
             )
 
     now_playing.commands = ['np', 'nowplaying']
+    now_playing.blocking = True
     now_playing.help = ["Get the Last.fm track currently played by a user "
                         "(defaults to username set with .setlastfm)",
                         "Syntax: .np [username]"]
@@ -224,9 +236,6 @@ class LastfmPlugin(object):
             )
             return
 
-        # Open the cursor for the query to find a saved Last.fm username
-        c = self.conn.cursor()
-
         # If they supplied user parameter, use that for the query instead
         message = msg.split()
 
@@ -236,26 +245,30 @@ class LastfmPlugin(object):
         if len(message) < 2:
             cardinal.sendMsg(channel, "Syntax: .compare <username> [username]")
 
-        nick = message[1]
-        c.execute("SELECT username FROM users WHERE nick=?", (nick,))
-        result = c.fetchone()
+        with self.db_lock:
+            # Open the cursor for the query to find a saved Last.fm username
+            c = self.conn.cursor()
 
-        if not result:
-            username1 = nick
-        else:
-            username1 = result[0]
-
-        if len(message) >= 3:
-            nick = message[2]
+            nick = message[1]
             c.execute("SELECT username FROM users WHERE nick=?", (nick,))
-        else:
-            nick = user.group(1)
-            vhost = user.group(3)
-            c.execute(
-                "SELECT username FROM users WHERE nick=? OR vhost=?",
-                (nick, vhost)
-            )
-        result = c.fetchone()
+            result = c.fetchone()
+
+            if not result:
+                username1 = nick
+            else:
+                username1 = result[0]
+
+            if len(message) >= 3:
+                nick = message[2]
+                c.execute("SELECT username FROM users WHERE nick=?", (nick,))
+            else:
+                nick = user.group(1)
+                vhost = user.group(3)
+                c.execute(
+                    "SELECT username FROM users WHERE nick=? OR vhost=?",
+                    (nick, vhost)
+                )
+            result = c.fetchone()
 
         # Use the returned username, or the entered/user's nick otherwise
         if not result:
@@ -326,13 +339,15 @@ class LastfmPlugin(object):
             self.logger.exception("An unknown error occurred comparing users")
 
     compare.commands = ['compare']
+    compare.blocking = True
     compare.help = ["Uses Last.fm to compare the compatibility of music "
                     "between two users.",
                     "Syntax: .compare <username> [username]"]
 
     def close(self):
         if self.conn:
-            self.conn.close()
+            with self.db_lock:
+                self.conn.close()
 
 
 def setup(cardinal, config):
@@ -32,7 +32,7 @@ class NotesPlugin(object):
             self.conn = sqlite3.connect(os.path.join(
                 cardinal.storage_path,
                 'database',
-                'notes-%s.db' % cardinal.network
+                'notes-%s.db' % cardinal.network_name
             ))
         except Exception:
             self.conn = None
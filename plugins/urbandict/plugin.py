@@ -1,6 +1,8 @@
 from urllib import urlopen
 import json
 
+from cardinal.decorators import cached
+
 URBANDICT_API_PREFIX = 'http://api.urbandictionary.com/v0/define?term='
 
 
@@ -13,12 +15,7 @@ class UrbanDictPlugin(object):
             return
 
         try:
-            url = URBANDICT_API_PREFIX + word
-            f = urlopen(url).read()
-            data = json.loads(f)
-
-            word_def = data['list'][0]['definition']
-            link = data['list'][0]['permalink']
+            word_def, link = self._get_definition(word)
 
             response = 'UD for %s: %s (%s)' % (word, word_def, link)
 
@@ -26,7 +23,16 @@ class UrbanDictPlugin(object):
         except Exception:
             cardinal.sendMsg(channel, "Could not retrieve definition for %s" % word)
 
+    @cached(ttl=3600)
+    def _get_definition(self, word):
+        url = URBANDICT_API_PREFIX + word
+        f = urlopen(url).read()
+        data = json.loads(f)
+
+        return data['list'][0]['definition'], data['list'][0]['permalink']
+
     get_ud.commands = ['ud']
+    get_ud.blocking = True
     get_ud.help = ['Returns the top Urban Dictionary definition for a given word.',
                    'Syntax: .ud <word>']
 
@@ -5,6 +5,7 @@ import urllib2
 import socket
 import HTMLParser
 import logging
+import threading
 
 from datetime import datetime
 
@@ -35,6 +36,10 @@ class URLsPlugin(object):
         # Initialize logger
         self.logger = logging.getLogger(__name__)
 
+        # get_title runs in several threads at once, so the cooloff must be
+        # checked and updated atomically
+        self.cooloff_lock = threading.Lock()
+
         # Only check config if it exists
         if config is None:
             return
@@ -48,7 +53,10 @@ class URLsPlugin(object):
         if 'lookup_cooloff' in config:
             self.lookup_cooloff = config['lookup_cooloff']
 
-        cardinal.event_manager.register('urls.detection', 2)
+        # Only one plugin should respond to a URL
+        cardinal.event_manager.register('urls.detection', 2,
+                                        first_acceptor=True,
+                                        params=('channel', 'url'))
 
     def get_title(self, cardinal, user, channel, msg):
         # Find every URL within the message
@@ -59,12 +67,13 @@ class URLsPlugin(object):
             if url[:7].lower() != "http://" and url[:8].lower() != "https://":
                 url = "http://" + url
 
-            if (url == self.last_url and self.last_url_at and
-                (datetime.now() - self.last_url_at).seconds < self.lookup_cooloff):
-                return
+            with self.cooloff_lock:
+                if (url == self.last_url and self.last_url_at and
+                    (datetime.now() - self.last_url_at).seconds < self.lookup_cooloff):
+                    return
 
-            self.last_url = url
-            self.last_url_at = datetime.now()
+                self.last_url = url
+                self.last_url_at = datetime.now()
 
             # Check if another plugin has hooked into this URL and wants to
             # provide information itself
@@ -106,6 +115,7 @@ class URLsPlugin(object):
                     continue
 
     get_title.regex = URL_REGEX
+    get_title.blocking = True
 
     def close(self, cardinal):
         cardinal.event_manager.remove('urls.detection')
@@ -4,6 +4,7 @@ import logging
 
 from bs4 import BeautifulSoup
 
+from cardinal.decorators import cached
 from cardinal.exceptions import EventRejectedMessage
 
 ARTICLE_URL_REGEX = "https?:\/\/(?:\w{2}\.)?wikipedia\..{2,4}\/wiki\/(.+)"
@@ -35,33 +36,33 @@ class WikipediaPlugin(object):
         self._callback_id = cardinal.event_manager.register_callback(
             'urls.detection', self.url_callback)
 
+    # Article titles are case-sensitive, so key on the exact URL
+    @cached(ttl=600, key=lambda self, url: url)
+    def _fetch_article(self, url):
+        uh = urllib2.urlopen(url.encode('UTF-8'))
+        soup = BeautifulSoup(uh)
+
+        # Title of the Wikipedia page
+        title = soup.find("h1").get_text()
+
+        # Manipulation to get first paragraph without HTML markup
+        content = soup.find_all("div", id="mw-content-text")[0]
+        first_paragraph = content.p.get_text()
+
+        return title, first_paragraph
+
     def _get_article_info(self, name):
         name = name.replace(' ', '_')
         url = "https://%s.wikipedia.org/wiki/%s" % (self._language_code, name.decode('UTF-8'))
 
         try:
-            uh = urllib2.urlopen(url.encode('UTF-8'))
-            soup = BeautifulSoup(uh)
-        except Exception, e:
+            title, first_paragraph = self._fetch_article(url)
+        except IOError, e:
             self.logger.warning(
                 "Couldn't query Wikipedia (404?) for: %s" % name, exc_info=True
             )
 
             return "Unable to find Wikipedia page for: %s" % name
-
-        try:
-            # Title of the Wikipedia page
-            title = soup.find("h1").get_text()
-
-            # Manipulation to get first paragraph without HTML markup
-            content = soup.find_all("div", id="mw-content-text")[0]
-            first_paragraph = content.p.get_text()
-
-            if len(first_paragraph) > self._max_description_length:
-                first_paragraph = first_paragraph[:self._max_description_length] + \
-                    '...'
-            else:
-                first_paragraph = first_paragraph
         except Exception, e:
             self.logger.error(
                 "Error parsing Wikipedia result for: %s" % name,
@@ -70,6 +71,10 @@ class WikipediaPlugin(object):
 
             return "Error parsing Wikipedia result for: %s" % name
 
+        if len(first_paragraph) > self._max_description_length:
+            first_paragraph = first_paragraph[:self._max_description_length] + \
+                '...'
+
         return ("[ Wikipedia: %s | %s | %s ]" % (title, first_paragraph, url)).encode('utf-8')
 
     def url_callback(self, cardinal, channel, url):
@@ -80,6 +85,8 @@ class WikipediaPlugin(object):
         article_info = self._get_article_info(match.group(1))
         cardinal.sendMsg(channel, article_info)
 
+    url_callback.blocking = True
+
     def lookup_article(self, cardinal, user, channel, message):
         name = message.split(' ', 1)[1]
 
@@ -87,6 +94,7 @@ class WikipediaPlugin(object):
         cardinal.sendMsg(channel, article_info)
 
     lookup_article.commands = ['wiki', 'wikipedia']
+    lookup_article.blocking = True
     lookup_article.help = ["Gets a summary and link to a Wikipedia page",
                            "Syntax: .wiki <article>"]
 
@@ -4,6 +4,7 @@ import urllib
 import urllib2
 import logging
 
+from cardinal.decorators import cached
 from cardinal.exceptions import EventRejectedMessage
 
 VIDEO_URL_REGEX = re.compile(r'https?:\/\/(?:www\.)?youtube\..{2,4}\/watch\?.*(?:v=(.+?))(?:(?:&.*)|$)', flags=re.IGNORECASE)
@@ -88,6 +89,7 @@ class YouTubePlugin(object):
             raise EventRejectedMessage
 
     search.commands = ['youtube', 'yt']
+    search.blocking = True
     search.help = ["Get the first YouTube result for a given search.",
                    "Syntax: .youtube <search query>"]
 
@@ -114,6 +116,11 @@ class YouTubePlugin(object):
             self.logger.exception("Failed to parse info for %s'" % video_id)
             raise EventRejectedMessage
 
+    _get_video_info.blocking = True
+
+    # Video IDs are case-sensitive, so don't normalize the params
+    @cached(ttl=300, key=lambda self, endpoint, params:
+            (endpoint, tuple(sorted(params.items()))))
     def _form_request(self, endpoint, params):
         # Add API key to all requests
         params['key'] = self.api_key